@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import optimization as opt
+import metrics as met
+
+# =============================================================================
+# EXECUÇÃO EM LOTE (SEM INTERFACE) DE VÁRIAS INSTÂNCIAS
+# =============================================================================
+
+def load_manifest(manifest_file):
+    """
+    Lê o manifesto JSON do lote. O arquivo pode ser uma lista de instâncias ou um objeto
+    no formato:
+
+        {
+            "defaults": {"shift_mode": "days_shifts", "decayType": "sigmoid"},
+            "instances": [
+                {"tutors": "I0/tutores.csv", "schools": "I0/escolas.csv",
+                 "distances": "distancias.csv", "params": {"Instancia_ID": "I0"}}
+            ]
+        }
+
+    'distances' é opcional (padrão 'distancias.csv') e os parâmetros de cada instância
+    são combinados com 'defaults' e com 'optimization.DEFAULT_PARAMS'. Caminhos relativos
+    são resolvidos a partir da pasta do manifesto. Sem 'Instancia_ID', a instância recebe
+    'I<posição>'.
+    """
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if isinstance(manifest, list):
+        manifest = {"instances": manifest}
+    defaults = manifest.get("defaults", {})
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    def resolve(path):
+        return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+    instances = []
+    for index, entry in enumerate(manifest.get("instances", [])):
+        try:
+            # Os relatórios registram os parâmetros efetivos, então os padrões são explicitados
+            params = {**opt.DEFAULT_PARAMS, **defaults, **entry.get("params", {})}
+            params.setdefault("Instancia_ID", f"I{index}")
+            instances.append({
+                "tutors": resolve(entry["tutors"]),
+                "schools": resolve(entry["schools"]),
+                "distances": resolve(entry.get("distances", "distancias.csv")),
+                "params": params
+            })
+        except KeyError as e:
+            raise ValueError(f"Instância {index} do manifesto sem o campo obrigatório {e}.")
+
+    instance_ids = [instance["params"]["Instancia_ID"] for instance in instances]
+    duplicated = sorted({i for i in instance_ids if instance_ids.count(i) > 1})
+    if duplicated:
+        raise ValueError(f"Instancia_ID repetido no manifesto: {', '.join(map(str, duplicated))}")
+
+    return instances
+
+def _run_instance(task):
+    """Otimiza uma instância e gera a sua pasta de relatórios (executado nos processos do lote)."""
+    instance, base_path = task
+    params = instance["params"]
+    start_time = time.perf_counter()
+
+    try:
+        result = opt.generate_allocation(instance["tutors"], instance["schools"], instance["distances"], params)
+        output_path, history_row = met.write_instance_reports(result, params, base_path)
+    except Exception as e:
+        return {
+            "instance_id": params["Instancia_ID"],
+            "ok": False,
+            "error": str(e),
+            "elapsed_time": time.perf_counter() - start_time
+        }
+
+    stats = result["stats"]
+    return {
+        "instance_id": params["Instancia_ID"],
+        "ok": True,
+        "output_path": output_path,
+        "history_row": history_row,
+        "solver_status": stats.get("solver_status", "N/A"),
+        "filled_vacancies": stats.get("filled_vacancies", 0),
+        "total_vacancies": stats.get("total_vacancies", 0),
+        "elapsed_time": time.perf_counter() - start_time
+    }
+
+def run_batch(instances, base_path='alocacoes/', max_workers=None, on_result=None):
+    """
+    Executa todas as instâncias em um pool de processos.
+
+    Cada processo otimiza a instância e grava a sua pasta de relatórios; a linha do
+    histórico volta para o processo principal, que a grava no histórico de execuções
+    (banco SQLite, com 'merge_history_rows') assim que a instância termina. O CSV
+    do histórico não é regravado a cada instância: 'main' o exporta uma vez, ao final.
+    'on_result' é chamado a cada instância concluída. Retorna os resultados na ordem
+    do manifesto.
+    """
+    os.makedirs(base_path, exist_ok=True)
+    results = [None] * len(instances)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_run_instance, (instance, base_path)): index
+            for index, instance in enumerate(instances)
+        }
+        for future in as_completed(futures):
+            outcome = future.result()
+            if outcome["ok"]:
+                met.merge_history_rows(base_path, [outcome.pop("history_row")])
+            results[futures[future]] = outcome
+            if on_result:
+                on_result(outcome)
+
+    return results
+
+def _print_result(outcome):
+    if outcome["ok"]:
+        print(
+            f"[{outcome['instance_id']}] {outcome['solver_status']} - "
+            f"{outcome['filled_vacancies']}/{outcome['total_vacancies']} vagas preenchidas "
+            f"em {outcome['elapsed_time']:.1f} s -> {outcome['output_path']}"
+        )
+    else:
+        print(f"[{outcome['instance_id']}] ERRO: {outcome['error']}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Executa a alocação de várias instâncias em lote.")
+    parser.add_argument("manifest", help="Manifesto JSON com as instâncias (ver 'load_manifest')")
+    parser.add_argument("--output", default="alocacoes/", help="Pasta base dos relatórios e do histórico")
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrão: nº de CPUs)")
+    args = parser.parse_args()
+
+    instances = load_manifest(args.manifest)
+    start_time = time.perf_counter()
+    results = run_batch(instances, base_path=args.output, max_workers=args.workers, on_result=_print_result)
+
+    # O CSV do histórico é exportado uma única vez, ao final do lote
+    history_csv = met.export_history_csv(args.output)
+
+    failures = [r for r in results if not r["ok"]]
+    print(
+        f"\n{len(results) - len(failures)}/{len(results)} instâncias concluídas em "
+        f"{time.perf_counter() - start_time:.1f} s. Histórico: {history_csv}"
+    )
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
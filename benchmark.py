@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+import optimization as opt
+import metrics as met
+import synthetic
+
+try:
+    import resource
+except ImportError:    # Windows: sem medição do pico de memória do processo
+    resource = None
+
+# =============================================================================
+# BENCHMARK DO MODO MULTI-THREAD DO CBC
+# =============================================================================
+
+def _allocation_hash(df_allocation):
+    """Impressão digital da alocação, para conferir se todas as execuções são idênticas."""
+    csv_bytes = df_allocation.to_csv(index=False).encode('utf-8')
+    return hashlib.sha256(csv_bytes).hexdigest()[:12]
+
+def benchmark_threads(tutors_file, schools_file, distances_file, params, thread_counts, repeat=3):
+    """
+    Executa 'generate_allocation' com cada quantidade de threads 'repeat' vezes e mede o
+    tempo total e o tempo do CBC. A primeira quantidade da lista é a referência do speedup.
+    Todas as execuções são canonicalizadas (inclusive a de 1 thread), de modo que as
+    alocações podem ser comparadas diretamente.
+
+    Retorna uma lista de dicionários (um por quantidade de threads) com os tempos médios,
+    o speedup e as impressões digitais distintas das alocações obtidas.
+    """
+    rows = []
+    for threads in thread_counts:
+        run_params = {**params, 'threads': threads, 'canonicalize': True}
+        totals, mip_times, hashes = [], [], set()
+
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            result = opt.generate_allocation(tutors_file, schools_file, distances_file, run_params)
+            totals.append(time.perf_counter() - start_time)
+            mip_times.append(result['stats'].get('mip_time', 0.0))
+            hashes.add(_allocation_hash(result['dataframe']))
+
+        rows.append({
+            "threads": threads,
+            "total_time": sum(totals) / repeat,
+            "mip_time": sum(mip_times) / repeat,
+            "allocations": sorted(hashes)
+        })
+
+    reference = rows[0]['mip_time'] if rows else 0
+    for row in rows:
+        row['speedup'] = reference / row['mip_time'] if row['mip_time'] > 0 else float('nan')
+
+    return rows
+
+# =============================================================================
+# BENCHMARK DE ESCALA POR ETAPA (INSTÂNCIAS SINTÉTICAS)
+# =============================================================================
+
+STAGES = ('parse', 'benefits', 'build', 'solve', 'extract', 'metrics')
+
+def _max_rss_mb():
+    """Pico de memória residente do processo (inclui o CBC, que o tracemalloc não enxerga)."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if platform.system() == 'Darwin' else max_rss / 2**10
+
+def profile_stages(tutors_file, schools_file, distances_file, params, track_memory=False):
+    """
+    Executa o caminho de 'generate_allocation' (objetivo ponderado, sem decomposição)
+    etapa por etapa, medindo o tempo de cada uma:
+
+    - parse: leitura dos CSVs e da matriz de distâncias ('AllocationSession')
+    - benefits: matriz de benefícios (e poda de candidatos, se 'prune_k' for informado)
+    - build: construção do modelo do CBC (apenas no motor 'mip')
+    - solve: resolução pelo motor selecionado
+    - extract: montagem do DataFrame da alocação
+    - metrics: métricas do Streamlit e relatório detalhado
+
+    Com 'track_memory', também registra o pico de memória alocada pelo Python em cada
+    etapa (tracemalloc, que deixa a execução mais lenta; os tempos dessa execução não
+    devem ser comparados aos de uma execução sem medição).
+    """
+    params = {**opt.DEFAULT_PARAMS, **params}
+    if params['objective_mode'] != 'weighted' or params['decompose']:
+        raise ValueError("O perfil por etapa cobre apenas o objetivo 'weighted' sem decomposição.")
+
+    engine = params['solver_engine']
+    times, peaks = {}, {}
+
+    @contextmanager
+    def stage(name):
+        if track_memory:
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        yield
+        times[name] = time.perf_counter() - start_time
+        if track_memory:
+            peaks[name] = tracemalloc.get_traced_memory()[1] / 2**20
+
+    if track_memory:
+        tracemalloc.start()
+    try:
+        with stage('parse'):
+            session = opt.AllocationSession(tutors_file, schools_file, distances_file, params['shift_mode'])
+        tutors, time_slots, schools = session.tutors, session.time_slots, session.schools
+        availability, vacancies = session.availability, session.vacancies
+
+        with stage('benefits'):
+            benefit_matrix = opt.calculate_benefit_matrix(
+                tutors, schools, session.preferences, session.distances, session.rankings,
+                decay_type=params['decayType'], pref1=params['pref1'], pref2=params['pref2'],
+                pref3=params['pref3'], baseDistance=params['baseDistance'],
+                baseRanking=params['baseRanking'], sigmoidCurve=params['sigmoidCurve'],
+                distance_mean=session.distance_mean
+            )
+            candidate_mask = None
+            if params['prune_k'] is not None:
+                candidate_mask, _ = opt.prune_candidates(
+                    tutors, time_slots, schools, session.preferences, session.distances,
+                    availability, vacancies, benefit_matrix, k=params['prune_k']
+                )
+
+        solve_stats = {}
+        if engine == 'mip':
+            with stage('build'):
+                built = opt.build_allocation_model(
+                    tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                    candidate_mask=candidate_mask, threads=params['threads']
+                )
+            with stage('solve'):
+                results_list, solve_stats = opt.solve_mip(
+                    tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                    relax_lp=params['relax_lp'], candidate_mask=candidate_mask,
+                    time_limit=params['time_limit'], mip_gap=params['mip_gap'],
+                    threads=params['threads'], canonicalize=params['canonicalize'], built=built
+                )
+        else:
+            solver = opt.solve_flow if engine == 'flow' else opt.solve_greedy
+            extra = (session.rankings,) if engine == 'greedy' else ()
+            with stage('solve'):
+                results_list, solve_stats = solver(
+                    tutors, time_slots, schools, availability, vacancies, benefit_matrix, *extra,
+                    candidate_mask=candidate_mask
+                )
+
+        with stage('extract'):
+            if results_list:
+                df_allocation = pd.DataFrame(results_list)
+            else:
+                df_allocation = pd.DataFrame(columns=['Escola', 'Turno da Vaga', 'Tutor Alocado'])
+
+        with stage('metrics'):
+            kpis = met.AllocationKPIs(df_allocation, session.raw_data)
+            met.get_summary_metrics(df_allocation, session.raw_data, kpis=kpis)
+            met._generate_detailed_report(df_allocation, session.raw_data, params, kpis=kpis)
+    finally:
+        if track_memory:
+            tracemalloc.stop()
+
+    return {
+        "stages": times,
+        "peak_memory_mb": peaks,
+        "max_rss_mb": _max_rss_mb(),
+        "total_tutors": session.total_tutors,
+        "total_schools": session.total_schools,
+        "total_vacancies": session.total_vacancies,
+        "filled_vacancies": len(results_list),
+        "num_variables": solve_stats.get("num_variables"),
+        "solver_status": solve_stats.get("solver_status", "OPTIMAL"),
+        "objective_value": solve_stats.get("objective_value")
+    }
+
+def benchmark_scaling(sizes, params=None, repeat=1, track_memory=True, seed=0, **generator_kwargs):
+    """
+    Gera uma instância sintética para cada (tutores, escolas) em 'sizes' (ver
+    'synthetic.generate_instance') e mede as etapas com 'profile_stages'.
+
+    O tempo de cada etapa é o menor entre 'repeat' execuções; com 'track_memory', uma
+    execução extra mede o pico de memória por etapa.
+    """
+    params = dict(params or {})
+    shift_mode = params.get('shift_mode', opt.DEFAULT_PARAMS['shift_mode'])
+    rows = []
+
+    for n_tutors, n_schools in sizes:
+        files = synthetic.generate_instance(n_tutors, n_schools, shift_mode=shift_mode, seed=seed,
+                                            **generator_kwargs)
+
+        runs = [profile_stages(*(io.BytesIO(content) for content in files), params) for _ in range(repeat)]
+        row = {
+            "n_tutors": n_tutors,
+            "n_schools": n_schools,
+            **{key: value for key, value in runs[0].items() if key not in ("stages", "peak_memory_mb")},
+            "stages": {name: min(run["stages"][name] for run in runs) for name in runs[0]["stages"]}
+        }
+        row["total_time"] = sum(row["stages"].values())
+
+        if track_memory:
+            memory_run = profile_stages(*(io.BytesIO(content) for content in files), params, track_memory=True)
+            row["peak_memory_mb"] = memory_run["peak_memory_mb"]
+            row["max_rss_mb"] = memory_run["max_rss_mb"]
+
+        rows.append(row)
+
+    return rows
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_report(rows, path, params=None, generator_kwargs=None):
+    """Grava os resultados em JSON, com a versão do código e do ambiente para comparação futura."""
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params or {},
+        "generator": generator_kwargs or {},
+        "results": rows
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+def compare_reports(baseline, current, tolerance=0.2, min_seconds=0.05):
+    """
+    Compara dois relatórios de 'save_report' (dicionários) e retorna as etapas que ficaram
+    mais de 'tolerance' (20%) mais lentas, como (tutores, escolas, etapa, antes, depois).
+    Diferenças abaixo de 'min_seconds' são ignoradas, pois etapas muito curtas oscilam.
+    """
+    previous = {(r["n_tutors"], r["n_schools"]): r for r in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        old = previous.get((row["n_tutors"], row["n_schools"]))
+        if old is None:
+            continue
+        for name, seconds in row["stages"].items():
+            before = old["stages"].get(name)
+            if before and seconds > before * (1 + tolerance) and seconds - before > min_seconds:
+                regressions.append((row["n_tutors"], row["n_schools"], name, before, seconds))
+    return regressions
+
+def _parse_size(text):
+    try:
+        n_tutors, n_schools = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Tamanho inválido '{text}'. Use TUTORESxESCOLAS, ex: 1000x200.")
+    return n_tutors, n_schools
+
+def _main_threads(args):
+    params = {"shift_mode": args.shift_mode}
+    rows = benchmark_threads(args.tutors_file, args.schools_file, args.distances, params,
+                             args.threads, repeat=args.repeat)
+
+    print(f"{'Threads':>7} | {'Total (s)':>9} | {'CBC (s)':>8} | {'Speedup':>7} | Alocações")
+    for row in rows:
+        print(
+            f"{row['threads']:>7} | {row['total_time']:>9.2f} | {row['mip_time']:>8.2f} | "
+            f"{row['speedup']:>6.2f}x | {', '.join(row['allocations'])}"
+        )
+
+    distinct = {h for row in rows for h in row['allocations']}
+    if len(distinct) == 1:
+        print("\nTodas as execuções produziram a mesma alocação.")
+    else:
+        print(f"\nATENÇÃO: {len(distinct)} alocações distintas foram produzidas.")
+
+def _main_scaling(args):
+    params = {"shift_mode": args.shift_mode, "solver_engine": args.engine,
+              "prune_k": args.prune_k, "time_limit": args.time_limit}
+    generator_kwargs = {"availability_density": args.density,
+                        "preference_concentration": args.concentration}
+    rows = benchmark_scaling(args.sizes, params, repeat=args.repeat, track_memory=not args.no_memory,
+                             seed=args.seed, **generator_kwargs)
+
+    header = " | ".join(f"{name:>8}" for name in STAGES)
+    print(f"{'Tamanho':>12} | {header} | {'Total':>8} | {'Mem. (MB)':>9}")
+    for row in rows:
+        stages = " | ".join(
+            f"{row['stages'][name]:>8.2f}" if name in row['stages'] else f"{'-':>8}" for name in STAGES
+        )
+        peak = max(row.get("peak_memory_mb", {}).values(), default=None)
+        peak_str = f"{peak:>9.1f}" if peak is not None else f"{'-':>9}"
+        print(f"{row['n_tutors']:>6}x{row['n_schools']:<5} | {stages} | {row['total_time']:>8.2f} | {peak_str}")
+
+    if args.output:
+        report = save_report(rows, args.output, params, generator_kwargs)
+        print(f"\nResultados gravados em {args.output}")
+    else:
+        report = {"results": rows}
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report)
+        if not regressions:
+            print("Nenhuma regressão de desempenho em relação à referência.")
+        for n_tutors, n_schools, name, before, after in regressions:
+            print(f"REGRESSÃO {n_tutors}x{n_schools} [{name}]: {before:.2f} s -> {after:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks da otimização.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    threads = subparsers.add_parser("threads", help="Mede o speedup do CBC com múltiplas threads.")
+    threads.add_argument("tutors_file", help="CSV dos tutores")
+    threads.add_argument("schools_file", help="CSV das escolas")
+    threads.add_argument("--distances", default="distancias.csv", help="CSV da matriz de distâncias")
+    threads.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    threads.add_argument("--repeat", type=int, default=3)
+    threads.add_argument("--shift-mode", default="days_shifts", choices=["days_shifts", "shifts"])
+
+    scaling = subparsers.add_parser("scaling", help="Mede cada etapa em instâncias sintéticas de vários tamanhos.")
+    scaling.add_argument("--sizes", type=_parse_size, nargs="+", default=[(100, 50), (500, 100), (1000, 200)],
+                         help="Tamanhos no formato TUTORESxESCOLAS")
+    scaling.add_argument("--repeat", type=int, default=1)
+    scaling.add_argument("--engine", default="mip", choices=["mip", "flow", "greedy"])
+    scaling.add_argument("--prune-k", type=int, default=None)
+    scaling.add_argument("--time-limit", type=float, default=None)
+    scaling.add_argument("--density", type=float, default=0.3, help="Chance de disponibilidade por turno")
+    scaling.add_argument("--concentration", type=float, default=1.0, help="Concentração das preferências")
+    scaling.add_argument("--seed", type=int, default=0)
+    scaling.add_argument("--shift-mode", default="days_shifts", choices=["days_shifts", "shifts"])
+    scaling.add_argument("--no-memory", action="store_true", help="Não mede o pico de memória")
+    scaling.add_argument("--output", help="Arquivo JSON para gravar os resultados")
+    scaling.add_argument("--baseline", help="JSON de uma execução anterior para detectar regressões")
+
+    args = parser.parse_args()
+    if args.command == "threads":
+        _main_threads(args)
+    else:
+        _main_scaling(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import zlib
+from collections import OrderedDict
+import optimization as opt
+import dataset as ds
+
+# =============================================================================
+# CACHE DE RESULTADOS DA OTIMIZAÇÃO
+# =============================================================================
+
+# Incrementar sempre que o formato do resultado ou o modelo mudar, invalidando o cache antigo
+CACHE_VERSION = 1
+
+# Parâmetros que não alteram a alocação (apenas como ela é calculada ou registrada)
+_IGNORED_PARAMS = {'max_workers', 'profile_memory'}
+
+def normalize_params(params_dict):
+    """
+    Normaliza o dicionário de parâmetros para a chave do cache: completa com os valores
+    padrão de 'optimization.DEFAULT_PARAMS', descarta chaves que não afetam o resultado
+    e representa números inteiros sempre da mesma forma (8000 e 8000.0 geram a mesma chave).
+    """
+    params = {**opt.DEFAULT_PARAMS, **params_dict}
+
+    normalized = {}
+    for key in sorted(opt.DEFAULT_PARAMS):
+        if key in _IGNORED_PARAMS:
+            continue
+        value = params[key]
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        normalized[key] = value
+    return normalized
+
+def make_cache_key(tutors_file, schools_file, distances_file, params_dict):
+    """Chave SHA-256 do conteúdo dos três arquivos e dos parâmetros normalizados."""
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}".encode('utf-8'))
+    for file_input in (tutors_file, schools_file, distances_file):
+        digest.update(hashlib.sha256(ds.file_bytes(file_input)).digest())
+    digest.update(json.dumps(normalize_params(params_dict), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def is_cacheable(result):
+    """
+    Indica se o resultado pode ir para o cache: apenas soluções ótimas (dentro do
+    'mip_gap', que faz parte da chave) ou da heurística gulosa, que é determinística.
+    Resultados interrompidos pelo limite de tempo ('FEASIBLE', inclusive a solução
+    inicial devolvida quando o solver não encontra outra) dependem da máquina e da carga
+    e não podem ser reaproveitados como se fossem a resposta definitiva.
+    """
+    stats = result['stats']
+    if stats.get('solver_engine') == 'greedy':
+        return True
+    return stats.get('solver_status') == 'OPTIMAL'
+
+class ResultCache:
+    """
+    Cache de resultados de 'generate_allocation' em dois níveis:
+
+    - Memória: LRU com no máximo 'memory_items' resultados
+    - Disco: um arquivo por chave em 'cache_dir', removendo os menos usados quando o
+      total passa de 'max_disk_bytes'
+
+    Os resultados (DataFrame, estatísticas e raw_data) são guardados serializados com
+    pickle e comprimidos com zlib; cada leitura devolve uma cópia independente.
+    """
+
+    def __init__(self, cache_dir=os.path.join('.cache', 'alocacoes'), memory_items=16,
+                 max_disk_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl.z")
+
+    def get(self, key):
+        """Retorna o resultado armazenado para a chave, ou None se não houver."""
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                tier = 'memory'
+
+        if blob is None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    blob = f.read()
+                os.utime(path)    # Marca o uso recente para a política de remoção
+            except OSError:
+                return None
+            self._remember(key, blob)
+            tier = 'disk'
+
+        try:
+            result = pickle.loads(zlib.decompress(blob))
+        except Exception:
+            # Arquivo corrompido ou de outra versão: descarta e recalcula
+            self.discard(key)
+            return None
+
+        result['stats']['cache_hit'] = tier
+        return result
+
+    def put(self, key, result):
+        """Armazena o resultado nos dois níveis do cache."""
+        blob = zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        self._remember(key, blob)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, path)    # Escrita atômica: leitores nunca veem arquivo parcial
+
+        self._evict_disk()
+
+    def discard(self, key):
+        """Remove a chave dos dois níveis do cache."""
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Esvazia o cache em memória e em disco."""
+        with self._lock:
+            self._memory.clear()
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.pkl.z'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _remember(self, key, blob):
+        with self._lock:
+            self._memory[key] = blob
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """Remove os arquivos usados há mais tempo até o total caber em 'max_disk_bytes'."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pkl.z'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+def cached_generate_allocation(tutors_file, schools_file, distances_file, params_dict, cache,
+                               progress_callback=None):
+    """
+    Versão de 'generate_allocation' que consulta o cache antes de otimizar e armazena o
+    resultado depois (se 'is_cacheable'). Em caso de acerto, 'stats["cache_hit"]' indica
+    o nível ('memory' ou 'disk').
+    """
+    key = make_cache_key(tutors_file, schools_file, distances_file, params_dict)
+    result = cache.get(key)
+    if result is None:
+        result = opt.generate_allocation(
+            tutors_file, schools_file, distances_file, params_dict, progress_callback=progress_callback
+        )
+        if is_cacheable(result):
+            cache.put(key, result)
+    return result
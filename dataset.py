@@ -0,0 +1,189 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+import optimization as opt
+
+# =============================================================================
+# CAMADA DE DADOS COMPARTILHADA (LEITURA ÚNICA POR ARQUIVO)
+# =============================================================================
+
+# Quantos arquivos distintos de cada tipo ficam em memória
+_MAX_CACHED_FILES = 8
+
+@dataclass(frozen=True)
+class TutorData:
+    """Conteúdo já interpretado de um arquivo de tutores (ver 'read_tutors')."""
+    tutors: list
+    availability: dict
+    preferences: dict
+    rankings: dict
+    tutor_districts: dict
+    total_tutors: int
+
+@dataclass(frozen=True)
+class SchoolData:
+    """Conteúdo já interpretado de um arquivo de escolas (ver 'read_schools')."""
+    schools: list
+    vacancies: dict
+    school_districts: dict
+    total_schools: int
+    total_vacancies: int
+
+@dataclass(frozen=True)
+class Dataset:
+    """
+    Instância completa (tutores, escolas e distâncias) lida uma única vez e compartilhada
+    entre a pré-visualização, a otimização e os relatórios. É imutável: os campos não podem
+    ser reatribuídos e as coleções internas não devem ser modificadas por quem as recebe.
+    """
+    key: tuple
+    shift_mode: str
+    time_slots: list
+    tutors: list
+    availability: dict
+    preferences: dict
+    rankings: dict
+    tutor_districts: dict
+    total_tutors: int
+    schools: list
+    vacancies: dict
+    school_districts: dict
+    total_schools: int
+    total_vacancies: int
+    distances: opt.DistanceMatrix
+
+    @property
+    def raw_data(self):
+        """Dados puros no mesmo formato do 'raw_data' de 'generate_allocation'."""
+        return {
+            "tutors": self.tutors,
+            "schools": self.schools,
+            "time_slots": self.time_slots,
+            "vacancies": self.vacancies,
+            "rankings": self.rankings,
+            "preferences": self.preferences,
+            "availability": self.availability,
+            "distances": self.distances,
+            "tutor_districts": self.tutor_districts,
+            "school_districts": self.school_districts
+        }
+
+class LRUCache:
+    """Dicionário LRU simples e seguro entre threads (sessões do Streamlit)."""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Valor guardado para a chave, ou None se não estiver no cache."""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        return None
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        value = loader()
+
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+_tutor_cache = LRUCache(_MAX_CACHED_FILES)
+_school_cache = LRUCache(_MAX_CACHED_FILES)
+_distance_cache = LRUCache(_MAX_CACHED_FILES)
+
+def file_bytes(file_input):
+    """Conteúdo bruto de um caminho (string), de bytes ou de um objeto de arquivo em memória."""
+    if isinstance(file_input, (bytes, bytearray)):
+        return bytes(file_input)
+    if isinstance(file_input, str):
+        with open(file_input, 'rb') as f:
+            return f.read()
+    if hasattr(file_input, 'getvalue'):
+        return file_input.getvalue()
+    file_input.seek(0)
+    return file_input.read()
+
+def _digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+def dataset_key(tutors_content, schools_content, distances_content, shift_mode):
+    """Chave de um 'Dataset' ('Dataset.key') a partir do conteúdo bruto dos três arquivos."""
+    return (_digest(tutors_content), _digest(schools_content), _digest(distances_content), shift_mode)
+
+def load_tutor_data(file_input, shift_mode):
+    """Lê (ou recupera do cache, pelo hash do conteúdo) os dados de um arquivo de tutores."""
+    content = file_bytes(file_input)
+    return _tutor_cache.get_or_load(
+        (_digest(content), shift_mode),
+        lambda: TutorData(*opt.read_tutors(io.BytesIO(content), shift_mode))
+    )
+
+def load_school_data(file_input, shift_mode):
+    """Lê (ou recupera do cache, pelo hash do conteúdo) os dados de um arquivo de escolas."""
+    content = file_bytes(file_input)
+    return _school_cache.get_or_load(
+        (_digest(content), shift_mode),
+        lambda: SchoolData(*opt.read_schools(io.BytesIO(content), shift_mode))
+    )
+
+def load_distances(file_input):
+    """Lê (ou recupera do cache, pelo hash do conteúdo) a matriz de distâncias."""
+    content = file_bytes(file_input)
+    return _distance_cache.get_or_load(
+        _digest(content),
+        lambda: opt.load_distance_matrix(io.BytesIO(content))
+    )
+
+def load_dataset(tutors_file, schools_file, distances_file, shift_mode='days_shifts'):
+    """
+    Monta o 'Dataset' da instância reaproveitando as leituras já feitas de cada arquivo.
+    'key' identifica o conteúdo dos três arquivos e o modo de turnos.
+    """
+    tutors_content = file_bytes(tutors_file)
+    schools_content = file_bytes(schools_file)
+    distances_content = file_bytes(distances_file)
+
+    tutor_data = load_tutor_data(tutors_content, shift_mode)
+    school_data = load_school_data(schools_content, shift_mode)
+    distances = load_distances(distances_content)
+
+    return Dataset(
+        key=dataset_key(tutors_content, schools_content, distances_content, shift_mode),
+        shift_mode=shift_mode,
+        time_slots=opt._get_time_slots(shift_mode),
+        tutors=tutor_data.tutors,
+        availability=tutor_data.availability,
+        preferences=tutor_data.preferences,
+        rankings=tutor_data.rankings,
+        tutor_districts=tutor_data.tutor_districts,
+        total_tutors=tutor_data.total_tutors,
+        schools=school_data.schools,
+        vacancies=school_data.vacancies,
+        school_districts=school_data.school_districts,
+        total_schools=school_data.total_schools,
+        total_vacancies=school_data.total_vacancies,
+        distances=distances
+    )
+
+def clear_cache():
+    """Descarta todos os arquivos lidos mantidos em memória."""
+    _tutor_cache.clear()
+    _school_cache.clear()
+    _distance_cache.clear()
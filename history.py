@@ -0,0 +1,289 @@
+import argparse
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# HISTÓRICO DE EXECUÇÕES (SQLITE)
+# =============================================================================
+
+HISTORY_DB = 'historico_alocacoes.db'
+HISTORY_CSV = 'historico_alocacoes.csv'
+
+_TABLE = 'runs'
+_KEY = 'Instance_ID'
+
+# Índices criados junto com a tabela: data da execução e principais parâmetros
+_INDEXES = {
+    'idx_runs_timestamp': ('Timestamp',),
+    'idx_runs_params': ('Shift_Mode', 'Decay_Type')
+}
+
+# Tempo (s) que uma escrita espera por outra em andamento antes de desistir
+_BUSY_TIMEOUT = 30
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _sql_type(value):
+    if isinstance(value, (bool, np.bool_, int, np.integer)):
+        return 'INTEGER'
+    if isinstance(value, (float, np.floating)):
+        return 'REAL'
+    return 'TEXT'
+
+def _sql_value(value):
+    """Converte escalares do NumPy/pandas para tipos aceitos pelo sqlite3."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return value
+
+class RunHistory:
+    """
+    Histórico das execuções em um banco SQLite embutido (uma linha por Instance_ID).
+
+    Cada gravação é uma transação: 'upsert' substitui as linhas das mesmas instâncias de
+    forma atômica, e várias threads ou processos (ex: o processamento em lote) podem
+    gravar ao mesmo tempo sem perder linhas. Colunas novas nas linhas do histórico são
+    acrescentadas à tabela automaticamente.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=_BUSY_TIMEOUT, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')    # Leitores não bloqueiam a escrita
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _columns(self, conn):
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({_quote(_TABLE)})')]
+
+    def _ensure_schema(self, conn, rows):
+        """Cria a tabela e os índices, ou acrescenta as colunas que ainda não existem."""
+        sample = {}
+        for row in rows:
+            for column, value in row.items():
+                if column not in sample or sample[column] is None:
+                    sample[column] = _sql_value(value)
+
+        columns = self._columns(conn)
+        if not columns:
+            definitions = [
+                f'{_quote(column)} TEXT PRIMARY KEY' if column == _KEY else f'{_quote(column)} {_sql_type(value)}'
+                for column, value in sample.items()
+            ]
+            conn.execute(f'CREATE TABLE {_quote(_TABLE)} ({", ".join(definitions)})')
+            columns = self._columns(conn)
+        else:
+            for column, value in sample.items():
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE {_quote(_TABLE)} ADD COLUMN {_quote(column)} {_sql_type(value)}')
+                    columns.append(column)
+
+        for name, indexed in _INDEXES.items():
+            if all(column in columns for column in indexed):
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {_quote(name)} ON {_quote(_TABLE)} '
+                    f'({", ".join(_quote(column) for column in indexed)})'
+                )
+
+    def upsert(self, rows):
+        """
+        Grava as linhas (dicionários no formato de '_build_history_row'), substituindo as
+        linhas já existentes com o mesmo Instance_ID. Tudo ou nada: em caso de erro nenhuma
+        linha é gravada.
+        """
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return
+        missing = [row for row in rows if row.get(_KEY) is None]
+        if missing:
+            raise ValueError(f"Linha do histórico sem o campo obrigatório '{_KEY}'.")
+
+        with self._transaction() as conn:
+            self._ensure_schema(conn, rows)
+            for row in rows:
+                row[_KEY] = str(row[_KEY])
+                columns = list(row)
+                # A linha antiga é removida e a nova vai para o fim (ordem de gravação)
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {_quote(_TABLE)} '
+                    f'({", ".join(_quote(c) for c in columns)}) VALUES ({", ".join("?" * len(columns))})',
+                    [_sql_value(row[c]) for c in columns]
+                )
+
+    def _select(self, since=None, until=None, instance_ids=None, order_by='rowid', **params):
+        """Consulta as linhas com os filtros informados (ver 'runs')."""
+        if not os.path.exists(self.db_path):
+            return pd.DataFrame()
+
+        with closing(self._connect()) as conn:
+            columns = self._columns(conn)
+            if not columns:
+                return pd.DataFrame()
+
+            unknown = [name for name in params if name not in columns]
+            if unknown:
+                raise ValueError(f"Coluna inexistente no histórico: {', '.join(unknown)}")
+
+            conditions, values = [], []
+            if since is not None:
+                conditions.append('"Timestamp" >= ?')
+                values.append(pd.Timestamp(since).strftime('%Y-%m-%d %H:%M:%S'))
+            if until is not None:
+                conditions.append('"Timestamp" <= ?')
+                values.append(pd.Timestamp(until).strftime('%Y-%m-%d %H:%M:%S'))
+            if instance_ids is not None:
+                instance_ids = [str(i) for i in instance_ids]
+                conditions.append(f'{_quote(_KEY)} IN ({", ".join("?" * len(instance_ids))})')
+                values.extend(instance_ids)
+            for name, value in params.items():
+                if isinstance(value, (list, tuple, set)):
+                    conditions.append(f'{_quote(name)} IN ({", ".join("?" * len(value))})')
+                    values.extend(_sql_value(v) for v in value)
+                else:
+                    conditions.append(f'{_quote(name)} = ?')
+                    values.append(_sql_value(value))
+
+            query = f'SELECT * FROM {_quote(_TABLE)}'
+            if conditions:
+                query += ' WHERE ' + ' AND '.join(conditions)
+            query += f' ORDER BY {order_by}'
+            return pd.read_sql_query(query, conn, params=values)
+
+    def runs(self, since=None, until=None, instance_ids=None, **params):
+        """
+        Execuções registradas, em ordem cronológica, como DataFrame (coluna 'Timestamp'
+        convertida para data). Filtros opcionais: intervalo de datas ('since'/'until'),
+        lista de Instance_IDs e igualdade em qualquer coluna, ex:
+        runs(Decay_Type='sigmoid', Shift_Mode=['shifts', 'days_shifts']).
+        """
+        df_runs = self._select(since, until, instance_ids, order_by='"Timestamp", rowid', **params)
+        if 'Timestamp' in df_runs:
+            df_runs['Timestamp'] = pd.to_datetime(df_runs['Timestamp'])
+        return df_runs
+
+    def trend(self, metrics, by=None, freq=None, **filters):
+        """
+        Evolução de uma ou mais métricas ao longo do tempo, para análise de tendência.
+
+        Retorna um DataFrame indexado pelo 'Timestamp'. Com 'by' (ex: 'Decay_Type'), cada
+        valor do parâmetro vira uma coluna por métrica; com 'freq' (ex: 'D', 'W'), os
+        valores são agregados pela média em cada período. 'filters' segue 'runs'.
+        """
+        metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+        df_runs = self.runs(**filters)
+        if df_runs.empty:
+            return pd.DataFrame(columns=metrics)
+
+        unknown = [name for name in metrics + ([by] if by else []) if name not in df_runs]
+        if unknown:
+            raise ValueError(f"Coluna inexistente no histórico: {', '.join(unknown)}")
+
+        if by:
+            df_trend = df_runs.pivot_table(index='Timestamp', columns=by, values=metrics, aggfunc='mean')
+        else:
+            df_trend = df_runs.set_index('Timestamp')[metrics]
+
+        if freq:
+            df_trend = df_trend.resample(freq).mean().dropna(how='all')
+        return df_trend
+
+    def summarize_by(self, params, metrics, **filters):
+        """
+        Média, mínimo, máximo e número de execuções das métricas para cada combinação dos
+        parâmetros, ex: summarize_by(['Decay_Type'], ['Pct_Pref_1', 'Total_Benefit']).
+        """
+        params = [params] if isinstance(params, str) else list(params)
+        metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+        df_runs = self.runs(**filters)
+        if df_runs.empty:
+            return pd.DataFrame()
+
+        unknown = [name for name in params + metrics if name not in df_runs]
+        if unknown:
+            raise ValueError(f"Coluna inexistente no histórico: {', '.join(unknown)}")
+        return df_runs.groupby(params)[metrics].agg(['mean', 'min', 'max', 'count'])
+
+    def to_dataframe(self):
+        """Todas as linhas na ordem de gravação, como no antigo historico_alocacoes.csv."""
+        return self._select()
+
+    def export_csv(self, csv_path):
+        """
+        Exporta o histórico para CSV (formato do antigo historico_alocacoes.csv), com
+        troca atômica do arquivo. Retorna o caminho gravado.
+        """
+        directory = os.path.dirname(csv_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Temporário por processo e thread: exportações simultâneas do servidor não se misturam
+        tmp_path = f"{csv_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.to_dataframe().to_csv(tmp_path, index=False)
+        os.replace(tmp_path, csv_path)
+        return csv_path
+
+    def import_csv(self, csv_path):
+        """Importa um historico_alocacoes.csv (ex: de versões anteriores) para o banco."""
+        df_hist = pd.read_csv(csv_path)
+        if df_hist.empty or _KEY not in df_hist.columns:
+            return 0
+        # Valores ausentes voltam como None em vez de NaN
+        rows = df_hist.astype(object).where(df_hist.notna(), None).to_dict('records')
+        self.upsert(rows)
+        return len(rows)
+
+def open_history(base_path='alocacoes/'):
+    """
+    Abre o histórico da pasta de relatórios ('<base_path>/historico_alocacoes.db').
+    Na primeira abertura, se existir um historico_alocacoes.csv de versões anteriores
+    na mesma pasta, as suas linhas são importadas para o banco.
+    """
+    os.makedirs(base_path, exist_ok=True)
+    db_path = os.path.join(base_path, HISTORY_DB)
+    history = RunHistory(db_path)
+
+    csv_path = os.path.join(base_path, HISTORY_CSV)
+    if not os.path.exists(db_path) and os.path.exists(csv_path):
+        history.import_csv(csv_path)
+    return history
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta e exporta o histórico de execuções.")
+    parser.add_argument("base_path", nargs="?", default="alocacoes/", help="Pasta base dos relatórios")
+    parser.add_argument("--csv", nargs="?", const="", default=None,
+                        help="Exporta o histórico para CSV (padrão: <base_path>/historico_alocacoes.csv)")
+    args = parser.parse_args()
+
+    history = open_history(args.base_path)
+    if args.csv is not None:
+        path = history.export_csv(args.csv or os.path.join(args.base_path, HISTORY_CSV))
+        print(f"Histórico exportado para: {path}")
+    else:
+        df_runs = history.runs()
+        print(f"{len(df_runs)} execuções registradas em {history.db_path}")
+        if not df_runs.empty:
+            shown = [c for c in ('Timestamp', _KEY, 'Decay_Type', 'Fill_Rate_Pct', 'Pct_Pref_1') if c in df_runs]
+            print(df_runs[shown].to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import contextvars
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# =============================================================================
+# INSTRUMENTAÇÃO (TEMPO, CONTAGENS E MEMÓRIA POR ETAPA)
+# =============================================================================
+
+# Coletor ativo no contexto atual (cada thread/tarefa tem o seu)
+_current_profiler = contextvars.ContextVar('profiler', default=None)
+
+class Span:
+    """Medição de uma etapa: duração (s), contagens livres e pico de memória opcional."""
+
+    def __init__(self, name, counts):
+        self.name = name
+        self.counts = dict(counts)
+        self.duration = None
+        self.peak_memory = None
+        self._child_peak = 0
+
+    def count(self, **counts):
+        """Registra contagens da etapa, ex: span.count(variables=len(X))."""
+        self.counts.update(counts)
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "duration": self.duration,
+            "counts": self.counts,
+            "peak_memory_mb": self.peak_memory / 2**20 if self.peak_memory is not None else None
+        }
+
+class _NullSpan:
+    """Etapa descartada (nenhum coletor ativo): não mede nada."""
+
+    def count(self, **counts):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Profiler:
+    """
+    Coletor das etapas medidas com 'span'. Etapas aninhadas recebem o nome da etapa mãe
+    como prefixo ('build' > 'variables' vira 'build.variables') e são listadas na ordem em
+    que começaram. Com 'track_memory', cada etapa registra o pico de memória alocada pelo
+    Python (tracemalloc) enquanto esteve aberta.
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.spans = []
+        self._stack = []
+
+    @contextmanager
+    def span(self, name, **counts):
+        full_name = f"{self._stack[-1].name}.{name}" if self._stack else name
+        record = Span(full_name, counts)
+        self.spans.append(record)
+
+        if self.track_memory:
+            # O pico é global no tracemalloc: guarda o da etapa mãe antes de reiniciá-lo
+            if self._stack:
+                parent = self._stack[-1]
+                parent._child_peak = max(parent._child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        self._stack.append(record)
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - start_time
+            self._stack.pop()
+            if self.track_memory:
+                record.peak_memory = max(record._child_peak, tracemalloc.get_traced_memory()[1])
+
+    def records(self):
+        """Lista de dicionários (stage, duration, counts, peak_memory_mb), um por etapa."""
+        return [record.as_dict() for record in self.spans if record.duration is not None]
+
+@contextmanager
+def profile(track_memory=False):
+    """
+    Ativa um coletor para o bloco. Se já houver um ativo (ex: 'generate_allocation'
+    chamando 'AllocationSession.solve'), ele é reaproveitado, de modo que as etapas
+    internas entram na mesma lista.
+    """
+    active = _current_profiler.get()
+    if active is not None:
+        yield active
+        return
+
+    profiler = Profiler(track_memory)
+    token = _current_profiler.set(profiler)
+    started_tracing = track_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield profiler
+    finally:
+        _current_profiler.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+
+@contextmanager
+def span(name, **counts):
+    """
+    Mede o bloco como uma etapa do coletor ativo; sem coletor ativo não faz nada, então
+    pode ser usado livremente dentro das funções da biblioteca.
+    """
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield _NULL_SPAN
+        return
+    with profiler.span(name, **counts) as record:
+        yield record
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def to_prometheus(timings, prefix='alocacao', labels=None):
+    """
+    Converte 'stats["timings"]' para o formato de texto do Prometheus, com as métricas
+    '<prefix>_stage_duration_seconds', '<prefix>_stage_count' e
+    '<prefix>_stage_peak_memory_bytes' rotuladas pela etapa (e por 'labels', se houver).
+    Etapas repetidas têm as durações somadas.
+    """
+    base_labels = ''.join(f',{key}="{_label_value(value)}"' for key, value in (labels or {}).items())
+
+    durations, counts, memory = {}, {}, {}
+    for record in timings:
+        stage = record['stage']
+        durations[stage] = durations.get(stage, 0.0) + record['duration']
+        for item, value in record['counts'].items():
+            counts[(stage, item)] = value
+        if record.get('peak_memory_mb') is not None:
+            memory[stage] = max(memory.get(stage, 0), record['peak_memory_mb'] * 2**20)
+
+    lines = [
+        f"# HELP {prefix}_stage_duration_seconds Duração de cada etapa da otimização.",
+        f"# TYPE {prefix}_stage_duration_seconds gauge"
+    ]
+    lines += [
+        f'{prefix}_stage_duration_seconds{{stage="{_label_value(stage)}"{base_labels}}} {seconds:.6f}'
+        for stage, seconds in durations.items()
+    ]
+
+    if counts:
+        lines += [
+            f"# HELP {prefix}_stage_count Contagens registradas em cada etapa.",
+            f"# TYPE {prefix}_stage_count gauge"
+        ]
+        lines += [
+            f'{prefix}_stage_count{{stage="{_label_value(stage)}",item="{_label_value(item)}"{base_labels}}} {value}'
+            for (stage, item), value in counts.items()
+        ]
+
+    if memory:
+        lines += [
+            f"# HELP {prefix}_stage_peak_memory_bytes Pico de memória do Python em cada etapa.",
+            f"# TYPE {prefix}_stage_peak_memory_bytes gauge"
+        ]
+        lines += [
+            f'{prefix}_stage_peak_memory_bytes{{stage="{_label_value(stage)}"{base_labels}}} {int(peak)}'
+            for stage, peak in memory.items()
+        ]
+
+    return "\n".join(lines) + "\n"
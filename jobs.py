@@ -0,0 +1,335 @@
+import atexit
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import optimization as opt
+import dataset as ds
+import instrumentation as instr
+
+# =============================================================================
+# EXECUÇÃO DE OTIMIZAÇÕES EM SEGUNDO PLANO
+# =============================================================================
+
+# Estados possíveis de um job
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+
+_FINAL_STATES = {DONE, ERROR, CANCELLED}
+
+# Intervalo (em segundos) com que o monitor recolhe mensagens e inicia jobs pendentes
+_POLL_INTERVAL = 0.2
+
+# Quantas sessões de alocação (uma por conjunto de arquivos) cada processo mantém em memória
+_MAX_WORKER_SESSIONS = 2
+
+# Tempo (em segundos) que um processo ocioso espera por um job antes de verificar o pai
+_PARENT_CHECK_INTERVAL = 1.0
+
+# Tempo (em segundos) que o encerramento espera cada processo antes de forçá-lo
+_SHUTDOWN_TIMEOUT = 5.0
+
+def _worker_main(commands, events, parent_pid):
+    """
+    Laço do processo de otimização: recebe jobs ('job_id', arquivos, parâmetros) pelo pipe
+    de comandos e responde com ('progress', job_id, dados), ('done', job_id, resultado) ou
+    ('error', job_id, mensagem). Mantém uma 'AllocationSession' por conjunto de arquivos,
+    de modo que execuções seguidas reaproveitam os dados lidos e o modelo construído (com
+    warm start). Termina ao receber None ou quando o processo pai deixa de existir.
+    """
+    # Grupo de processos próprio: o cancelamento encerra também os filhos (decomposição, CBC)
+    if hasattr(os, 'setpgid'):
+        os.setpgid(0, 0)
+
+    sessions = ds.LRUCache(_MAX_WORKER_SESSIONS)
+    while True:
+        if not commands.poll(_PARENT_CHECK_INTERVAL):
+            if os.getppid() != parent_pid:
+                return
+            continue
+        try:
+            message = commands.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        job_id, files, params_dict = message
+        try:
+            start_time = time.perf_counter()
+            track_memory = params_dict.get('profile_memory', opt.DEFAULT_PARAMS['profile_memory'])
+            with instr.profile(track_memory=track_memory):
+                dataset = ds.load_dataset(
+                    *files, shift_mode=params_dict.get('shift_mode', opt.DEFAULT_PARAMS['shift_mode'])
+                )
+                session = sessions.get_or_load(
+                    dataset.key, lambda: opt.AllocationSession.from_dataset(dataset)
+                )
+                result = session.solve(
+                    params_dict, progress_callback=lambda progress: events.send(('progress', job_id, progress))
+                )
+            result['stats']['elapsed_time'] = time.perf_counter() - start_time
+            events.send(('done', job_id, result))
+        except Exception as e:
+            events.send(('error', job_id, f"Erro ao processar a otimização: {e}"))
+
+def _kill_process_group(process):
+    """Encerra o processo e os seus filhos (mesmo grupo) e aguarda o término."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        process.kill()
+    process.join()
+
+class Job:
+    """Registro de uma otimização submetida ao 'JobManager'."""
+
+    def __init__(self, job_id, files, params_dict):
+        self.job_id = job_id
+        self.files = files
+        self.params = params_dict
+        self.key = ds.dataset_key(*files, params_dict.get('shift_mode', opt.DEFAULT_PARAMS['shift_mode']))
+        self.status = PENDING
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.worker = None
+
+    def snapshot(self):
+        """Cópia do estado do job, segura para ser lida fora do lock do gerenciador."""
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "queued_time": (self.started_at or end) - self.submitted_at,
+            "elapsed_time": end - self.started_at if self.started_at else 0.0
+        }
+
+class _Worker:
+    """Processo de otimização de longa duração e os pipes usados para falar com ele."""
+
+    def __init__(self, context):
+        commands_receiver, self.commands = context.Pipe(duplex=False)
+        self.events, events_sender = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_worker_main, args=(commands_receiver, events_sender, os.getpid())
+        )
+        self.process.start()
+        if hasattr(os, 'setpgid'):
+            try:
+                # Repetido no pai para o grupo já existir caso o job seja cancelado logo em seguida
+                os.setpgid(self.process.pid, self.process.pid)
+            except OSError:
+                pass
+        commands_receiver.close()
+        events_sender.close()
+        self.job = None
+        # Chaves das sessões mantidas pelo processo, da menos para a mais recente
+        self.keys = OrderedDict()
+        self.last_used = time.time()
+
+    def run(self, job):
+        self.job = job
+        self.keys[job.key] = True
+        self.keys.move_to_end(job.key)
+        while len(self.keys) > _MAX_WORKER_SESSIONS:
+            self.keys.popitem(last=False)
+        self.commands.send((job.job_id, job.files, job.params))
+
+    def release(self):
+        self.job = None
+        self.last_used = time.time()
+
+    def close(self):
+        self.commands.close()
+        self.events.close()
+
+class JobManager:
+    """
+    Executa otimizações em processos separados, para que a thread do script do Streamlit
+    nunca fique bloqueada pelo CBC.
+
+    Os processos são de longa duração (no máximo 'max_workers'; os jobs excedentes
+    aguardam na fila) e cada um mantém as sessões de alocação dos arquivos que já
+    resolveu: um job é enviado, sempre que possível, ao processo que já tem a sessão dos
+    mesmos arquivos, que reaproveita os dados lidos e o modelo do CBC. Os processos são
+    iniciados com 'spawn' (nunca por fork do processo do Streamlit) e não são daemon, para poderem criar o pool da decomposição; cancelar um job em andamento
+    encerra o processo e todos os seus filhos, e o processo é recriado no próximo job.
+    Uma thread monitora recolhe o progresso e o resultado de cada job pelo pipe. O
+    gerenciador é compartilhado entre sessões, então jobs de usuários diferentes rodam
+    em paralelo. Os processos são encerrados em 'shutdown', chamado também na saída.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or max(1, os.cpu_count() or 1)
+        # 'spawn' em vez do 'fork' padrão do Linux: o processo do Streamlit tem várias threads
+        # (e locks) que não podem ser copiadas com segurança; tudo o que vai ao processo é
+        # serializável. Com 'spawn' o pai do processo continua sendo este (ver '_worker_main')
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = {}
+        self._queue = []
+        self._workers = []
+        self._lock = threading.Lock()
+        self._monitor = None
+        atexit.register(self.shutdown)
+
+    def submit(self, tutors_file, schools_file, distances_file, params_dict):
+        """Enfileira uma otimização e retorna o identificador do job."""
+        # O conteúdo é lido aqui porque arquivos em memória não podem ir para outro processo
+        files = (ds.file_bytes(tutors_file), ds.file_bytes(schools_file), ds.file_bytes(distances_file))
+        job = Job(uuid.uuid4().hex, files, dict(params_dict))
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._queue.append(job)
+            self._start_pending()
+            self._ensure_monitor()
+        return job.job_id
+
+    def status(self, job_id):
+        """Estado atual do job (ver 'Job.snapshot'), ou None se o id não existir."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.snapshot() if job else None
+
+    def result(self, job_id):
+        """Resultado ('AllocationSession.solve') de um job concluído, ou None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.result if job and job.status == DONE else None
+
+    def cancel(self, job_id):
+        """Cancela um job pendente ou em execução. Retorna True se o job foi cancelado."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in _FINAL_STATES:
+                return False
+
+            if job.status == PENDING:
+                self._queue.remove(job)
+            else:
+                self._discard_worker(job.worker)
+            self._finish(job, CANCELLED)
+            self._start_pending()
+            return True
+
+    def forget(self, job_id):
+        """Descarta um job (cancelando-o, se ainda estiver ativo) e libera o seu resultado."""
+        self.cancel(job_id)
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def shutdown(self):
+        """Cancela todos os jobs ativos e encerra os processos de otimização."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status not in _FINAL_STATES:
+                    self._finish(job, CANCELLED)
+            self._queue.clear()
+
+            workers, self._workers = self._workers, []
+            for worker in workers:
+                if worker.job is not None:
+                    _kill_process_group(worker.process)
+                else:
+                    try:
+                        worker.commands.send(None)
+                    except OSError:
+                        pass
+            for worker in workers:
+                worker.process.join(_SHUTDOWN_TIMEOUT)
+                if worker.process.is_alive():
+                    _kill_process_group(worker.process)
+                worker.close()
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job.files = None
+        job.params = None
+        if job.worker is not None and job.worker.job is job:
+            job.worker.release()
+        job.worker = None
+
+    def _discard_worker(self, worker):
+        _kill_process_group(worker.process)
+        worker.close()
+        self._workers.remove(worker)
+
+    def _pick_worker(self, job):
+        """Processo livre para o job: o que já tem a sessão dos arquivos, um novo ou o ocioso há mais tempo."""
+        idle = [worker for worker in self._workers if worker.job is None]
+        for worker in idle:
+            if job.key in worker.keys:
+                return worker
+        if len(self._workers) < self.max_workers:
+            worker = _Worker(self._context)
+            self._workers.append(worker)
+            return worker
+        return min(idle, key=lambda worker: worker.last_used, default=None)
+
+    def _start_pending(self):
+        while self._queue:
+            worker = self._pick_worker(self._queue[0])
+            if worker is None:
+                return
+            job = self._queue.pop(0)
+            job.worker = worker
+            job.status = RUNNING
+            job.started_at = time.time()
+            worker.run(job)
+
+    def _ensure_monitor(self):
+        if self._monitor is None or not self._monitor.is_alive():
+            self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+            self._monitor.start()
+
+    def _monitor_loop(self):
+        while True:
+            with self._lock:
+                for worker in [w for w in self._workers if w.job is not None]:
+                    self._collect(worker)
+                self._start_pending()
+                if not any(job.status not in _FINAL_STATES for job in self._jobs.values()):
+                    self._monitor = None
+                    return
+            time.sleep(_POLL_INTERVAL)
+
+    def _collect(self, worker):
+        """Lê as mensagens disponíveis do pipe de um processo com job em execução."""
+        job = worker.job
+        # Verificado antes da leitura para não perder mensagens enviadas logo antes do fim
+        alive = worker.process.is_alive()
+        try:
+            while worker.events.poll():
+                kind, job_id, payload = worker.events.recv()
+                if job_id != job.job_id:
+                    continue
+                if kind == 'progress':
+                    job.progress = payload
+                elif kind == 'done':
+                    job.result = payload
+                    self._finish(job, DONE)
+                    return
+                else:
+                    self._finish(job, ERROR, payload)
+                    return
+        except (EOFError, OSError):
+            pass
+
+        if not alive:
+            exitcode = worker.process.exitcode
+            self._discard_worker(worker)
+            self._finish(job, ERROR, f"O processo de otimização foi encerrado inesperadamente (código {exitcode}).")
@@ -1,8 +1,28 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import hashlib
+import io
 import os
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from optimization import DistanceMatrix
+import dataset as ds
+import history
+import instrumentation as instr
+
+# Resolução dos gráficos exportados e tamanho do cache de PNGs renderizados
+CHART_DPI = 150
+_MAX_CACHED_CHARTS = 32
+
+# Pool (criado sob demanda) que desenha os gráficos fora do caminho crítico da exportação
+_CHART_WORKERS = 2
+_chart_pool = None
+_chart_pool_lock = threading.Lock()
+_chart_cache = ds.LRUCache(_MAX_CACHED_CHARTS)
 
 # =============================================================================
 # FUNÇÕES DE ANÁLISE DE MÉTRICAS E KPIs
@@ -28,9 +48,11 @@ def analyze_unallocated_tutors(df_allocation, raw_data):
     else:
         allocated_tutors = set(df_allocation['Tutor Alocado'].dropna())
     
-    unallocated_tutors = set(all_tutors) - allocated_tutors
+    # Ordena para o relatório seguir a ordem dos melhores rankings primeiro
+    unallocated_tutors = list(dict.fromkeys(t for t in all_tutors if t not in allocated_tutors))
+    sorted_unallocated = sorted(unallocated_tutors, key=lambda t: rankings.get(t, 999999))
     
-    if not unallocated_tutors:
+    if not sorted_unallocated:
         # Retorna DataFrame vazio já com as colunas formatadas se todos foram alocados
         return pd.DataFrame(columns=[
             'Tutor', 'Ranking', 'Motivo', 'Escolas Preferenciais', 
@@ -38,13 +60,13 @@ def analyze_unallocated_tutors(df_allocation, raw_data):
         ])
         
     # --- Mapeando Vencedores ---
-    # Identifica todas as vagas ofertadas originalmente
-    available_vacancies = set()
-    for (time_slot, school), count in vacancies_dict.items():
-        if count > 0:
-            available_vacancies.add((school, time_slot))
-            
-    # Conta alocações por vaga e rastreia o pior ranking vencedor por vaga
+    # Vagas ofertadas originalmente, com a capacidade restante e o pior ranking vencedor de cada uma
+    slot_index = {ts: i for i, ts in enumerate(time_slots)}
+    offered = [
+        (school, time_slot, count) for (time_slot, school), count in vacancies_dict.items()
+        if count > 0 and time_slot in slot_index
+    ]
+
     allocated_counts = {}
     winners_by_vacancy = {}
 
@@ -54,53 +76,63 @@ def analyze_unallocated_tutors(df_allocation, raw_data):
         df_alloc_temp['v_key'] = list(zip(df_alloc_temp['Escola'], df_alloc_temp['Turno da Vaga']))
         allocated_counts = df_alloc_temp['v_key'].value_counts().to_dict()
         winners_by_vacancy = df_alloc_temp.groupby('v_key')['tutor_rank'].max().to_dict()
-                
-    # --- Análise Individual dos Não Alocados ---
+
+    vacancy_slot = np.array([slot_index[ts] for _, ts, _ in offered], dtype=np.int64)
+    remaining = np.array(
+        [count - allocated_counts.get((school, ts), 0) for school, ts, count in offered], dtype=np.int64
+    )
+    worst_winner = np.array(
+        [winners_by_vacancy.get((school, ts), -1) for school, ts, _ in offered], dtype=np.int64
+    )
+
+    # --- Análise Vetorizada dos Não Alocados ---
+    # Matriz tutor x turno de disponibilidade: uma vaga é compatível se o seu turno está livre
+    tutor_ranks = np.array([rankings.get(t, 999999) for t in sorted_unallocated], dtype=np.int64)
+    available = np.array(
+        [[availability.get((t, ts), 0) > 0 for ts in time_slots] for t in sorted_unallocated], dtype=bool
+    ).reshape(len(sorted_unallocated), len(time_slots))
+
+    # Por turno: total de vagas, vagas não preenchidas (o tutor não perdeu por ranking, foi
+    # barrado pela otimização global) e piores rankings vencedores das vagas preenchidas, ordenados
+    n_slots = len(time_slots)
+    full = remaining <= 0
+    vacancies_per_slot = np.bincount(vacancy_slot, minlength=n_slots)
+    open_per_slot = np.bincount(vacancy_slot[~full], minlength=n_slots)
+
+    lost_to_better = np.zeros((len(sorted_unallocated), n_slots), dtype=np.int64)
+    lost_to_worse = np.tile(open_per_slot, (len(sorted_unallocated), 1))
+    for slot in range(n_slots):
+        winners = np.sort(worst_winner[full & (vacancy_slot == slot)])
+        if winners.size:
+            # Venceu alguém com número menor (melhor) / maior (pior) que o do tutor
+            lost_to_better[:, slot] = np.searchsorted(winners, tutor_ranks, side='left')
+            lost_to_worse[:, slot] += winners.size - np.searchsorted(winners, tutor_ranks, side='right')
+
+    n_compatible = available @ vacancies_per_slot
+    n_better = (available * lost_to_better).sum(axis=1)
+    n_worse = (available * lost_to_worse).sum(axis=1)
+
+    # Sem vagas compatíveis: conflito. TODAS as compatíveis perdidas estritamente para
+    # pessoas de ranking melhor: competição. Caso contrário: indeterminado
+    reasons = np.where(
+        n_compatible == 0, "CONFLITO DE DISPONIBILIDADE",
+        np.where(
+            (n_better > 0) & (n_worse == 0) & (n_compatible == n_better),
+            "COMPETIÇÃO POR RANKING", "INDETERMINADO / MISTO"
+        )
+    )
+
     results = []
-    
-    # Ordena para o relatório seguir a ordem dos melhores rankings primeiro
-    sorted_unallocated = sorted(list(unallocated_tutors), key=lambda t: rankings.get(t, 999999))
-    
-    for tutor in sorted_unallocated:
+    for i, tutor in enumerate(sorted_unallocated):
         tutor_rank = rankings.get(tutor, 999999)
-        
-        tutor_avail_slots = [ts for ts in time_slots if availability.get((tutor, ts), 0) > 0]
+        tutor_avail_slots = [ts for ts, free in zip(time_slots, available[i]) if free]
         tutor_prefs = [p for p in preferences.get(tutor, []) if pd.notna(p) and p]
         tutor_polos = tutor_districts.get(tutor, [])
-        
-        # Lógica Matemática do Motivo
-        compatible_vacancies = {v for v in available_vacancies if v[1] in tutor_avail_slots}
-        
-        reason = ""
-        lost_to_better = 0
-        lost_to_worse = 0
-        
-        if not compatible_vacancies:
-            reason = "CONFLITO DE DISPONIBILIDADE"
-        else:
-            for vacancy in compatible_vacancies:
-                # Verifica se a vaga foi totalmente preenchida
-                # Se não foi preenchida, o tutor não perdeu por ranking, foi barrado pela otimização global
-                if allocated_counts.get(vacancy, 0) < vacancies_dict.get((vacancy[1], vacancy[0]), 0):
-                    lost_to_worse += 1 
-                else:
-                    winner_rank = winners_by_vacancy.get(vacancy)
-                    if winner_rank is not None:
-                        if winner_rank < tutor_rank:     # Venceu alguém com número menor (melhor)
-                            lost_to_better += 1
-                        elif winner_rank > tutor_rank:   # Venceu alguém com número maior (pior)
-                            lost_to_worse += 1
-            
-            # Se TODAS as vagas compatíveis foram perdidas estritamente para pessoas de ranking melhor:
-            if lost_to_better > 0 and lost_to_worse == 0 and len(compatible_vacancies) == lost_to_better:
-                reason = "COMPETIÇÃO POR RANKING"
-            else:
-                reason = "INDETERMINADO / MISTO"
-                
+
         results.append({
             'Tutor': tutor,
             'Ranking': tutor_rank if tutor_rank != 999999 else 'N/A',
-            'Motivo': reason,
+            'Motivo': str(reasons[i]),
             'Escolas Preferenciais': ", ".join(tutor_prefs) if tutor_prefs else "Nenhuma",
             'Polos Preferenciais': ", ".join(tutor_polos) if tutor_polos else "Nenhum",
             'Turnos Disponíveis': ", ".join(tutor_avail_slots) if tutor_avail_slots else "Nenhum"
@@ -116,46 +148,7 @@ def analyze_unfilled_vacancies(df_allocation, raw_data):
     pelo modelo para identificar exatamente onde sobraram vagas.
     Retorna um DataFrame estruturado para exibição direta no Streamlit.
     """
-    vacancies_dict = raw_data.get('vacancies', {})
-    
-    # --- Contagem das Alocações Realizadas ---
-    if df_allocation.empty:
-        allocated_counts = {}
-    else:
-        # Agrupa pelo Turno e Escola e conta quantas linhas (tutores) existem lá.
-        # to_dict() cria algo como: {('Manha', 'Escola A'): 2, ('Tarde', 'Escola B'): 1}
-        allocated_counts = df_allocation.groupby(['Turno da Vaga', 'Escola']).size().to_dict()
-        
-    # --- Verificação de Vagas Sobrando ---
-    unfilled_results = []
-    
-    for (time_slot, school), total_offered in vacancies_dict.items():
-        if total_offered > 0:
-            # Pega quantas vagas foram preenchidas (se não achar no dicionário, assume 0)
-            filled = allocated_counts.get((time_slot, school), 0)
-            remaining = total_offered - filled
-            
-            # Se a quantidade ofertada for maior que a preenchida, sobrou vaga
-            if remaining > 0:
-                unfilled_results.append({
-                    'Escola': school,
-                    'Turno da Vaga': time_slot,
-                    'Vagas Ofertadas': total_offered,
-                    'Vagas Preenchidas': filled,
-                    'Vagas Sobrando': remaining
-                })
-                
-    # --- Construção e Formatação do DataFrame ---
-    if not unfilled_results:
-        # Se não sobrou nenhuma vaga, devolve um DataFrame vazio
-        df_unfilled = pd.DataFrame(columns=[
-            'Escola', 'Turno da Vaga', 'Vagas Ofertadas', 'Vagas Preenchidas', 'Vagas Sobrando'
-        ])
-    else:
-        df_unfilled = pd.DataFrame(unfilled_results)
-        df_unfilled = df_unfilled.sort_values(by=['Escola', 'Turno da Vaga']).reset_index(drop=True)
-        
-    return df_unfilled
+    return AllocationKPIs(df_allocation, raw_data).unfilled_vacancies()
 
 def analyze_polo_matches(df_allocation, raw_data):
     """
@@ -163,35 +156,7 @@ def analyze_polo_matches(df_allocation, raw_data):
     em escolas pertencentes a um de seus polos de preferência.
     Retorna um dicionário com os KPIs para exibição no Streamlit.
     """
-    tutor_districts = raw_data.get('tutor_districts', {})
-    school_districts = raw_data.get('school_districts', {})
-    
-    total_allocated = len(df_allocation)
-    polo_matches = 0
-    
-    if total_allocated == 0:
-        return {
-            'Total_Alocados': 0,
-            'Tutores_Polo_Preferido': 0,
-            'Percentual_Polo_Preferido': 0.0
-        }
-        
-    # Conta matches de polo via vetorização
-    school_polos = df_allocation['Escola'].map(school_districts).fillna('')
-    tutor_polos = df_allocation['Tutor Alocado'].map(tutor_districts)
-    polo_matches = sum(
-        sp and isinstance(tp, list) and sp in tp
-        for sp, tp in zip(school_polos, tutor_polos)
-    )
-            
-    # --- Cálculo e Retorno ---
-    match_percentage = (polo_matches / total_allocated) * 100 if total_allocated > 0 else 0.0
-    
-    return {
-        'Total_Alocados': total_allocated,
-        'Tutores_Polo_Preferido': polo_matches,
-        'Percentual_Polo_Preferido': match_percentage
-    }
+    return AllocationKPIs(df_allocation, raw_data).polo_kpis()
 
 def analyze_preferences_matches(df_allocation, raw_data):
     """
@@ -199,226 +164,349 @@ def analyze_preferences_matches(df_allocation, raw_data):
     foi colocado na sua 1ª, 2ª, 3ª opção ou fora das suas preferências diretas.
     Retorna um DataFrame com a contagem e percentual (ideal para gráficos no Streamlit).
     """
-    preferences = raw_data.get('preferences', {})
-    total_allocated = len(df_allocation)
+    return AllocationKPIs(df_allocation, raw_data).preferences_summary()
 
-    counts = {
-        '1ª Opção': 0,
-        '2ª Opção': 0,
-        '3ª Opção': 0,
-        'Fora das Preferências': 0
-    }
-    
-    # Se não houver alocações, devolve a tabela zerada
-    if total_allocated == 0:
+def analyze_cross_preferences(df_allocation, raw_data):
+    """
+    Realiza a Análise Cruzada para saber se o tutor ganhou a Escola, 
+    apenas o Polo, ou nenhuma das duas preferências.
+    """
+    return AllocationKPIs(df_allocation, raw_data).cross_preferences()
+
+# =============================================================================
+# MOTOR DE KPIs (TABELAS COLUNARES E PASSADA ÚNICA)
+# =============================================================================
+
+def _explode(lists):
+    """
+    Achata uma sequência de listas (valores que não são listas contam como vazias) em três
+    colunas: linha de origem, posição na lista e valor.
+    """
+    rows, cols, values = [], [], []
+    for row, items in enumerate(lists):
+        if isinstance(items, list):
+            rows.extend([row] * len(items))
+            cols.extend(range(len(items)))
+            values.extend(items)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), pd.Index(values, dtype=object)
+
+class AllocationKPIs:
+    """
+    Calcula todos os KPIs de uma alocação a partir de uma única junção.
+
+    Tutores, escolas e polos viram códigos inteiros (categorias) e os atributos dos
+    tutores viram tabelas colunares: matriz tutor x preferência (código da escola) e
+    matriz tutor x polo (pertinência). A alocação é juntada a essas tabelas uma vez no
+    construtor, gerando as colunas 'pref_position' (1, 2, 3 ou 0 se fora), 'polo_match' e
+    'first_preference' por alocação; cada KPI é então apenas uma contagem sobre essas colunas.
+    """
+
+    def __init__(self, df_allocation, raw_data):
+        self.df_allocation = df_allocation
+        self.raw_data = raw_data
+
+        preferences = raw_data.get('preferences', {})
+        tutor_districts = raw_data.get('tutor_districts', {})
+        school_districts = raw_data.get('school_districts', {})
+
+        alloc_tutors = df_allocation['Tutor Alocado'].to_numpy() if not df_allocation.empty else np.array([])
+        alloc_schools = df_allocation['Escola'].to_numpy() if not df_allocation.empty else np.array([])
+
+        # --- Categorias (cada tutor e escola alocados viram um código inteiro) ---
+        tutor_codes, tutors = pd.factorize(alloc_tutors)
+        school_codes, schools = pd.factorize(alloc_schools)
+        school_index = pd.Index(schools, dtype=object)
+        district_index = pd.Index(list(dict.fromkeys(
+            d for d in school_districts.values() if isinstance(d, str) and d
+        )), dtype=object)
+
+        # --- Tabelas dos tutores alocados ---
+        # Preferências como códigos de escola; escolas sem alocação ficam com -1 e nunca coincidem
+        pref_rows, pref_cols, pref_values = _explode([preferences.get(t) for t in tutors])
+        pref_matrix = np.full((len(tutors), max(pref_cols, default=0) + 1), -1, dtype=np.int64)
+        pref_matrix[pref_rows, pref_cols] = school_index.get_indexer(pref_values)
+
+        # Pertinência tutor x polo (a última coluna, sempre falsa, representa "sem polo")
+        polo_rows, _, polo_values = _explode([tutor_districts.get(t) for t in tutors])
+        polo_codes = district_index.get_indexer(polo_values)
+        polo_matrix = np.zeros((len(tutors), len(district_index) + 1), dtype=bool)
+        polo_matrix[polo_rows[polo_codes >= 0], polo_codes[polo_codes >= 0]] = True
+        school_polo = district_index.get_indexer(
+            pd.Index([school_districts.get(s) for s in schools], dtype=object)
+        )
+
+        # --- Junção da alocação com as tabelas ---
+        pref_hits = pref_matrix[tutor_codes] == school_codes[:, None]
+        self.pref_position = np.where(pref_hits.any(axis=1), pref_hits.argmax(axis=1) + 1, 0)
+        self.polo_match = polo_matrix[tutor_codes, school_polo[school_codes]]
+
+        # 1ª preferência de cada alocação (referência das distâncias no relatório detalhado)
+        first_preferences = np.array(
+            [p[0] if isinstance(p, list) and p else None for p in (preferences.get(t) for t in tutors)],
+            dtype=object
+        )
+        self.first_preference = first_preferences[tutor_codes]
+
+    @property
+    def total_allocated(self):
+        return len(self.df_allocation)
+
+    def preferences_summary(self):
+        """Contagem e percentual de alocações na 1ª, 2ª, 3ª opção ou fora das preferências."""
+        counts = {
+            '1ª Opção': int((self.pref_position == 1).sum()),
+            '2ª Opção': int((self.pref_position == 2).sum()),
+            '3ª Opção': int((self.pref_position == 3).sum()),
+            'Fora das Preferências': int((self.pref_position == 0).sum())
+        }
+        total_allocated = self.total_allocated
         return pd.DataFrame([
-            {'Categoria': k, 'Quantidade': 0, 'Percentual': 0.0}
-            for k in counts.keys()
+            {
+                'Categoria': category,
+                'Quantidade': count,
+                'Percentual': round(count / total_allocated * 100, 2) if total_allocated else 0.0
+            }
+            for category, count in counts.items()
         ])
-        
-    # Descobre a posição da escola nas preferências do tutor (1, 2, 3) ou 0 se fora
-    prefs_series = df_allocation['Tutor Alocado'].map(preferences)
 
-    def _pref_position(prefs, school):
-        if isinstance(prefs, list) and school in prefs:
-            return prefs.index(school) + 1
-        return 0
+    def polo_kpis(self):
+        """Quantidade e percentual de tutores alocados em um dos seus polos de preferência."""
+        total_allocated = self.total_allocated
+        polo_matches = int(self.polo_match.sum())
+        return {
+            'Total_Alocados': total_allocated,
+            'Tutores_Polo_Preferido': polo_matches,
+            'Percentual_Polo_Preferido': (polo_matches / total_allocated) * 100 if total_allocated else 0.0
+        }
 
-    positions = pd.Series(
-        [_pref_position(p, s) for p, s in zip(prefs_series, df_allocation['Escola'])],
-        index=df_allocation.index
-    )
+    def cross_preferences(self):
+        """Análise cruzada: ganhou a escola, apenas o polo ou nenhuma das preferências."""
+        school_match = self.pref_position > 0
+        polo_only = ~school_match & self.polo_match
+        return {
+            'ESCOLA_PREFERIDA': int(school_match.sum()),
+            'POLO_PREFERIDO_APENAS': int(polo_only.sum()),
+            'SEM_PREFERENCIA_ATENDIDA': int((~school_match & ~polo_only).sum())
+        }
 
-    counts['1ª Opção'] = (positions == 1).sum()
-    counts['2ª Opção'] = (positions == 2).sum()
-    counts['3ª Opção'] = (positions == 3).sum()
-    counts['Fora das Preferências'] = (positions == 0).sum()
-            
-    # --- Construção do DataFrame de Resumo ---
-    results = []
-    for category, count in counts.items():
-        percentage = (count / total_allocated) * 100
-        results.append({
-            'Categoria': category,
-            'Quantidade': count,
-            'Percentual': round(percentage, 2)
-        })
-        
-    df_preferences_summary = pd.DataFrame(results)
-    
-    return df_preferences_summary
+    def unfilled_vacancies(self):
+        """Vagas ofertadas que sobraram, por escola e turno."""
+        columns = ['Escola', 'Turno da Vaga', 'Vagas Ofertadas', 'Vagas Preenchidas', 'Vagas Sobrando']
+        offered = [
+            (school, time_slot, count)
+            for (time_slot, school), count in self.raw_data.get('vacancies', {}).items() if count > 0
+        ]
+        if not offered:
+            return pd.DataFrame(columns=columns)
+
+        df_unfilled = pd.DataFrame(offered, columns=['Escola', 'Turno da Vaga', 'Vagas Ofertadas'])
+        if self.df_allocation.empty:
+            df_unfilled['Vagas Preenchidas'] = 0
+        else:
+            allocated_counts = self.df_allocation.groupby(['Escola', 'Turno da Vaga']).size()
+            df_unfilled['Vagas Preenchidas'] = allocated_counts.reindex(
+                pd.MultiIndex.from_frame(df_unfilled[['Escola', 'Turno da Vaga']]), fill_value=0
+            ).to_numpy()
+        df_unfilled['Vagas Sobrando'] = df_unfilled['Vagas Ofertadas'] - df_unfilled['Vagas Preenchidas']
 
-def analyze_cross_preferences(df_allocation, raw_data):
-    """
-    Realiza a Análise Cruzada para saber se o tutor ganhou a Escola, 
-    apenas o Polo, ou nenhuma das duas preferências.
-    """
-    preferences = raw_data.get('preferences', {})
-    tutor_districts = raw_data.get('tutor_districts', {})
-    school_districts = raw_data.get('school_districts', {})
-    
-    counts = {
-        'ESCOLA_PREFERIDA': 0,
-        'POLO_PREFERIDO_APENAS': 0,
-        'SEM_PREFERENCIA_ATENDIDA': 0
-    }
-    
-    # Verifica match de escola, polo ou nenhum via vetorização
-    prefs_series = df_allocation['Tutor Alocado'].map(preferences)
-    tutor_polos_series = df_allocation['Tutor Alocado'].map(tutor_districts)
-    school_polos = df_allocation['Escola'].map(school_districts).fillna('')
-
-    school_match = pd.Series(
-        isinstance(p, list) and s in p
-        for p, s in zip(prefs_series, df_allocation['Escola'])
-    )
-    polo_match = ~school_match & pd.Series(
-        sp and isinstance(tp, list) and sp in tp
-        for sp, tp in zip(school_polos, tutor_polos_series)
-    )
+        df_unfilled = df_unfilled[df_unfilled['Vagas Sobrando'] > 0]
+        if df_unfilled.empty:
+            return pd.DataFrame(columns=columns)
+        return df_unfilled.sort_values(by=['Escola', 'Turno da Vaga']).reset_index(drop=True)
 
-    counts['ESCOLA_PREFERIDA'] = school_match.sum()
-    counts['POLO_PREFERIDO_APENAS'] = polo_match.sum()
-    counts['SEM_PREFERENCIA_ATENDIDA'] = (~school_match & ~polo_match).sum()
-            
-    return counts
+    def unallocated(self):
+        """Diagnóstico dos tutores não alocados (ver 'analyze_unallocated_tutors')."""
+        return analyze_unallocated_tutors(self.df_allocation, self.raw_data)
 
 # =============================================================================
 # FUNÇÕES DE EXPORTAÇÃO DAS MÉTRICAS
 # =============================================================================
 
-def _generate_detailed_report(df_allocation, raw_data, params):
-    """Gera um DataFrame detalhado com o cálculo real das notas de cada alocação."""
-    rows = []
-    preferences = raw_data.get('preferences', {})
-    distances = raw_data.get('distances', {})
+def _instance_schools(raw_data):
+    """
+    Escolas listadas no arquivo desta instância, reaproveitando a leitura feita pela
+    otimização ('raw_data["schools"]') em vez de reler o CSV.
+    """
+    return set(raw_data.get('schools', []))
+
+def _scenario_distance_stats(raw_data, stats=None):
+    """
+    Média e maior distância válida entre as escolas da instância. Reaproveita os valores
+    calculados pela otimização ('stats'); resultados antigos, sem esses campos, são
+    recalculados a partir da matriz.
+    """
+    if stats and 'avg_scenario_distance' in stats and 'max_scenario_distance' in stats:
+        return stats['avg_scenario_distance'] or None, stats['max_scenario_distance'] or None
+
+    distances = DistanceMatrix.coerce(raw_data.get('distances', {}))
+    return distances.positive_stats(_instance_schools(raw_data))
+
+def _generate_detailed_report(df_allocation, raw_data, params, stats=None, kpis=None):
+    """
+    Gera um DataFrame detalhado com o cálculo real das notas de cada alocação.
+    Os cálculos são feitos sobre colunas inteiras: a posição da preferência vem da junção
+    do 'AllocationKPIs' ('kpis', construído aqui se não for informado) e as estatísticas
+    de distância vêm de 'stats' (ver '_scenario_distance_stats').
+    """
+    columns = ['Tutor', 'Time_Slot', 'Ranking', 'Escola', 'PrefPos', 'Distância', 'Base', 'Mult', 'Final']
+    if df_allocation.empty:
+        return pd.DataFrame(columns=columns)
+
+    kpis = kpis if kpis is not None else AllocationKPIs(df_allocation, raw_data)
+    distances = DistanceMatrix.coerce(raw_data.get('distances', {}))
     rankings = raw_data.get('rankings', {})
     
     base_multiplier = params.get('baseRanking', 10**9)
     total_tutors = len(raw_data.get('tutors', []))
     decrement = base_multiplier / total_tutors if total_tutors > 0 else 0
 
-    # Identifica as escolas ativas nesta instância específica
-    schools_file = params.get('arq_escolas')
-    if isinstance(schools_file, str):
-        df_instance_schools = pd.read_csv(schools_file)
-    else:
-        schools_file.seek(0)
-        df_instance_schools = pd.read_csv(schools_file)
-    school_col = 'Escola' if 'Escola' in df_instance_schools.columns else df_instance_schools.columns[0]
-    active_schools = set(df_instance_schools[school_col].unique())
-
-    # Calcula a média e a maior distância da matriz para os decaimentos (apenas escolas ativas e válidas)
-    dist_values = [
-        dist for (school_A, school_B), dist in distances.items() 
-        if school_A in active_schools and school_B in active_schools and dist != float('inf') and dist > 0
+    # Média e maior distância da matriz para os decaimentos (apenas escolas ativas e válidas)
+    distance_mean, max_distance = _scenario_distance_stats(raw_data, stats)
+    if distance_mean is None:
+        distance_mean, max_distance = 9000, 20000
+
+    alloc_tutors = df_allocation['Tutor Alocado'].to_numpy()
+    alloc_schools = df_allocation['Escola'].to_numpy()
+
+    tutor_ranks = df_allocation['Tutor Alocado'].map(rankings).fillna(total_tutors).astype(np.int64).to_numpy()
+    multipliers = np.maximum(base_multiplier - (tutor_ranks - 1) * decrement, 1)
+
+    # --- Alocações em uma das preferências: pontuação fixa da posição ---
+    pref_pos = kpis.pref_position
+    in_prefs = pref_pos > 0
+    pref_scores = np.array([0] + [params.get(f'pref{k}', 0) for k in range(1, pref_pos.max() + 1)])
+    base_scores = pref_scores[pref_pos]
+
+    # --- Demais alocações: decaimento pela distância até a 1ª preferência ---
+    ref_schools = kpis.first_preference
+    distance_values = distances.pairs(ref_schools, alloc_schools)
+    decayed = ~in_prefs & pd.notna(ref_schools)    # Tutores sem preferência alguma ganham base 0
+
+    if decayed.any():
+        calculated_dist = np.where(np.isinf(distance_values), max_distance, distance_values)[decayed]
+        base_pref = params.get('baseDistance', 5000)
+
+        if params.get('decayType', 'sigmoid') == 'linear':
+            decay_scores = np.maximum(0, base_pref * (1 - (calculated_dist / max_distance)))
+        else: # Decaimento Sigmoidal
+            scale = params.get('sigmoidCurve', 2000)
+            decay_scores = base_pref / (1 + np.exp((calculated_dist - distance_mean) / scale))
+
+        base_scores = base_scores.astype(np.float64)
+        base_scores[decayed] = decay_scores
+
+    df_detailed = pd.DataFrame({
+        'Tutor': alloc_tutors,
+        'Time_Slot': df_allocation['Turno da Vaga'].to_numpy(),
+        'Ranking': tutor_ranks,
+        'Escola': alloc_schools,
+        'PrefPos': np.where(in_prefs, pref_pos, np.nan) if not in_prefs.all() else pref_pos,
+        'Distância': np.where(in_prefs, np.nan, distance_values),
+        'Base': base_scores,
+        'Mult': multipliers,
+        'Final': base_scores * multipliers
+    })
+
+    return df_detailed.sort_values(['Ranking', 'Final'])
+
+def _chart_data(df_detailed):
+    """Dados plotados nos gráficos das métricas (percentuais, distâncias e ranking x benefício)."""
+    total_allocated = len(df_detailed)
+    pref_pos = df_detailed['PrefPos']
+
+    counts = [
+        (pref_pos == 1).sum(), (pref_pos == 2).sum(), (pref_pos == 3).sum(), pref_pos.isna().sum()
     ]
-    
-    distance_mean = sum(dist_values) / len(dist_values) if dist_values else 9000
-    max_distance = max(dist_values) if dist_values else 20000
-
-    # Extrai colunas como arrays para evitar overhead do iterrows
-    alloc_tutors = df_allocation['Tutor Alocado'].values
-    alloc_schools = df_allocation['Escola'].values
-    alloc_slots = df_allocation['Turno da Vaga'].values
-
-    for i in range(len(df_allocation)):
-        tutor = alloc_tutors[i]
-        school = alloc_schools[i]
-        time_slot = alloc_slots[i]
-
-        tutor_rank = rankings.get(tutor, total_tutors)
-        multiplier = max(base_multiplier - (tutor_rank - 1) * decrement, 1)
-        tutor_prefs = preferences.get(tutor, [])
-
-        if school in tutor_prefs:
-            pref_pos = tutor_prefs.index(school) + 1
-            base_score = params.get(f'pref{pref_pos}', 0)
-            distance = None
-        else:
-            pref_pos = None
-            ref_school = tutor_prefs[0] if tutor_prefs else None
-            distance = distances.get((ref_school, school), float('inf'))
-
-            if ref_school:
-                calculated_dist = max_distance if distance == float('inf') else distance
-                decay_type = params.get('decayType', 'sigmoid')
-                
-                if decay_type == 'linear':
-                    base_pref = params.get('baseDistance', 5000)
-                    base_score = max(0, base_pref * (1 - (calculated_dist / max_distance)))
-                else: # Decaimento Sigmoidal
-                    scale = params.get('sigmoidCurve', 2000)
-                    base_pref = params.get('baseDistance', 5000)
-                    base_score = base_pref / (1 + np.exp((calculated_dist - distance_mean) / scale))
-            else:
-                base_score = 0 # Tutores sem preferência alguma ganham base 0
-
-        final_score = base_score * multiplier
-
-        rows.append({
-            'Tutor': tutor, 'Time_Slot': time_slot, 'Ranking': tutor_rank, 'Escola': school,
-            'PrefPos': pref_pos, 'Distância': distance, 'Base': base_score, 'Mult': multiplier, 'Final': final_score
-        })
+    percentages = np.array(
+        [(count / total_allocated * 100) if total_allocated else 0 for count in counts], dtype=np.float64
+    )
 
-    if not rows:
-        return pd.DataFrame(columns=['Tutor', 'Time_Slot', 'Ranking', 'Escola', 'PrefPos', 'Distância', 'Base', 'Mult', 'Final'])
+    # Histograma de distâncias: apenas não-preferências válidas
+    dist_numeric = pd.to_numeric(df_detailed.loc[pref_pos.isna(), 'Distância'], errors='coerce')
+    distances = dist_numeric.replace([np.inf, -np.inf], np.nan).dropna().to_numpy(dtype=np.float64)
 
-    return pd.DataFrame(rows).sort_values(['Ranking', 'Final'])
+    rankings = pd.to_numeric(df_detailed['Ranking'], errors='coerce').to_numpy(dtype=np.float64)
+    benefits = pd.to_numeric(df_detailed['Final'], errors='coerce').to_numpy(dtype=np.float64)
+    return percentages, distances, rankings, benefits
 
-def _save_visual_charts(df_detailed, path):
-    """Gera os gráficos das métricas."""
-    plt.figure(figsize=(15, 4))
+def _chart_key(chart_data, dpi):
+    """Hash SHA-256 dos dados plotados: dados iguais geram o mesmo PNG."""
+    digest = hashlib.sha256(f"dpi={dpi}".encode('utf-8'))
+    for values in chart_data:
+        digest.update(len(values).to_bytes(8, 'little'))
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
 
-    total_allocated = len(df_detailed)
+def _render_charts(chart_data, dpi):
+    """
+    Desenha os gráficos das métricas com a API orientada a objetos do Matplotlib (Figure +
+    canvas Agg, sem o estado global do pyplot) e retorna o PNG em bytes. Cada chamada usa
+    a sua própria figura, então várias renderizações podem rodar em threads diferentes.
+    """
+    percentages, distances, rankings, benefits = chart_data
+
+    fig = Figure(figsize=(15, 4))
+    FigureCanvasAgg(fig)
+    ax_prefs, ax_dist, ax_rank = fig.subplots(1, 3)
 
     # --- Gráfico de Preferências Atendidas ---
-    plt.subplot(1, 3, 1)
-    count_pref1 = len(df_detailed[df_detailed['PrefPos'] == 1])
-    count_pref2 = len(df_detailed[df_detailed['PrefPos'] == 2])
-    count_pref3 = len(df_detailed[df_detailed['PrefPos'] == 3])
-    count_other_prefs = len(df_detailed[df_detailed['PrefPos'].isna()])
-    
-    pct_1 = (count_pref1 / total_allocated * 100) if total_allocated else 0
-    pct_2 = (count_pref2 / total_allocated * 100) if total_allocated else 0
-    pct_3 = (count_pref3 / total_allocated * 100) if total_allocated else 0
-    pct_outras = (count_other_prefs / total_allocated * 100) if total_allocated else 0
-    
-    barras = plt.bar(['1ª Pref', '2ª Pref', '3ª Pref', 'Outras'], [pct_1, pct_2, pct_3, pct_outras])
-    plt.title('Distribuição de Preferências Atendidas')
-    plt.ylabel('Porcentagem (%)')
+    barras = ax_prefs.bar(['1ª Pref', '2ª Pref', '3ª Pref', 'Outras'], percentages)
+    ax_prefs.set_title('Distribuição de Preferências Atendidas')
+    ax_prefs.set_ylabel('Porcentagem (%)')
 
     for barra in barras:
         yval = barra.get_height()
-        plt.text(barra.get_x() + barra.get_width()/2, yval + 1, f'{yval:.1f}%', ha='center', va='bottom')
+        ax_prefs.text(barra.get_x() + barra.get_width()/2, yval + 1, f'{yval:.1f}%', ha='center', va='bottom')
 
     # --- Histograma de Distâncias (Apenas não-preferências válidas) ---
-    plt.subplot(1, 3, 2)
-    dist_non_pref = df_detailed[df_detailed['PrefPos'].isna()]['Distância']
-    dist_numeric = pd.to_numeric(dist_non_pref, errors='coerce')
-    dist_clean = dist_numeric.replace([np.inf, -np.inf], np.nan).dropna()
-    
-    if not dist_clean.empty:
-        plt.hist(dist_clean, bins=20, edgecolor='black')
-    plt.title('Distribuição de Distâncias (Não-Preferências)')
-    plt.xlabel('Metros')
+    if distances.size:
+        ax_dist.hist(distances, bins=20, edgecolor='black')
+    ax_dist.set_title('Distribuição de Distâncias (Não-Preferências)')
+    ax_dist.set_xlabel('Metros')
 
     # --- Dispersão Ranking vs Benefício ---
-    plt.subplot(1, 3, 3)
-    rankings_numeric = pd.to_numeric(df_detailed['Ranking'], errors='coerce')
-    benefits_numeric = pd.to_numeric(df_detailed['Final'], errors='coerce')
-    
-    plt.scatter(rankings_numeric, benefits_numeric, alpha=0.5)
-    plt.title('Benefício vs Posição no Ranking')
-    plt.xlabel('Posição no Ranking')
-    plt.ylabel('Benefício')
-
-    plt.tight_layout()
-    plt.savefig(os.path.join(path, 'graficos_resultados.png'), dpi=150, bbox_inches='tight')
-    plt.close()
+    ax_rank.scatter(rankings, benefits, alpha=0.5)
+    ax_rank.set_title('Benefício vs Posição no Ranking')
+    ax_rank.set_xlabel('Posição no Ranking')
+    ax_rank.set_ylabel('Benefício')
+
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
+
+def _get_chart_pool():
+    global _chart_pool
+    with _chart_pool_lock:
+        if _chart_pool is None:
+            _chart_pool = ThreadPoolExecutor(max_workers=_CHART_WORKERS, thread_name_prefix='graficos')
+        return _chart_pool
+
+def render_charts(df_detailed, dpi=CHART_DPI):
+    """
+    PNG (bytes) dos gráficos das métricas do relatório detalhado. O resultado fica em
+    cache pelo hash dos dados plotados, então relatórios iguais não são redesenhados.
+    """
+    chart_data = _chart_data(df_detailed)
+    return _chart_cache.get_or_load(_chart_key(chart_data, dpi), lambda: _render_charts(chart_data, dpi))
 
-def _save_text_report(path, params, stats, df_detailed, df_unallocated, df_unfilled, polo_kpis, pref_summary, cross_analysis):
-    """Gera um relatorio_metricas.txt."""
+def render_charts_async(df_detailed, dpi=CHART_DPI):
+    """
+    Igual a 'render_charts', mas desenha em segundo plano (pool de threads) e retorna um
+    Future com o PNG. Os dados são extraídos antes de retornar, então o DataFrame pode ser
+    alterado em seguida; em caso de cache, o Future já vem concluído.
+    """
+    chart_data = _chart_data(df_detailed)
+    key = _chart_key(chart_data, dpi)
+    cached = _chart_cache.get(key)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+    return _get_chart_pool().submit(_chart_cache.get_or_load, key, lambda: _render_charts(chart_data, dpi))
+
+def _write_text_report(f, params, stats, df_detailed, df_unallocated, df_unfilled, polo_kpis, pref_summary, cross_analysis):
+    """Escreve o conteúdo do relatorio_metricas.txt no arquivo de texto 'f'."""
     total_allocated = len(df_detailed)
     
     total_benefit = df_detailed['Final'].sum() if total_allocated > 0 else 0
@@ -444,119 +532,202 @@ def _save_text_report(path, params, stats, df_detailed, df_unallocated, df_unfil
     decay_type = params.get('decayType', 'sigmoid')
     decay_str = f"{decay_type} (Escala: {params.get('sigmoidCurve', 'N/A')})" if decay_type == 'sigmoid' else decay_type
 
-    with open(os.path.join(path, 'relatorio_metricas.txt'), 'w', encoding='utf-8') as f:
-        f.write("RELATÓRIO DE OTIMIZAÇÃO DE ALOCAÇÃO\n")
-        f.write(f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-        f.write("-" * 50 + "\n\n")
-        
-        f.write("[ CONFIGURAÇÕES DA SIMULAÇÃO ]\n")
-        f.write(f"Motor     : Turnos ({params.get('shift_mode', 'N/A')}) | Decaimento ({decay_str})\n")
-        f.write(f"Pesos     : 1ª Opção ({params.get('pref1', 0)}) | 2ª Opção ({params.get('pref2', 0)}) | 3ª Opção ({params.get('pref3', 0)})\n\n")
-        
-        f.write("[ RESULTADOS GERAIS ]\n")
-        f.write(f"Vagas Ofertadas    : {stats.get('total_vacancies', 0)}\n")
-        f.write(f"Vagas Preenchidas  : {stats.get('filled_vacancies', 0)}\n")
-        if not df_unfilled.empty:
-            f.write(f"Vagas Ociosas      : {df_unfilled['Vagas Sobrando'].sum()} (Verificar CSV de vagas não preenchidas)\n")
-        f.write(f"Tutores De Fora    : {total_unallocated}\n\n")
-        
-        f.write(f"[ QUALIDADE DA ALOCAÇÃO (Base: {total_allocated} alocados) ]\n")
-        f.write(f"Benefício Total    : {total_benefit:,.2f}\n")
-        f.write(f"Ranking Médio      : {avg_ranking:.1f} (Cenário Ideal: {ideal_ranking:.1f})\n")
-        f.write(f"Desvio Padrão      : {equity_std_dev:,.2f}\n")
-        f.write(f"Distância Média    : {avg_dist_non_pref:.2f} m (Cenário Base: {avg_scenario_dist:.2f} m)\n\n")
-        
-        f.write("[ ATENDIMENTO DE PREFERÊNCIAS (ESCOLAS) ]\n")
-        f.write(f"1ª Opção           : {pref_dict.get('1ª Opção', (0,0))[0]:>3} ({pref_dict.get('1ª Opção', (0,0))[1]:>5.1f}%)\n")
-        f.write(f"2ª Opção           : {pref_dict.get('2ª Opção', (0,0))[0]:>3} ({pref_dict.get('2ª Opção', (0,0))[1]:>5.1f}%)\n")
-        f.write(f"3ª Opção           : {pref_dict.get('3ª Opção', (0,0))[0]:>3} ({pref_dict.get('3ª Opção', (0,0))[1]:>5.1f}%)\n")
-        f.write(f"Fora das Opções    : {pref_dict.get('Fora das Preferências', (0,0))[0]:>3} ({pref_dict.get('Fora das Preferências', (0,0))[1]:>5.1f}%)\n\n")
-
-        f.write("[ ATENDIMENTO DE POLOS E ANÁLISE CRUZADA ]\n")
-        f.write(f"Sucesso de Polo    : {polo_kpis.get('Percentual_Polo_Preferido', 0):.1f}% ({polo_kpis.get('Tutores_Polo_Preferido', 0)} tutores)\n")
-        f.write(f"Match Escola       : {(cross_analysis.get('ESCOLA_PREFERIDA', 0)/total_allocated)*100 if total_allocated else 0:.1f}%\n")
-        f.write(f"Match Só Polo      : {(cross_analysis.get('POLO_PREFERIDO_APENAS', 0)/total_allocated)*100 if total_allocated else 0:.1f}%\n")
-        f.write(f"Sem Match Nenhum   : {(cross_analysis.get('SEM_PREFERENCIA_ATENDIDA', 0)/total_allocated)*100 if total_allocated else 0:.1f}%\n\n")
-
-        if total_unallocated > 0:
-            f.write(f"[ DIAGNÓSTICO DOS {total_unallocated} NÃO ALOCADOS ]\n")
-            f.write(f"Melhor Ranking de Fora      : {best_unallocated_rank}\n")
-            f.write(f"Competição por Ranking      : {rank_competition} ({(rank_competition/total_unallocated)*100:.1f}%)\n")
-            f.write(f"Conflito de Disponibilidade : {time_conflict} ({(time_conflict/total_unallocated)*100:.1f}%)\n")
-            f.write(f"Otimização Global (Misto)   : {mixed_optimization} ({(mixed_optimization/total_unallocated)*100:.1f}%)\n")
-
-def get_summary_metrics(df_allocation, raw_data):
+    f.write("RELATÓRIO DE OTIMIZAÇÃO DE ALOCAÇÃO\n")
+    f.write(f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+    f.write("-" * 50 + "\n\n")
+    
+    f.write("[ CONFIGURAÇÕES DA SIMULAÇÃO ]\n")
+    f.write(f"Motor     : Turnos ({params.get('shift_mode', 'N/A')}) | Decaimento ({decay_str})\n")
+    f.write(f"Pesos     : 1ª Opção ({params.get('pref1', 0)}) | 2ª Opção ({params.get('pref2', 0)}) | 3ª Opção ({params.get('pref3', 0)})\n\n")
+    
+    f.write("[ RESULTADOS GERAIS ]\n")
+    f.write(f"Vagas Ofertadas    : {stats.get('total_vacancies', 0)}\n")
+    f.write(f"Vagas Preenchidas  : {stats.get('filled_vacancies', 0)}\n")
+    if not df_unfilled.empty:
+        f.write(f"Vagas Ociosas      : {df_unfilled['Vagas Sobrando'].sum()} (Verificar CSV de vagas não preenchidas)\n")
+    f.write(f"Tutores De Fora    : {total_unallocated}\n\n")
+    
+    f.write(f"[ QUALIDADE DA ALOCAÇÃO (Base: {total_allocated} alocados) ]\n")
+    f.write(f"Benefício Total    : {total_benefit:,.2f}\n")
+    f.write(f"Ranking Médio      : {avg_ranking:.1f} (Cenário Ideal: {ideal_ranking:.1f})\n")
+    f.write(f"Desvio Padrão      : {equity_std_dev:,.2f}\n")
+    f.write(f"Distância Média    : {avg_dist_non_pref:.2f} m (Cenário Base: {avg_scenario_dist:.2f} m)\n\n")
+    
+    f.write("[ ATENDIMENTO DE PREFERÊNCIAS (ESCOLAS) ]\n")
+    f.write(f"1ª Opção           : {pref_dict.get('1ª Opção', (0,0))[0]:>3} ({pref_dict.get('1ª Opção', (0,0))[1]:>5.1f}%)\n")
+    f.write(f"2ª Opção           : {pref_dict.get('2ª Opção', (0,0))[0]:>3} ({pref_dict.get('2ª Opção', (0,0))[1]:>5.1f}%)\n")
+    f.write(f"3ª Opção           : {pref_dict.get('3ª Opção', (0,0))[0]:>3} ({pref_dict.get('3ª Opção', (0,0))[1]:>5.1f}%)\n")
+    f.write(f"Fora das Opções    : {pref_dict.get('Fora das Preferências', (0,0))[0]:>3} ({pref_dict.get('Fora das Preferências', (0,0))[1]:>5.1f}%)\n\n")
+
+    f.write("[ ATENDIMENTO DE POLOS E ANÁLISE CRUZADA ]\n")
+    f.write(f"Sucesso de Polo    : {polo_kpis.get('Percentual_Polo_Preferido', 0):.1f}% ({polo_kpis.get('Tutores_Polo_Preferido', 0)} tutores)\n")
+    f.write(f"Match Escola       : {(cross_analysis.get('ESCOLA_PREFERIDA', 0)/total_allocated)*100 if total_allocated else 0:.1f}%\n")
+    f.write(f"Match Só Polo      : {(cross_analysis.get('POLO_PREFERIDO_APENAS', 0)/total_allocated)*100 if total_allocated else 0:.1f}%\n")
+    f.write(f"Sem Match Nenhum   : {(cross_analysis.get('SEM_PREFERENCIA_ATENDIDA', 0)/total_allocated)*100 if total_allocated else 0:.1f}%\n\n")
+
+    if total_unallocated > 0:
+        f.write(f"[ DIAGNÓSTICO DOS {total_unallocated} NÃO ALOCADOS ]\n")
+        f.write(f"Melhor Ranking de Fora      : {best_unallocated_rank}\n")
+        f.write(f"Competição por Ranking      : {rank_competition} ({(rank_competition/total_unallocated)*100:.1f}%)\n")
+        f.write(f"Conflito de Disponibilidade : {time_conflict} ({(time_conflict/total_unallocated)*100:.1f}%)\n")
+        f.write(f"Otimização Global (Misto)   : {mixed_optimization} ({(mixed_optimization/total_unallocated)*100:.1f}%)\n")
+
+def get_summary_metrics(df_allocation, raw_data, kpis=None):
     """.
     Retorna apenas os DataFrames e dicionários para exibição no STREAMLIT.
+    Todos os KPIs saem da mesma junção da alocação ('kpis', ver 'AllocationKPIs'),
+    construída aqui se não for informada.
     """
+    if kpis is None:
+        with instr.span('metrics.join', rows=len(df_allocation)):
+            kpis = AllocationKPIs(df_allocation, raw_data)
+    with instr.span('metrics.unallocated'):
+        unallocated = kpis.unallocated()
+    with instr.span('metrics.unfilled_vacancies'):
+        unfilled_vacancies = kpis.unfilled_vacancies()
+    with instr.span('metrics.polo_kpis'):
+        polo_kpis = kpis.polo_kpis()
+    with instr.span('metrics.preferences_summary'):
+        preferences_summary = kpis.preferences_summary()
+    with instr.span('metrics.cross_preferences'):
+        cross_preferences = kpis.cross_preferences()
+
     return {
-        'unallocated': analyze_unallocated_tutors(df_allocation, raw_data),
-        'unfilled_vacancies': analyze_unfilled_vacancies(df_allocation, raw_data),
-        'polo_kpis': analyze_polo_matches(df_allocation, raw_data),
-        'preferences_summary': analyze_preferences_matches(df_allocation, raw_data)
+        'unallocated': unallocated,
+        'unfilled_vacancies': unfilled_vacancies,
+        'polo_kpis': polo_kpis,
+        'preferences_summary': preferences_summary,
+        'cross_preferences': cross_preferences
     }
 
-def export_local_reports(allocation_result, params, base_path='alocacoes/'):
+def build_report(allocation_result, params):
     """
-    Gera exatamente os 6 arquivos e o histórico.
+    Calcula, sem gravar nada, todas as tabelas e indicadores do relatório da instância.
+
+    Retorna um dicionário com as chaves de 'get_summary_metrics' mais 'allocation' (DataFrame
+    da alocação), 'detailed' (ver '_generate_detailed_report'), 'charts' (Future com o PNG
+    dos gráficos, desenhado em segundo plano), 'stats' e 'params'.
     """
     df_allocation = allocation_result['dataframe']
     raw_data = allocation_result['raw_data']
     stats = allocation_result['stats']
 
-    # Lê o arquivo de escolas desta instância específica para isolar as escolas ativas
-    schools_file = params.get('arq_escolas')
-    if isinstance(schools_file, str):
-        df_instance_schools = pd.read_csv(schools_file)
-    else:
-        schools_file.seek(0)
-        df_instance_schools = pd.read_csv(schools_file)
-    school_col = 'Escola' if 'Escola' in df_instance_schools.columns else df_instance_schools.columns[0]
-    active_schools = set(df_instance_schools[school_col].unique())
+    # Distância Média da Instância (apenas entre escolas ativas nessa instância e com distâncias válidas)
+    distance_mean, distance_max = _scenario_distance_stats(raw_data, stats)
+    stats['avg_scenario_distance'] = distance_mean if distance_mean is not None else 0
+    stats['max_scenario_distance'] = distance_max if distance_max is not None else 0
 
-    # Calcula a Distância Média da Instância (apenas entre escolas ativas nessa instância e com distâncias válidas)
-    distances = raw_data.get('distances', {})
-
-    dist_values = [
-        dist for (school_A, school_B), dist in distances.items() 
-        if school_A in active_schools and school_B in active_schools and dist != float('inf') and dist > 0
-    ]
+    # Gera todos os DataFrames de métricas a partir de uma única junção
+    with instr.span('metrics.join', rows=len(df_allocation)):
+        kpis = AllocationKPIs(df_allocation, raw_data)
+    metrics = get_summary_metrics(df_allocation, raw_data, kpis=kpis)
     
-    distance_mean = sum(dist_values) / len(dist_values) if dist_values else 0
-    stats['avg_scenario_distance'] = distance_mean
+    with instr.span('metrics.detailed_report', rows=len(df_allocation)):
+        df_detailed = _generate_detailed_report(df_allocation, raw_data, params, stats=stats, kpis=kpis)
+
+    return {
+        **metrics,
+        'allocation': df_allocation,
+        'detailed': df_detailed,
+        # Os gráficos são desenhados em segundo plano enquanto os demais arquivos são gerados
+        'charts': render_charts_async(df_detailed),
+        'stats': stats,
+        'params': params
+    }
+
+def _write_text_member(f, report):
+    """Escreve o relatorio_metricas.txt (UTF-8) no arquivo binário 'f'."""
+    text = io.TextIOWrapper(f, encoding='utf-8')
+    try:
+        _write_text_report(
+            text, report['params'], report['stats'], report['detailed'], report['unallocated'],
+            report['unfilled_vacancies'], report['polo_kpis'], report['preferences_summary'],
+            report['cross_preferences']
+        )
+    finally:
+        text.flush()
+        text.detach()    # Mantém 'f' aberto para quem o criou
+
+def _chart_bytes(charts):
+    return charts.result() if isinstance(charts, Future) else charts
+
+def _report_members(report):
+    """
+    Arquivos do relatório, gerados sob demanda: produz (nome, etapa, escrita), em que
+    'escrita' grava o conteúdo do arquivo em um arquivo binário já aberto. Os gráficos vêm
+    por último, dando tempo para a renderização em segundo plano terminar.
+    """
+    yield 'alocacoes.csv', 'export.csv', lambda f: report['allocation'].to_csv(f, index=False)
+    yield 'relatorio_nao_alocados.csv', 'export.csv', lambda f: report['unallocated'].to_csv(f, index=False)
+    yield 'relatorio_vagas_nao_preenchidas.csv', 'export.csv', lambda f: report['unfilled_vacancies'].to_csv(f, index=False)
+    yield 'report_alocacao.csv', 'export.csv', lambda f: report['detailed'].to_csv(f, index=False)
+    yield 'relatorio_metricas.txt', 'export.text_report', lambda f: _write_text_member(f, report)
+    yield 'graficos_resultados.png', 'export.charts', lambda f: f.write(_chart_bytes(report['charts']))
+
+def build_report_zip(allocation_result=None, params=None, report=None):
+    """
+    Pacote com os 6 arquivos do relatório em um ZIP gerado inteiramente em memória (sem
+    acesso ao disco), retornado em bytes. Aceita o resultado da otimização e os parâmetros
+    ou um 'report' já calculado por 'build_report'.
+
+    Cada arquivo é gerado somente na sua vez e gravado (comprimido) direto no ZIP, então
+    nunca há mais de um arquivo do relatório materializado ao mesmo tempo.
+    """
+    if report is None:
+        report = build_report(allocation_result, params)
+
+    buffer = io.BytesIO()
+    date_time = datetime.now().timetuple()[:6]
+    with zipfile.ZipFile(buffer, 'w') as bundle:
+        for name, stage, write in _report_members(report):
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            # O PNG já é comprimido: guardá-lo sem recompressão poupa tempo
+            info.compress_type = zipfile.ZIP_STORED if name.endswith('.png') else zipfile.ZIP_DEFLATED
+            with instr.span(stage):
+                with bundle.open(info, 'w') as member:
+                    write(member)
+    return buffer.getvalue()
+
+def write_instance_reports(allocation_result, params, base_path='alocacoes/'):
+    """
+    Gera os 6 arquivos da instância, sem tocar no histórico.
+    Retorna o caminho da pasta e a linha do histórico, para ser gravada depois com
+    'merge_history_rows' (usado pelo processamento em lote, que grava o histórico
+    somente no processo principal).
+    """
+    report = build_report(allocation_result, params)
 
     # Define o nome da pasta com base no ID da Instância
     instance_id = params.get('Instancia_ID', 'Default_Run')
     output_path = os.path.join(base_path, instance_id)
     os.makedirs(output_path, exist_ok=True)
 
-    # Gera todos os DataFrames de métricas
-    df_unallocated = analyze_unallocated_tutors(df_allocation, raw_data)
-    df_unfilled = analyze_unfilled_vacancies(df_allocation, raw_data)
-    polo_kpis = analyze_polo_matches(df_allocation, raw_data)
-    pref_summary = analyze_preferences_matches(df_allocation, raw_data)
-    cross_analysis = analyze_cross_preferences(df_allocation, raw_data)
-    
-    df_detailed = _generate_detailed_report(df_allocation, raw_data, params)
-
-    df_allocation.to_csv(os.path.join(output_path, 'alocacoes.csv'), index=False)
-    df_unallocated.to_csv(os.path.join(output_path, 'relatorio_nao_alocados.csv'), index=False)
-    df_unfilled.to_csv(os.path.join(output_path, 'relatorio_vagas_nao_preenchidas.csv'), index=False)
-    df_detailed.to_csv(os.path.join(output_path, 'report_alocacao.csv'), index=False)
-
-    _save_visual_charts(df_detailed, output_path)
-
-    _save_text_report(output_path, params, stats, df_detailed, df_unallocated, df_unfilled, polo_kpis, pref_summary, cross_analysis)
+    for name, stage, write in _report_members(report):
+        with instr.span(stage):
+            with open(os.path.join(output_path, name), 'wb') as f:
+                write(f)
 
-    _update_general_history(base_path, params, stats, df_detailed, df_unallocated, polo_kpis, cross_analysis)
+    history_row = _build_history_row(
+        params, report['stats'], report['detailed'], report['unallocated'],
+        report['polo_kpis'], report['cross_preferences']
+    )
 
     print(f"✅ Bateria de relatórios criados com sucesso em: {output_path}")
+    return output_path, history_row
+
+def export_local_reports(allocation_result, params, base_path='alocacoes/', export_csv=False):
+    """
+    Gera exatamente os 6 arquivos na pasta da instância e grava a linha da execução no
+    histórico da pasta base (banco SQLite historico_alocacoes.db). O historico_alocacoes.csv
+    é regravado inteiro, por isso só é exportado com 'export_csv' ou, de uma vez ao final
+    de várias execuções, com 'export_history_csv' (ou 'python history.py --csv').
+    """
+    output_path, history_row = write_instance_reports(allocation_result, params, base_path)
+    merge_history_rows(base_path, [history_row], export_csv=export_csv)
     return output_path
 
-def _update_general_history(base_path, params, stats, df_detailed, df_unallocated, polo_kpis, cross_analysis):
-    """Gera o arquivo historico_alocacoes.csv."""
-    history_file = os.path.join(base_path, 'historico_alocacoes.csv')
-    
+def _build_history_row(params, stats, df_detailed, df_unallocated, polo_kpis, cross_analysis):
+    """Monta a linha do historico_alocacoes.csv referente a uma instância."""
     total_allocated = len(df_detailed)
     total_benefit = df_detailed['Final'].sum() if total_allocated > 0 else 0
     avg_ranking = df_detailed['Ranking'].mean() if total_allocated > 0 else 0
@@ -637,20 +808,19 @@ def _update_general_history(base_path, params, stats, df_detailed, df_unallocate
         'Best_Unalloc_Rank': best_unallocated_rank
     }
     
-    df_new = pd.DataFrame([new_entry])
-    
-    if os.path.exists(history_file):
-        df_hist = pd.read_csv(history_file)
-        
-        # Verifica qual é a instância atual (ex: 'I0')
-        instancia_atual = params.get('Instancia_ID', 'N/A')
-        
-        # Remove a linha antiga da mesma instância, se existir, para evitar duplicatas
-        if 'Instance_ID' in df_hist.columns and instancia_atual in df_hist['Instance_ID'].values:
-            df_hist = df_hist[df_hist['Instance_ID'] != instancia_atual]
-            
-        df_hist = pd.concat([df_hist, df_new], ignore_index=True)
-    else:
-        df_hist = df_new
-        
-    df_hist.to_csv(history_file, index=False)
+    return new_entry
+
+def merge_history_rows(base_path, rows, export_csv=False):
+    """
+    Grava as linhas no histórico de execuções da pasta (banco SQLite, ver 'history'),
+    substituindo as linhas antigas das mesmas instâncias. A gravação é atômica e segura
+    entre processos. Com 'export_csv', o historico_alocacoes.csv da pasta (que é
+    regravado inteiro) também é exportado em seguida ('export_history_csv').
+    """
+    history.open_history(base_path).upsert(rows)
+    if export_csv:
+        export_history_csv(base_path)
+
+def export_history_csv(base_path='alocacoes/'):
+    """Exporta o histórico da pasta para historico_alocacoes.csv. Retorna o caminho do arquivo."""
+    return history.open_history(base_path).export_csv(os.path.join(base_path, history.HISTORY_CSV))
@@ -1,8 +1,22 @@
 import csv
 import io
 import math
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from types import SimpleNamespace
+import numpy as np
 import pandas as pd
-from mip import Model, xsum, MAXIMIZE, BINARY, CBC, OptimizationStatus
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components, min_weight_full_bipartite_matching
+from mip import Model, xsum, MAXIMIZE, BINARY, CONTINUOUS, INF, CBC, OptimizationStatus
+import instrumentation as instr
 
 # =============================================================================
 # FUNÇÕES AUXILIARES
@@ -176,7 +190,137 @@ def read_schools(file_input, shift_mode):
     
     return schools, vacancies, school_districts, len(schools), total_vacancies
 
-def read_distances(file_input):
+class DistanceMatrix(Mapping):
+    """
+    Matriz de distâncias densa entre escolas.
+
+    Guarda os valores em um array NumPy contíguo (origens x destinos) e os mapas
+    nome -> índice de cada eixo, oferecendo consultas O(1) e fatias vetorizadas.
+    Pares ausentes no arquivo são armazenados como 'inf'.
+
+    Também se comporta como o antigo dicionário {(origem, destino): valor}
+    (get, items, 'in', etc.), de modo que o código que recebia o dicionário
+    continua funcionando sem alterações.
+    """
+
+    def __init__(self, origins, targets, values):
+        self.origins = list(origins)
+        self.targets = list(targets)
+        self.origin_index = {s: i for i, s in enumerate(self.origins)}
+        self.target_index = {s: j for j, s in enumerate(self.targets)}
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self._padded = None
+        self._stats_cache = {}
+
+    @classmethod
+    def from_dict(cls, distances):
+        """Constrói a matriz a partir de um dicionário {(origem, destino): valor}."""
+        origins = list(dict.fromkeys(a for a, _ in distances))
+        targets = list(dict.fromkeys(b for _, b in distances))
+        matrix = cls(origins, targets, np.full((len(origins), len(targets)), np.inf))
+
+        for (a, b), dist in distances.items():
+            matrix.values[matrix.origin_index[a], matrix.target_index[b]] = dist
+
+        return matrix
+
+    @classmethod
+    def coerce(cls, distances):
+        """Aceita uma DistanceMatrix ou um dicionário de distâncias e devolve sempre uma DistanceMatrix."""
+        if isinstance(distances, cls):
+            return distances
+        return cls.from_dict(distances or {})
+
+    # --- Interface de dicionário (compatibilidade) ---
+
+    def __getitem__(self, key):
+        origin, target = key
+        i = self.origin_index.get(origin)
+        j = self.target_index.get(target)
+        if i is None or j is None or not np.isfinite(self.values[i, j]):
+            raise KeyError(key)
+        return self.values[i, j].item()
+
+    def __iter__(self):
+        rows, cols = np.nonzero(np.isfinite(self.values))
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            yield (self.origins[i], self.targets[j])
+
+    def __len__(self):
+        if 'count' not in self._stats_cache:
+            self._stats_cache['count'] = int(np.isfinite(self.values).sum())
+        return self._stats_cache['count']
+
+    # --- Consultas vetorizadas ---
+
+    def distance(self, origin, target, default=np.inf):
+        """Distância entre duas escolas em O(1); 'default' se o par não existir."""
+        i = self.origin_index.get(origin)
+        j = self.target_index.get(target)
+        if i is None or j is None:
+            return default
+        return self.values[i, j].item()
+
+    def row(self, origin, targets=None):
+        """Linha de distâncias a partir de 'origin' (opcionalmente restrita a 'targets')."""
+        return self.submatrix([origin], self.targets if targets is None else targets)[0]
+
+    def submatrix(self, origins, targets):
+        """
+        Fatia a matriz para as listas de origens e destinos informadas, na ordem dada.
+        Nomes ausentes (ou None) resultam em linhas/colunas preenchidas com 'inf'.
+        """
+        rows = np.array([self.origin_index.get(o, -1) for o in origins], dtype=np.intp)
+        cols = np.array([self.target_index.get(t, -1) for t in targets], dtype=np.intp)
+        return self._padded_values()[np.ix_(rows, cols)]
+
+    def pairs(self, origins, targets):
+        """
+        Distâncias elemento a elemento: a k-ésima posição é a distância de 'origins[k]'
+        até 'targets[k]'. Nomes ausentes (ou None) resultam em 'inf'.
+        """
+        rows = np.array([self.origin_index.get(o, -1) for o in origins], dtype=np.intp)
+        cols = np.array([self.target_index.get(t, -1) for t in targets], dtype=np.intp)
+        return self._padded_values()[rows, cols]
+
+    def _padded_values(self):
+        if self._padded is None:
+            # Linha e coluna extras com 'inf' para onde apontam os nomes desconhecidos
+            self._padded = np.full((len(self.origins) + 1, len(self.targets) + 1), np.inf)
+            self._padded[:-1, :-1] = self.values
+        return self._padded
+
+    def max_distance(self):
+        """Maior distância registrada na matriz (0 se a matriz estiver vazia)."""
+        if 'max' not in self._stats_cache:
+            finite = self.values[np.isfinite(self.values)]
+            self._stats_cache['max'] = finite.max().item() if finite.size else 0
+        return self._stats_cache['max']
+
+    def positive_stats(self, schools=None):
+        """
+        Média e maior valor das distâncias válidas (> 0 e finitas) entre as escolas
+        informadas (todas, se 'schools' for None). Devolve (None, None) se não houver
+        nenhuma distância válida. O resultado fica em cache por conjunto de escolas.
+        """
+        key = ('positive', None if schools is None else frozenset(schools))
+        if key not in self._stats_cache:
+            if schools is None:
+                block = self.values
+            else:
+                rows = [self.origin_index[s] for s in self.origins if s in key[1]]
+                cols = [self.target_index[s] for s in self.targets if s in key[1]]
+                block = self.values[np.ix_(rows, cols)]
+
+            valid = block[np.isfinite(block) & (block > 0)]
+            if valid.size:
+                self._stats_cache[key] = (valid.mean().item(), valid.max().item())
+            else:
+                self._stats_cache[key] = (None, None)
+
+        return self._stats_cache[key]
+
+def load_distance_matrix(file_input):
     """
     Lê a matriz de distâncias entre escolas, aceitando tanto o caminho do arquivo (string) 
     quanto o objeto de arquivo (BytesIO do Streamlit).
@@ -189,10 +333,8 @@ def read_distances(file_input):
       * Demais colunas: Distância para escola do cabeçalho (número)
 
     Retorna:
-    - distances: Dicionário de distâncias {(origem, destino): valor}
+    - distances: DistanceMatrix com as distâncias (células vazias valem 0)
     """
-    distances = {}
-
     reader_source, should_close = _open_file(file_input)
 
     try:
@@ -205,27 +347,23 @@ def read_distances(file_input):
         except StopIteration:
             raise ValueError("O arquivo de distâncias está vazio.")
         
+        origins = []
+        rows = []
+
         # Processa cada linha da matriz
         for row in reader:
             if not row:     # Pula linhas vazias
                 continue
             
-            origin_school = row[0].strip()
-            for idx, distance_str in enumerate(row[1:]):
-                
-                # Garante que não tente ler além do número de escolas do cabeçalho
-                if idx < len(schools):
-                    target_school = schools[idx]
-                    
-                    # Converte o valor da distância
-                    distance_val = distance_str.strip()
-                    if distance_val:
-                        distances[(origin_school, target_school)] = (
-                            float(distance_val) if '.' in distance_val else int(distance_val)
-                        )
-                    else:
-                        # Trata caso de célula vazia como distância 0 ou indefinida
-                        distances[(origin_school, target_school)] = 0 
+            origins.append(row[0].strip())
+
+            # Células além do cabeçalho são ignoradas e as que faltam ficam como 'inf'
+            cells = [c.strip() for c in row[1:len(schools) + 1]]
+            values = [float(c) if c else 0.0 for c in cells]   # Célula vazia = distância 0
+            values.extend([np.inf] * (len(schools) - len(values)))
+            rows.append(values)
+
+        values = np.array(rows, dtype=np.float64).reshape(len(origins), len(schools))
     
     except Exception as e:
         # Captura outros erros e envia para o Streamlit/Console
@@ -235,68 +373,68 @@ def read_distances(file_input):
         # Garante fechamento apenas se o arquivo foi aberto fisicamente
         if should_close:
             reader_source.close()
-            
-    return distances
+
+    # Se a mesma origem aparecer duas vezes, vale a última linha (como no antigo dicionário)
+    if len(set(origins)) != len(origins):
+        last = {o: i for i, o in enumerate(origins)}
+        origins = list(last)
+        values = values[list(last.values())]
+
+    return DistanceMatrix(origins, schools, values)
+
+def read_distances(file_input):
+    """
+    Lê a matriz de distâncias entre escolas (caminho ou BytesIO do Streamlit).
+    Mantida por compatibilidade: equivale a 'load_distance_matrix'.
+
+    Retorna:
+    - distances: DistanceMatrix, que também aceita o acesso {(origem, destino): valor}
+    """
+    return load_distance_matrix(file_input)
 
 def calculate_mean_distances(file_input, active_schools):
     """
-    Lê a matriz de distâncias e calcula a média dinamicamente.
-    Aceita tanto o caminho do arquivo (string) quanto o objeto em memória (Streamlit).
+    Calcula a média das distâncias entre as escolas ativas.
+    Aceita uma DistanceMatrix já carregada, o caminho do arquivo (string) ou o objeto em memória (Streamlit).
     Considera apenas as escolas presentes na lista 'active_schools'.
     
     Args:
-    - file_input: Caminho do arquivo ou objeto BytesIO/StringIO.
+    - file_input: DistanceMatrix, caminho do arquivo ou objeto BytesIO.
     - active_schools: Lista de strings com os nomes das escolas ativas.
 
     Retorna:
     - distances_mean: A média (float) das distâncias > 0 entre as escolas ativas.
     """
-    distances_mean = 0.0
-
-    #print(f"--- Calculando média de distância dinâmica ---")
-    #print(f"Escolas ativas neste cenário: {len(active_schools)}")
-
-    # --- LÓGICA HÍBRIDA (Super simples graças ao Pandas) ---
-    if not isinstance(file_input, str):
-        file_input.seek(0) # Rebobina o arquivo se for um upload do Streamlit
+    if isinstance(file_input, DistanceMatrix):
+        distance_matrix = file_input
+    else:
+        if isinstance(file_input, str) and not os.path.exists(file_input):
+            # Mantido para caso file_input seja uma string de um caminho incorreto
+            raise FileNotFoundError("ERRO: O arquivo de distâncias não foi encontrado.")
+        distance_matrix = load_distance_matrix(file_input)
+
+    # Identifica escolas que estão na lista de vagas mas NÃO estão na matriz
+    valid_schools = [
+        e for e in active_schools
+        if e in distance_matrix.origin_index and e in distance_matrix.target_index
+    ]
+    missing_count = len(active_schools) - len(valid_schools)
+
+    if missing_count > 0:
+        print(f"⚠️ ATENÇÃO: {missing_count} escolas ativas NÃO foram encontradas na matriz de distâncias.")
+
+    if len(valid_schools) >= 2:
+        print(f"Matriz filtrada para {len(valid_schools)} x {len(valid_schools)} escolas.")
+        distances_mean, _ = distance_matrix.positive_stats(valid_schools)
+    else:
+        print("AVISO: Menos de 2 escolas ativas na matriz. Usando matriz completa.")
+        distances_mean, _ = distance_matrix.positive_stats()
 
-    try:
-        # O Pandas lê diretamente tanto do disco quanto da memória!
-        df = pd.read_csv(file_input, index_col=0)
-        
-        # Identifica escolas que estão na lista de vagas mas NÃO estão na matriz
-        missing_schools = [e for e in active_schools if e not in df.index]
-        
-        if len(missing_schools) > 0:
-            print(f"⚠️ ATENÇÃO: {len(missing_schools)} escolas ativas NÃO foram encontradas na matriz de distâncias.")
-            # Descomente a linha abaixo se quiser ver os nomes das escolas faltando
-            # for school in missing_schools: print(f"   -> {school}")
-
-        # Interseção: escolas que estão 'ativas' E que existem na matriz
-        valid_schools = [e for e in active_schools if e in df.index]
-        
-        if len(valid_schools) >= 2:
-            print(f"Matriz filtrada para {len(valid_schools)} x {len(valid_schools)} escolas.")
-            df = df.loc[valid_schools, valid_schools]
-        else:
-            print("AVISO: Menos de 2 escolas ativas na matriz. Usando matriz completa.")
-        
-        # Filtra distâncias maiores que zero
-        relevant_distances = df.stack()
-        relevant_distances = relevant_distances[relevant_distances > 0]
-        
-        if not relevant_distances.empty:
-            distances_mean = relevant_distances.mean()
-            print(f"Distancia Média entre escolas dessa instância = {distances_mean:.2f}")
-        else:
-            print("Nenhuma distância válida encontrada > 0. Retornando 0.")
-            
-    except FileNotFoundError:
-        # Mantido para caso file_input seja uma string de um caminho incorreto
-        raise FileNotFoundError("ERRO: O arquivo de distâncias não foi encontrado.")
-    except Exception as e:
-        raise ValueError(f"Erro ao processar o arquivo de distâncias para calcular a média: {e}")
+    if distances_mean is None:
+        print("Nenhuma distância válida encontrada > 0. Retornando 0.")
+        return 0.0
 
+    print(f"Distancia Média entre escolas dessa instância = {distances_mean:.2f}")
     return distances_mean
 
 # =============================================================================
@@ -321,6 +459,119 @@ def sigmoid_decay(distance, bmax, mean, scale):
     """
     return bmax / (1 + math.exp((distance - mean) / scale))
 
+def calculate_ranking_multipliers(tutors, rankings, baseRanking):
+    """
+    Calcula o vetor de multiplicadores de ranking, alinhado à lista 'tutors'.
+    O 1º colocado recebe 'baseRanking' e o valor decresce linearmente até o mínimo de 1.
+    """
+    total_tutors = len(tutors)
+    decrement = baseRanking / total_tutors if total_tutors > 0 else 0
+
+    ranking_positions = np.array([rankings.get(t, total_tutors) for t in tutors], dtype=np.int64)
+    return np.maximum(baseRanking - (ranking_positions - 1) * decrement, 1)
+
+def _preference_positions(tutors, schools, preferences):
+    """
+    Monta a matriz tutores x escolas com a posição (1, 2, 3) da escola nas preferências
+    do tutor (0 quando a escola não é uma preferência) e o vetor com a escola de
+    referência (1ª preferência válida) de cada tutor.
+    """
+    school_index = {s: j for j, s in enumerate(schools)}
+    positions = np.zeros((len(tutors), len(schools)), dtype=np.int8)
+    reference_schools = []
+
+    for i, tutor in enumerate(tutors):
+        prefs = preferences.get(tutor, [])
+        valid_prefs = [p for p in prefs if p and str(p).strip()]
+        reference_schools.append(valid_prefs[0] if valid_prefs else None)
+
+        for pos, school in enumerate(prefs):
+            j = school_index.get(school)
+            if j is not None and school and str(school).strip():
+                positions[i, j] = pos + 1
+
+    return positions, reference_schools
+
+
+def calculate_base_scores(tutors, schools, preferences, distances,
+                          decay_type,
+                          pref1,
+                          pref2,
+                          pref3,
+                          baseDistance,
+                          sigmoidCurve,
+                          distance_mean):
+    """
+    Calcula de forma vetorizada a matriz tutores x escolas com a pontuação base
+    (antes do multiplicador de ranking) de cada par.
+
+    - Escolas preferidas recebem pref1, pref2 ou pref3 conforme a posição.
+    - Demais escolas recebem o decaimento (linear ou sigmoide) da distância até a
+      1ª preferência do tutor, truncado para inteiro e com piso de 1.
+    - Tutores sem preferências recebem 0 nas escolas não preferidas.
+    """
+    positions, reference_schools = _preference_positions(tutors, schools, preferences)
+
+    # Distância entre a escola de referência de cada tutor e cada escola ('inf' se ausente)
+    distances = DistanceMatrix.coerce(distances)
+    distance_matrix = distances.submatrix(reference_schools, schools)
+
+    has_reference = np.array([r is not None for r in reference_schools], dtype=bool)
+    decay_mask = (positions == 0) & has_reference[:, None]
+
+    if decay_type == 'linear':
+        max_distance = distances.max_distance()
+        if max_distance == 0:
+            decay_scores = np.zeros_like(distance_matrix)
+        else:
+            decay_scores = (-baseDistance / max_distance) * distance_matrix + baseDistance    # Fórmula da reta decrescente
+            decay_scores = np.where(distance_matrix >= max_distance, 0, np.maximum(decay_scores, 0))
+    elif decay_type == 'sigmoid':
+        if sigmoidCurve == 0 and decay_mask.any():
+            raise ValueError("A escala da curva sigmoide deve ser maior que zero.")
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            decay_scores = baseDistance / (1 + np.exp((distance_matrix - distance_mean) / sigmoidCurve))
+    else:
+        raise ValueError(f"Tipo de decaimento '{decay_type}' desconhecido.")
+
+    # Equivalente ao int() + max(benefit_score, 1) aplicado par a par
+    decay_scores = np.maximum(np.trunc(decay_scores), 1)
+
+    scores = np.zeros(positions.shape, dtype=np.float64)
+    scores[decay_mask] = decay_scores[decay_mask]
+    scores[positions == 1] = pref1
+    scores[positions == 2] = pref2
+    scores[positions == 3] = pref3
+
+    return scores
+
+def calculate_benefit_matrix(tutors, schools, preferences, distances, rankings,
+                             decay_type,
+                             pref1,
+                             pref2,
+                             pref3,
+                             baseDistance,
+                             baseRanking,
+                             sigmoidCurve,
+                             distance_mean):
+    """
+    Calcula a matriz densa de benefícios (linhas alinhadas a 'tutors' e colunas a 'schools')
+    aplicando o multiplicador de ranking sobre a pontuação base de cada par.
+    """
+    base_scores = calculate_base_scores(
+        tutors, schools, preferences, distances,
+        decay_type=decay_type,
+        pref1=pref1,
+        pref2=pref2,
+        pref3=pref3,
+        baseDistance=baseDistance,
+        sigmoidCurve=sigmoidCurve,
+        distance_mean=distance_mean
+    )
+    multipliers = calculate_ranking_multipliers(tutors, rankings, baseRanking)
+
+    return base_scores * multipliers[:, None]
+
 def calculate_benefits(tutors, schools, preferences, distances, rankings, 
                         decay_type,
                         pref1, 
@@ -333,60 +584,26 @@ def calculate_benefits(tutors, schools, preferences, distances, rankings,
     """
     Calcula os benefícios para cada par (tutor, escola) usando a curva de decaimento especificada.
     Recebe todos os parâmetros de configuração (pref1, baseDistance, etc.) vindos do Streamlit.
+
+    Mantido por compatibilidade: os valores vêm de 'calculate_benefit_matrix' e são
+    devolvidos no formato {(tutor, escola): benefício}.
     """
+    benefit_matrix = calculate_benefit_matrix(
+        tutors, schools, preferences, distances, rankings,
+        decay_type=decay_type,
+        pref1=pref1,
+        pref2=pref2,
+        pref3=pref3,
+        baseDistance=baseDistance,
+        baseRanking=baseRanking,
+        sigmoidCurve=sigmoidCurve,
+        distance_mean=distance_mean
+    )
 
     benefits = {}
-    total_tutors = len(tutors)
+    for tutor, row in zip(tutors, benefit_matrix.tolist()):
+        benefits.update(zip(((tutor, school) for school in schools), row))
 
-    decrement = baseRanking / total_tutors if total_tutors > 0 else 0
-
-    maior_distancia = max(distances.values()) if distances else 0
-    
-    for tutor in tutors:
-        prefs = preferences.get(tutor, [])
-        ranking_position = rankings.get(tutor, total_tutors)
-        # Usa o parâmetro 'baseRanking'
-        multiplier = max(baseRanking - (ranking_position - 1) * decrement, 1)
-        
-        valid_prefs = [p for p in prefs if p and str(p).strip()]
-        reference_school = valid_prefs[0] if valid_prefs else None
-
-        # Dicionário com a posição de cada preferência
-        pref_positions = {p: i + 1 for i, p in enumerate(prefs) if p and str(p).strip()}
-
-        for school in schools:
-            position = pref_positions.get(school)
-            if position is not None:
-                # Benefício baseado na posição da preferência (1ª, 2ª ou 3ª)
-                if position == 1:
-                    benefit_score = pref1
-                elif position == 2:
-                    benefit_score = pref2
-                elif position == 3:
-                    benefit_score = pref3
-                else:
-                    benefit_score = 0
-            else:
-                if reference_school:
-                    distance = distances.get((reference_school, school), float('inf'))
-
-                    if decay_type == 'linear':
-                        # Passa o parâmetro 'baseDistance'
-                        benefit_score = int(linear_decay(distance, maior_distancia, baseDistance))
-                    elif decay_type == 'sigmoid':
-                        # Passa todos os parâmetros necessários
-                        benefit_score = int(sigmoid_decay(distance, 
-                                                            bmax=baseDistance, 
-                                                            mean=distance_mean, 
-                                                            scale=sigmoidCurve))
-
-                    benefit_score = max(benefit_score, 1)
-                else:
-                    benefit_score = 0
-            
-            # Aplica o multiplicador baseado na posição do ranking
-            benefits[(tutor, school)] = benefit_score * multiplier
-    
     return benefits
 
 def extract_allocation_results(X_dict):
@@ -416,160 +633,1682 @@ def extract_allocation_results(X_dict):
     return results
 
 # =============================================================================
-# FUNÇÃO PRINCIPAL DA OTIMIZAÇÃO
+# CONSTRUÇÃO DO MODELO
 # =============================================================================
 
-def generate_allocation(tutors_file, schools_file, distances_file, params_dict):
+def build_allocation_model(tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                           candidate_mask=None, continuous=False, threads=1):
     """
-    Função mestra que executa todo o processo de otimização.
-    
-    Recebe:
-    - tutors_file: O objeto de arquivo CSV dos tutores (ou string de caminho)
-    - schools_file: O objeto de arquivo CSV das escolas (ou string de caminho)
-    - distances_file: O objeto ou caminho do arquivo da matriz de distâncias
-    - params_dict: Um dicionário com todos os parâmetros da página de config
-    
+    Constrói o modelo MIP da alocação em uma única passada sobre os candidatos.
+
+    As variáveis são agrupadas por tutor e por vaga (turno, escola) no momento em que
+    são criadas, de modo que as restrições são montadas sem varrer X novamente
+    (O(|X|) em vez de O(tutores x |X| + turnos x escolas x |X|)).
+    'benefit_matrix' é a matriz de 'calculate_benefit_matrix' (tutores x escolas) e
+    'candidate_mask' (opcional, mesma forma) restringe as escolas consideradas por tutor.
+    Com 'continuous=True' as variáveis são contínuas e sem limite superior (x <= 1 já é
+    implicado pela Restrição 1), o que deixa os duais das restrições completos para a
+    precificação de colunas. 'threads' define quantos núcleos o CBC pode usar (1 por
+    padrão, para que a solução seja reproduzível sem pós-processamento).
+
+    Retorna um dicionário com:
+    - model: O objeto Model do python-mip pronto para ser otimizado
+    - X: Dicionário de variáveis {(tutor, turno, escola): Var}
+    - vars_by_tutor: Dicionário {tutor: [Var, ...]}
+    - vars_by_vacancy: Dicionário {(turno, escola): [Var, ...]}
+    - tutor_constrs: Dicionário {tutor: Constr} da Restrição 1
+    - vacancy_constrs: Dicionário {(turno, escola): Constr} da Restrição 2
+    - var_index: Par de vetores (linha do tutor, coluna da escola) alinhado a X.values()
+    - benefit_matrix: A matriz usada na função objetivo atual do modelo
+    - build_time: Tempo (s) gasto na construção do modelo
+    """
+    start_time = time.perf_counter()
+
+    model = Model(sense=MAXIMIZE, solver_name=CBC)
+    model.verbose = 0 # Silencia os logs do solver no console
+
+    # --- Configuração para Reprodutibilidade ---
+    model.threads = threads  # Por padrão, força o uso de apenas 1 núcleo do processador
+    model.seed = 37    # Fixa a semente matemática para os desempates e heurísticas
+
+    # Pré-seleciona as vagas abertas por turno para não testar escolas sem vaga a cada tutor
+    open_schools_by_slot = {
+        time_slot: [(j, s) for j, s in enumerate(schools) if vacancies.get((time_slot, s), 0) > 0]
+        for time_slot in time_slots
+    }
+
+    # Dicionário de variáveis (X) e seus agrupamentos por tutor e por vaga
+    X = {}
+    vars_by_tutor = {}
+    vars_by_vacancy = {}
+    objective_terms = []
+    var_rows = []
+    var_cols = []
+
+    with instr.span('build.variables') as variables_span:
+        if candidate_mask is None:
+            candidate_rows = [None] * len(tutors)
+        else:
+            candidate_rows = candidate_mask.tolist()
+
+        for i, (t, tutor_benefits, tutor_candidates) in enumerate(zip(tutors, benefit_matrix.tolist(), candidate_rows)):
+            for time_slot in time_slots:
+                # Só cria a variável de decisão se o tutor tem disponibilidade E a escola tem vaga
+                # Já incorpora a terceira restrição (disponibilidade dos tutores) na própria criação das variáveis
+                if availability.get((t, time_slot), 0) <= 0:
+                    continue
+
+                for j, s in open_schools_by_slot[time_slot]:
+                    if tutor_candidates is not None and not tutor_candidates[j]:
+                        continue    # Escola descartada pela poda de candidatos
+
+                    if continuous:
+                        var = model.add_var(var_type=CONTINUOUS, ub=INF)
+                    else:
+                        var = model.add_var(var_type=BINARY)
+                    X[(t, time_slot, s)] = var
+                    vars_by_tutor.setdefault(t, []).append(var)
+                    vars_by_vacancy.setdefault((time_slot, s), []).append(var)
+                    objective_terms.append(tutor_benefits[j] * var)
+                    var_rows.append(i)
+                    var_cols.append(j)
+        variables_span.count(variables=len(X))
+
+    # Restrição 1: Cada tutor em no máximo um turno/escola
+    with instr.span('build.constraints.tutors') as tutors_span:
+        tutor_constrs = {}
+        for t, vars_tutor in vars_by_tutor.items():
+            tutor_constrs[t] = model.add_constr(xsum(vars_tutor) <= 1)
+        tutors_span.count(constraints=len(tutor_constrs))
+
+    # Restrição 2: Respeitar vagas das escolas
+    with instr.span('build.constraints.vacancies') as vacancies_span:
+        vacancy_constrs = {}
+        for time_slot in time_slots:
+            for _, s in open_schools_by_slot[time_slot]:
+                vars_escola_turno = vars_by_vacancy.get((time_slot, s))
+                if vars_escola_turno:
+                    vacancy_constrs[(time_slot, s)] = model.add_constr(
+                        xsum(vars_escola_turno) <= vacancies[(time_slot, s)]
+                    )
+        vacancies_span.count(constraints=len(vacancy_constrs))
+
+    # Restrição 3: Disponibilidade dos tutores
+    # A garantia de disponibilidade já está incorporada na filtragem feita durante a
+    # criação das variáveis X: só existe variável se availability > 0.
+    # Como X[t,ts,s] só é criada quando availability == 1 e é do tipo BINARY (0 ou 1),
+    # adicionar "var <= 1" seria redundante. Por isso esta restrição foi omitida.
+
+    # Função Objetivo
+    with instr.span('build.objective', terms=len(objective_terms)):
+        model.objective = xsum(objective_terms)
+
+    return {
+        "model": model,
+        "X": X,
+        "vars_by_tutor": vars_by_tutor,
+        "vars_by_vacancy": vars_by_vacancy,
+        "tutor_constrs": tutor_constrs,
+        "vacancy_constrs": vacancy_constrs,
+        "var_index": (np.array(var_rows, dtype=np.intp), np.array(var_cols, dtype=np.intp)),
+        "benefit_matrix": benefit_matrix,
+        "build_time": time.perf_counter() - start_time
+    }
+
+def set_allocation_objective(built, benefit_matrix):
+    """
+    Substitui apenas a função objetivo de um modelo de 'build_allocation_model', mantendo
+    variáveis e restrições. Usado quando só os parâmetros de pontuação mudam.
+    """
+    if built.get('benefit_matrix') is benefit_matrix:
+        return    # O modelo acabou de ser construído com esta mesma matriz
+
+    rows, cols = built['var_index']
+    with instr.span('build.objective_update', terms=len(rows)):
+        coefficients = benefit_matrix[rows, cols].tolist()
+        built['model'].objective = xsum(c * var for c, var in zip(coefficients, built['X'].values()))
+    built['benefit_matrix'] = benefit_matrix
+
+# =============================================================================
+# PODA DE CANDIDATOS
+# =============================================================================
+
+def select_candidate_schools(tutors, schools, preferences, distances, open_schools, k):
+    """
+    Monta a máscara tutores x escolas com os candidatos mantidos pela poda: as escolas
+    preferidas do tutor e as 'k' escolas abertas mais próximas da sua escola de
+    referência (1ª preferência). Tutores sem escola de referência mantêm todas as
+    escolas, pois não há distância para ordená-las.
+
+    Args:
+    - open_schools: Vetor booleano (alinhado a 'schools') das escolas com alguma vaga
+    - k: Quantidade de escolas vizinhas mantidas por tutor
+    """
+    positions, reference_schools = _preference_positions(tutors, schools, preferences)
+    distances = DistanceMatrix.coerce(distances)
+
+    mask = positions > 0
+    has_reference = np.array([r is not None for r in reference_schools], dtype=bool)
+    mask[~has_reference] = True
+
+    # Distância até a referência apenas para escolas abertas que ainda não são preferência
+    ranked = distances.submatrix(reference_schools, schools)
+    ranked[:, ~open_schools] = np.inf
+    ranked[mask] = np.inf
+
+    k = min(k, len(schools))
+    if k > 0:
+        nearest = np.argsort(ranked, axis=1, kind='stable')[:, :k]
+        rows = np.repeat(np.arange(len(tutors)), k)
+        reachable = np.isfinite(ranked[rows, nearest.ravel()])
+        mask[rows[reachable], nearest.ravel()[reachable]] = True
+
+    return mask
+
+def _coefficient_tolerance(benefit_matrix):
+    """
+    Tolerância, nos benefícios originais, abaixo da qual duas soluções são tratadas como
+    empatadas: metade da menor diferença não nula entre coeficientes (incluindo o 0 de
+    "não alocado"), e nunca menor que o erro de arredondamento de coeficientes dessa
+    ordem de grandeza.
+    """
+    values = np.unique(np.append(benefit_matrix, 0.0))
+    largest = float(np.abs(values).max()) if values.size else 0.0
+    roundoff = 64 * np.finfo(np.float64).eps * max(largest, 1.0)
+    differences = np.diff(values)
+    differences = differences[differences > 0]
+    if differences.size == 0:
+        return roundoff
+    return max(0.5 * float(differences.min()), roundoff)
+
+def price_out_pruned_columns(tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                             candidate_mask, tolerance=None):
+    """
+    Verifica se a poda pode ter descartado uma solução melhor.
+
+    Resolve a relaxação linear do modelo podado (com benefícios normalizados, apenas para
+    o CLP) e precifica as colunas descartadas nos benefícios originais. Os duais das
+    vagas viram uma solução dual viável (u, v) com '_repaired_duals', de valor D, e a
+    alocação do vértice tem valor z. Qualquer alocação que use a coluna (t, s) vale no
+    máximo D + c[t,s], com c = b[t,s] - u[t] - v[turno,s] (custo reduzido); logo, a
+    coluna só pode melhorar a solução podada se c > z - D. Com duais exatos (D = z) o
+    critério é o custo reduzido positivo de sempre; se as tolerâncias do CLP deixarem os
+    duais folgados, mais colunas voltam, nunca menos.
+
+    'tolerance' (nos benefícios originais, padrão '_coefficient_tolerance') é a melhora
+    mínima considerada; melhoras menores são tratadas como empates.
+
     Retorna:
-    - Um dicionário contendo o DataFrame final, as estatísticas e os dados puros (raw_data)
+    - violations: Matriz booleana tutores x escolas com as escolas que deveriam voltar
+    - max_reduced_cost: Maior custo reduzido (nos benefícios originais) entre as colunas descartadas
     """
-    
+    scale = benefit_matrix.max() if benefit_matrix.size and benefit_matrix.max() > 0 else 1
+    normalized = benefit_matrix / scale
+    if tolerance is None:
+        tolerance = _coefficient_tolerance(benefit_matrix)
+
+    built = build_allocation_model(
+        tutors, time_slots, schools, availability, vacancies, normalized,
+        candidate_mask=candidate_mask, continuous=True
+    )
+    # O CLP escreve o log mesmo com 'verbose = 0': a relaxação roda no processo filho
+    status, solution = _optimize_logged(
+        built['model'], built['X'], relax=True, constrs=list(built['vacancy_constrs'].values())
+    )
+    if status != OptimizationStatus.OPTIMAL:
+        raise ValueError(f"Não foi possível precificar as colunas descartadas (status {status}).")
+
+    tutor_duals, vacancy_duals = _repaired_duals(built, benefit_matrix, solution.duals, scale)
+    dual_value = (math.fsum(tutor_duals.tolist())
+                  + math.fsum(vacancies[key] * v for key, v in vacancy_duals.items()))
+    incumbent = _allocation_value(solution.results, tutors, schools, benefit_matrix)
+    threshold = incumbent - dual_value + tolerance
+
+    avail = _availability_matrix(tutors, time_slots, availability)
+    capacities = _vacancy_matrix(time_slots, schools, vacancies)
+
+    violations = np.zeros(candidate_mask.shape, dtype=bool)
+    max_reduced_cost = -np.inf
+    for k, ts in enumerate(time_slots):
+        discarded = avail[:, k:k + 1] & (capacities[k] > 0)[None, :] & ~candidate_mask
+        if not discarded.any():
+            continue
+        # Duais 0 para vagas que ficaram sem nenhuma variável no modelo podado
+        slot_duals = np.array([vacancy_duals.get((ts, s), 0.0) for s in schools])
+        reduced_costs = benefit_matrix - tutor_duals[:, None] - slot_duals[None, :]
+        reduced_costs = np.where(discarded, reduced_costs, -np.inf)
+        max_reduced_cost = max(max_reduced_cost, reduced_costs.max())
+        violations |= reduced_costs > threshold
+
+    return violations, float(max_reduced_cost)
+
+def prune_candidates(tutors, time_slots, schools, preferences, distances, availability, vacancies,
+                     benefit_matrix, k):
+    """
+    Etapa de poda opcional: mantém para cada tutor suas preferências e as 'k' escolas
+    mais próximas da referência e certifica o resultado precificando as colunas
+    descartadas. Enquanto houver colunas com custo reduzido positivo, os pares
+    (tutor, escola) correspondentes voltam à máscara e a precificação é refeita
+    (no limite, todas as escolas voltam e o modelo é o completo).
+
+    Retorna:
+    - candidate_mask: Máscara tutores x escolas a ser usada pelos motores de solução
+    - prune_stats: Dicionário com o 'k' final, rodadas e tempo da poda
+    """
+    start_time = time.perf_counter()
+
+    capacities = _vacancy_matrix(time_slots, schools, vacancies)
+    open_schools = (capacities > 0).any(axis=0)
+
+    candidate_mask = select_candidate_schools(tutors, schools, preferences, distances, open_schools, k)
+    initial_candidates = int(candidate_mask.sum())
+
+    # Geração de colunas: as escolas com custo reduzido positivo voltam ao modelo
+    # até que nenhuma coluna descartada possa melhorar a solução
+    rounds = 0
+    while True:
+        rounds += 1
+        violations, max_reduced_cost = price_out_pruned_columns(
+            tutors, time_slots, schools, availability, vacancies, benefit_matrix, candidate_mask
+        )
+        if not violations.any():
+            break
+        candidate_mask |= violations
+
+    prune_stats = {
+        "prune_k": k,
+        "prune_rounds": rounds,
+        "prune_restored_pairs": int(candidate_mask.sum()) - initial_candidates,
+        "prune_max_reduced_cost": max_reduced_cost,
+        "prune_time": time.perf_counter() - start_time
+    }
+
+    return candidate_mask, prune_stats
+
+# =============================================================================
+# MOTORES DE SOLUÇÃO
+# =============================================================================
+
+def _availability_matrix(tutors, time_slots, availability):
+    """Matriz booleana tutores x turnos indicando a disponibilidade de cada tutor."""
+    return np.array(
+        [[availability.get((t, ts), 0) > 0 for ts in time_slots] for t in tutors],
+        dtype=bool
+    ).reshape(len(tutors), len(time_slots))
+
+def _vacancy_matrix(time_slots, schools, vacancies):
+    """Matriz de inteiros turnos x escolas com a quantidade de vagas ofertadas."""
+    return np.array(
+        [[max(vacancies.get((ts, s), 0), 0) for s in schools] for ts in time_slots],
+        dtype=np.int64
+    ).reshape(len(time_slots), len(schools))
+
+def _results_from_keys(keys, tutors, time_slots, schools):
+    """
+    Converte índices (tutor, turno, escola) no formato de 'extract_allocation_results',
+    seguindo a mesma ordem em que as variáveis X são criadas no modelo MIP.
+    """
+    return [
+        {'Escola': schools[j], 'Turno da Vaga': time_slots[k], 'Tutor Alocado': tutors[i]}
+        for i, k, j in sorted(keys)
+    ]
+
+def _check_mip_status(status):
+    """Valida o status retornado pelo CBC, lançando um erro claro quando não há solução confiável."""
+    if status == OptimizationStatus.INFEASIBLE:
+        raise ValueError(
+            "O modelo não possui solução viável. "
+            "Verifique se há tutores com disponibilidade para as vagas ofertadas."
+        )
+    elif status == OptimizationStatus.NO_SOLUTION_FOUND:
+        raise ValueError(
+            "O solver não conseguiu encontrar uma solução no tempo limite. "
+            "Tente simplificar as restrições ou aumentar o tempo máximo."
+        )
+    elif status not in (OptimizationStatus.OPTIMAL, OptimizationStatus.FEASIBLE):
+        raise ValueError(
+            f"O solver retornou status inesperado: {status}. "
+            "Não foi possível gerar uma alocação confiável."
+        )
+
+def _max_fractionality(X_dict):
+    """Maior distância de um valor de X ao inteiro mais próximo (0 quando a solução é inteira)."""
+    values = np.array([var.x if var.x is not None else 0.0 for var in X_dict.values()])
+    if values.size == 0:
+        return 0.0
+    return float(np.abs(values - np.round(values)).max())
+
+def _relative_gap(objective, bound):
+    """Gap relativo entre incumbente e limitante, no mesmo critério do 'max_mip_gap' do CBC."""
+    if objective is None or bound is None or not math.isfinite(objective) or not math.isfinite(bound):
+        return None
+    return abs(bound - objective) / max(abs(objective), 1e-10)
+
+# Linhas de progresso do CBC: formato clássico (Cbc0010I / Cbc0012I) e tabela do branch-and-bound
+_CBC_NODE_LINE = re.compile(r"Cbc0010I After \d+ nodes, \d+ on tree, (\S+) best solution, best possible (\S+)")
+_CBC_SOLUTION_LINE = re.compile(r"Cbc00(?:04|12)I Integer solution of (\S+)")
+_CBC_SUMMARY_LINE = re.compile(r"(?:Obj|BestSol):\s*(\S+)\s+Bound:\s*(\S+)")
+_CBC_BEST_LINE = re.compile(r"best (\S+) in [\d.]+s")
+
+# Intervalo (em segundos) com que o arquivo de log do CBC é relido durante a resolução
+_SOLVER_LOG_POLL_INTERVAL = 0.1
+
+# Intervalo máximo (em segundos) entre dois pontos de progresso, mesmo sem linhas novas no log
+_PROGRESS_HEARTBEAT_INTERVAL = 1.0
+
+def _finite_or_none(value):
+    """Descarta os valores sentinela (±inf, ±1e50, ±DBL_MAX) usados pelo CBC para 'sem valor'."""
+    if value is None or not math.isfinite(value) or abs(value) >= 1e50:
+        return None
+    return value
+
+def _parse_float(token):
     try:
-        # --- Definir Parâmetros de Turno ---
-        shift_mode = params_dict.get('shift_mode', 'days_shifts') 
+        return _finite_or_none(float(token.rstrip('%')))
+    except ValueError:
+        return None
 
-        time_slots = _get_time_slots(shift_mode)
+def _parse_progress_line(line):
+    """
+    Extrai (incumbente, limitante) de uma linha do log do CBC, ou None se a linha não
+    traz progresso. Valores ausentes vêm como None. O objetivo desta alocação nunca é
+    negativo, então o sinal (o CBC minimiza internamente) é descartado.
+    """
+    node_match = _CBC_NODE_LINE.search(line) or _CBC_SUMMARY_LINE.search(line)
+    solution_match = _CBC_SOLUTION_LINE.search(line) or _CBC_BEST_LINE.search(line)
+    if node_match:
+        objective, bound = _parse_float(node_match.group(1)), _parse_float(node_match.group(2))
+    elif solution_match:
+        objective, bound = _parse_float(solution_match.group(1)), None
+    else:
+        tokens = line.split()
+        if '★' in line and 'solution' in line and len(tokens) >= 2:
+            # Nova solução encontrada por heurística: "... solution <valor> <tempo>"
+            objective, bound = _parse_float(tokens[-2]), None
+        elif len(tokens) >= 6 and tokens[0].isdigit() and tokens[-2].endswith('%'):
+            # Linha da tabela: Nodes OnTree Depth [BestSol] [Method] BestBound Gap% Time(s)
+            objective = _parse_float(tokens[3]) if len(tokens) >= 7 else None
+            bound = _parse_float(tokens[-3])
+        else:
+            return None
+
+    if objective is None and bound is None:
+        return None
+    return (
+        abs(objective) if objective is not None else None,
+        abs(bound) if bound is not None else None
+    )
+
+def _exit_with_parent(parent_pid):
+    """Encerra o processo filho do solver se o processo que o criou deixar de existir."""
+    while os.getppid() == parent_pid:
+        time.sleep(_SOLVER_LOG_POLL_INTERVAL)
+    os._exit(1)
+
+def _solution_summary(model, X, status, relax=False, constrs=()):
+    """
+    Resumo da resolução que sobrevive ao processo do solver: 'objective_value',
+    'objective_bound', 'results' (ver 'extract_allocation_results'), 'max_fractionality'
+    (apenas com 'relax') e 'duals' (duais das restrições 'constrs', apenas com 'relax').
+    """
+    has_solution = status in (OptimizationStatus.OPTIMAL, OptimizationStatus.FEASIBLE)
+    return SimpleNamespace(
+        objective_value=model.objective_value if has_solution else None,
+        objective_bound=model.objective_bound,
+        results=extract_allocation_results(X) if has_solution else None,
+        max_fractionality=_max_fractionality(X) if relax and has_solution else None,
+        duals=[c.pi for c in constrs] if relax and has_solution else None
+    )
+
+def _optimize_child(model, X, log_path, conn, parent_pid, relax=False, constrs=()):
+    """
+    Executado no processo filho: a saída padrão (onde o CBC e o CLP escrevem o log) passa
+    a ser o arquivo de log desta resolução, e o resultado volta pelo pipe.
+    """
+    # Se o processo pai for encerrado (ex: job cancelado), o CBC não fica órfão
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+    exit_code = 1
+    try:
+        log_fd = os.open(log_path, os.O_WRONLY | os.O_APPEND)
+        os.dup2(log_fd, 1)
+        os.close(log_fd)
 
-        # --- Extrair Parâmetros de Configuração ---
-        PREF1_SCORE = params_dict.get('pref1', 8000)
-        PREF2_SCORE = params_dict.get('pref2', 7000)
-        PREF3_SCORE = params_dict.get('pref3', 6000)
-        NON_PREF_BASE_SCORE = params_dict.get('baseDistance', 5000)
-        RANKING_MULTIPLIER = params_dict.get('baseRanking', 10**9)
-        DISTANCE_DECAY_TYPE = params_dict.get('decayType', 'sigmoid')
-        SIGMOID_SCALE = params_dict.get('sigmoidCurve', 2000)
+        status = model.optimize(relax=relax)
+        conn.send((status, _solution_summary(model, X, status, relax, constrs)))
+        exit_code = 0
+    finally:
+        conn.close()
+        # Sai sem a finalização do multiprocessing, que esvaziaria o sys.stdout herdado no
+        # fork (cujo lock pode ter sido copiado travado por outra thread do processo pai)
+        os._exit(exit_code)
 
-        # --- Carregar Dados ---
-        tutors, availability, preferences, rankings, tutor_districts, total_tutors = read_tutors(tutors_file, shift_mode)
-        schools, vacancies, school_districts, total_schools, total_vacancies = read_schools(schools_file, shift_mode)
+def _follow_solver_log(log_path, finished, progress_callback, start_time, scale):
+    """
+    Acompanha o arquivo de log do CBC até 'finished' ser sinalizado e repassa cada ponto
+    de progresso (incumbente, limitante e gap) para 'progress_callback'. Enquanto o CBC
+    não escreve linhas de progresso (ex: relaxação da raiz em instâncias grandes), um
+    ponto com o tempo decorrido e os últimos valores conhecidos é enviado a cada
+    '_PROGRESS_HEARTBEAT_INTERVAL' segundos.
+    """
+    state = {"objective": None, "bound": None}
+
+    def emit():
+        progress_callback({
+            "elapsed": time.perf_counter() - start_time,
+            "objective": state["objective"],
+            "bound": state["bound"],
+            "gap": _relative_gap(state["objective"], state["bound"])
+        })
+        return time.perf_counter()
+
+    last_emit = emit()
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as log:
+        line = ''
+        while True:
+            done = finished.is_set()
+            line += log.readline()
+            if not line.endswith('\n'):
+                if done:
+                    break
+                if time.perf_counter() - last_emit >= _PROGRESS_HEARTBEAT_INTERVAL:
+                    last_emit = emit()
+                time.sleep(_SOLVER_LOG_POLL_INTERVAL)
+                continue
 
-        active_schools = list({s for (slot, s), v in vacancies.items() if v > 0})
-        
-        # Agora passamos o arquivo de distâncias como parâmetro
-        distances = read_distances(distances_file)
-        DISTANCE_MEAN = calculate_mean_distances(distances_file, active_schools) 
-
-        # --- Calcular Benefícios ---
-        benefits = calculate_benefits(
-            tutors, schools, preferences, distances, rankings,
-            decay_type=DISTANCE_DECAY_TYPE,
-            pref1=PREF1_SCORE,
-            pref2=PREF2_SCORE,
-            pref3=PREF3_SCORE,
-            baseDistance=NON_PREF_BASE_SCORE,
-            baseRanking=RANKING_MULTIPLIER,
-            sigmoidCurve=SIGMOID_SCALE,
-            distance_mean=DISTANCE_MEAN
+            progress = _parse_progress_line(line)
+            line = ''
+            if progress is None:
+                continue
+            objective, bound = progress
+            if objective is not None:
+                state["objective"] = objective * scale
+            if bound is not None:
+                state["bound"] = bound * scale
+            last_emit = emit()
+
+def _optimize_logged(model, X, progress_callback=None, start_time=None, scale=1.0, relax=False, constrs=()):
+    """
+    Executa 'model.optimize(relax=relax)' sem escrever o log do solver na saída padrão,
+    repassando o progresso do CBC para 'progress_callback' (se informado).
+
+    O CBC escreve o log apenas na saída padrão do processo, que é compartilhada por todas
+    as threads, e o CLP (relaxação linear) escreve mesmo com 'verbose = 0'. Para não
+    capturá-la, a resolução roda em um processo filho (fork, que herda o modelo já
+    montado) cuja saída padrão é um arquivo de log exclusivo desta resolução; uma thread
+    daqui acompanha o arquivo. O callback de progresso nativo do python-mip derruba o
+    CBC em algumas versões, por isso o log textual é usado.
+
+    Retorna (status, solução), com a solução no formato de '_solution_summary' ('constrs'
+    são as restrições cujos duais são devolvidos com 'relax'). Sem 'fork' (ex: Windows)
+    o modelo é resolvido no próprio processo e apenas o ponto final de progresso é
+    informado.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        model.verbose = 0
+        status = model.optimize(relax=relax)
+        solution = _solution_summary(model, X, status, relax, constrs)
+        if progress_callback is not None:
+            objective = _finite_or_none(solution.objective_value)
+            bound = _finite_or_none(solution.objective_bound)
+            objective = objective * scale if objective is not None else None
+            bound = bound * scale if bound is not None else None
+            progress_callback({
+                "elapsed": time.perf_counter() - start_time,
+                "objective": objective,
+                "bound": bound,
+                "gap": _relative_gap(objective, bound)
+            })
+        return status, solution
+
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory(prefix='cbc_') as log_dir:
+        log_path = os.path.join(log_dir, 'cbc.log')
+        open(log_path, 'wb').close()
+
+        receiver, sender = context.Pipe(duplex=False)
+        child = context.Process(
+            target=_optimize_child, args=(model, X, log_path, sender, os.getpid(), relax, constrs)
         )
+        finished = threading.Event()
+        reader = None
+        if progress_callback is not None:
+            reader = threading.Thread(
+                target=_follow_solver_log, args=(log_path, finished, progress_callback, start_time, scale),
+                daemon=True
+            )
+            model.verbose = 1    # O progresso é lido do log do CBC
 
-        # --- Construir e Rodar o Modelo MIP ---
-        model = Model(sense=MAXIMIZE, solver_name=CBC)
-        model.verbose = 0 # Silencia os logs do solver no console
+        child.start()
+        sender.close()    # O processo atual só lê; assim o fim do filho fecha o pipe
+        if reader is not None:
+            reader.start()
+        message = None
+        try:
+            message = receiver.recv()
+        except EOFError:
+            pass
+        finally:
+            if message is None and child.is_alive():
+                child.terminate()
+            child.join()
+            receiver.close()
+            finished.set()
+            if reader is not None:
+                reader.join()
+            model.verbose = 0
+
+    if message is None:
+        raise ValueError(
+            f"O processo do solver foi encerrado inesperadamente (código {child.exitcode})."
+        )
+    return message
 
-        # --- Configuração para Reprodutibilidade ---
-        model.threads = 1  # Força o uso de apenas 1 núcleo do processador
-        model.seed = 37    # Fixa a semente matemática para os desempates e heurísticas
+# Tempo limite padrão do CBC (parâmetro 'seconds'), equivalente a não ter limite
+_CBC_NO_TIME_LIMIT = 1e8
 
-        # Dicionário de variáveis (X)
-        X = {}
-        for t in tutors:
-            for time_slot in time_slots:
-                for s in schools:
-                    # Só cria a variável de decisão se o tutor tem disponibilidade E a escola tem vaga
-                    # Já incorpora a terceira restrição (disponibilidade dos tutores) na própria criação das variáveis
-                    if availability.get((t, time_slot), 0) > 0 and vacancies.get((time_slot, s), 0) > 0:
-                        X[(t, time_slot, s)] = model.add_var(var_type=BINARY)
-
-        # Restrição 1: Cada tutor em no máximo um turno/escola
-        for t in tutors:
-            # Pega apenas as variáveis que existem para este tutor
-            vars_tutor = [X[k] for k in X if k[0] == t]
-            if vars_tutor:
-                model += xsum(vars_tutor) <= 1
-
-        # Restrição 2: Respeitar vagas das escolas
-        for time_slot in time_slots:
-            for s in schools:
-                # Pega apenas as variáveis que existem para esta escola e turno
-                vars_escola_turno = [X[k] for k in X if k[1] == time_slot and k[2] == s]
-                if vars_escola_turno:
-                    model += xsum(vars_escola_turno) <= vacancies.get((time_slot, s), 0)
-
-        # Restrição 3: Disponibilidade dos tutores
-        #for keys, var in X.items():
-        #    t, time_slot, s = keys
-        #    model += var <= availability.get((t, time_slot), 0)
-        # A garantia de disponibilidade já está incorporada na filtragem feita durante a
-        # criação das variáveis X: só existe variável se availability > 0.
-        # Como X[t,ts,s] só é criada quando availability == 1 e é do tipo BINARY (0 ou 1),
-        # adicionar "var <= 1" seria redundante. Por isso esta restrição foi omitida.
-
-        # Função Objetivo
-        model.objective = xsum(
-            benefits.get((keys[0], keys[2]), 0) * var
-            for keys, var in X.items()
+# Diferença relativa aceita entre o limitante e o valor do vértice da relaxação
+# (apenas o erro de arredondamento de somas na ordem de 1e15)
+_LP_CERTIFICATE_TOL = 1e-12
+
+def _allocation_value(results_list, tutors, schools, benefit_matrix):
+    """Valor exato (soma compensada dos benefícios) de uma alocação."""
+    tutor_index = {t: i for i, t in enumerate(tutors)}
+    school_index = {sc: j for j, sc in enumerate(schools)}
+    return math.fsum(
+        float(benefit_matrix[tutor_index[r['Tutor Alocado']], school_index[r['Escola']]])
+        for r in results_list
+    )
+
+def _repaired_duals(built, benefit_matrix, vacancy_duals, scale):
+    """
+    Solução dual viável, nos benefícios originais, para o modelo de 'build_allocation_model'.
+
+    Os duais v das vagas (Restrição 2) vêm do CLP, na escala normalizada; a partir deles
+    cada tutor recebe u[t] = max(0, max(b[t,s] - v[turno,s])) sobre as suas variáveis, o
+    que torna (u, v) viável para o dual mesmo que o CLP tenha parado dentro da sua
+    tolerância. Retorna (u alinhado às linhas de 'benefit_matrix', {(turno, escola): v}).
+    """
+    rows, cols = built['var_index']
+    vacancy_keys = list(built['vacancy_constrs'])
+    vacancy_position = {key: n for n, key in enumerate(vacancy_keys)}
+    var_vacancy = np.array([vacancy_position[(ts, s)] for _, ts, s in built['X']], dtype=np.intp)
+
+    duals = np.maximum(np.asarray(vacancy_duals, dtype=np.float64) * scale, 0.0)
+    tutor_duals = np.zeros(benefit_matrix.shape[0])
+    if rows.size:
+        np.maximum.at(tutor_duals, rows, benefit_matrix[rows, cols] - duals[var_vacancy])
+    return tutor_duals, dict(zip(vacancy_keys, duals.tolist()))
+
+def _lp_dual_bound(built, benefit_matrix, vacancies, vacancy_duals, scale):
+    """
+    Limitante superior, nos benefícios originais, para qualquer alocação do modelo de
+    'build_allocation_model': o valor sum(u) + sum(vagas * v) da solução dual de
+    '_repaired_duals' (justo apenas quando os duais do CLP são exatos).
+    """
+    tutor_duals, vacancy_duals = _repaired_duals(built, benefit_matrix, vacancy_duals, scale)
+    return math.fsum(tutor_duals.tolist()) + math.fsum(vacancies[key] * v for key, v in vacancy_duals.items())
+
+def solve_mip(tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+              relax_lp=False, candidate_mask=None, start=None,
+              time_limit=None, mip_gap=None, progress_callback=None, threads=1, canonicalize=None,
+              built=None):
+    """
+    Resolve a alocação pelo modelo MIP (CBC) montado em 'build_allocation_model'.
+
+    Com 'relax_lp=True' resolve primeiro a relaxação linear (BINARY tratado como contínuo).
+    Como a matriz de restrições é de rede (totalmente unimodular), o simplex devolve um
+    vértice inteiro; isso é verificado variável a variável (certificado de integralidade)
+    e o branch-and-bound completo só é executado se a verificação falhar.
+    Nesse modo os benefícios são normalizados pelo maior valor: com coeficientes na
+    ordem de 1e12 as tolerâncias do simplex deixam a solução levemente fracionária.
+    A normalização, por outro lado, pode deixar diferenças entre tutores do fim do
+    ranking abaixo das tolerâncias do CLP; por isso o vértice inteiro só é aceito se o
+    limitante calculado nos benefícios originais (o dual de '_lp_dual_bound' ou, se este
+    ficar folgado, o ótimo exato de 'solve_flow') coincidir com o seu valor. Caso
+    contrário o MIP é resolvido com os benefícios originais ('lp+mip').
+    'start' (opcional) é uma alocação viável no formato de 'extract_allocation_results'
+    (por exemplo, a de 'solve_greedy') usada como solução inicial do CBC; se o tempo
+    limite esgotar sem que o CBC tenha solução própria, ela é devolvida como resultado.
+
+    'time_limit' (segundos) e 'mip_gap' (gap relativo) limitam o branch-and-bound; ao
+    atingir o tempo, a melhor solução viável encontrada é devolvida. 'progress_callback',
+    se informado, recebe a cada linha de progresso do CBC (e ao menos uma vez por segundo,
+    mesmo antes da primeira) um dicionário com 'elapsed', 'objective', 'bound' e 'gap',
+    chamado de uma thread auxiliar (use, por exemplo, 'queue.put').
+
+    Com 'threads' > 1 o branch-and-bound paralelo pode devolver soluções ótimas diferentes
+    a cada execução; o resultado passa então por 'canonicalize_allocation' ('canonicalize'
+    força ou desativa esse passo independentemente de 'threads').
+
+    'built' (opcional) é um modelo já construído por 'build_allocation_model' para os
+    mesmos dados e sem poda; nesse caso apenas a função objetivo é substituída.
+
+    Retorna:
+    - results_list: Lista de alocações no formato de 'extract_allocation_results'
+    - solve_stats: Dicionário com as estatísticas da construção e da resolução
+    """
+    raw_benefits = benefit_matrix
+    scale = 1.0
+    if relax_lp and benefit_matrix.size and benefit_matrix.max() > 0:
+        # Escalar a função objetivo por uma constante positiva não altera a solução ótima
+        scale = float(benefit_matrix.max())
+        benefit_matrix = benefit_matrix / scale
+
+    if built is None:
+        built = build_allocation_model(
+            tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+            candidate_mask=candidate_mask, threads=threads
         )
-        
+        build_time = built['build_time']
+    else:
+        start_time = time.perf_counter()
+        set_allocation_objective(built, benefit_matrix)
+        build_time = time.perf_counter() - start_time
+    model = built['model']
+    X = built['X']
+
+    # Um modelo reaproveitado pode ter configurações da execução anterior
+    model.threads = threads
+    model.verbose = 0
+    if time_limit:
+        model.max_seconds = time_limit
+    elif built.get('time_limited'):
+        # O CBC rejeita 'inf': o limite anterior é trocado pelo valor padrão do próprio CBC
+        model.max_seconds = _CBC_NO_TIME_LIMIT
+    built['time_limited'] = bool(time_limit)
+    model.max_mip_gap = mip_gap if mip_gap is not None else 1e-4
+
+    solve_stats = {
+        "num_variables": len(X),
+        "build_time": build_time
+    }
+
+    if start:
+        # Solução inicial: o CBC já começa o branch-and-bound com este incumbente
+        model.start = [
+            (X[key], 1.0) for key in
+            ((r['Tutor Alocado'], r['Turno da Vaga'], r['Escola']) for r in start)
+            if key in X
+        ]
+        solve_stats['start_size'] = len(model.start)
+
+    # Resolução feita em processo filho ('_optimize_logged'): o resultado não fica no modelo
+    solution = None
+    solve_path = 'mip'
+    if relax_lp:
+        # O CLP escreve o log mesmo com 'verbose = 0': a relaxação também roda no processo filho
+        start_time = time.perf_counter()
+        with instr.span('optimize.lp', variables=len(X)):
+            status, solution = _optimize_logged(
+                model, X, relax=True, constrs=list(built['vacancy_constrs'].values())
+            )
+        solve_stats['lp_time'] = time.perf_counter() - start_time
+
+        if status == OptimizationStatus.OPTIMAL:
+            fractionality = solution.max_fractionality
+            solve_stats['lp_max_fractionality'] = fractionality
+            if fractionality <= model.integer_tol:
+                # Certificado de otimalidade nos benefícios originais: primeiro o limitante
+                # dual; se as tolerâncias do CLP o deixarem folgado, o ótimo exato do fluxo
+                lp_objective = _allocation_value(solution.results, tutors, schools, raw_benefits)
+                tolerance = _LP_CERTIFICATE_TOL * max(abs(lp_objective), 1.0)
+                lp_bound = _lp_dual_bound(built, raw_benefits, vacancies, solution.duals, scale)
+                if lp_bound - lp_objective > tolerance:
+                    flow_results, _ = solve_flow(
+                        tutors, time_slots, schools, availability, vacancies, raw_benefits, candidate_mask
+                    )
+                    lp_bound = min(lp_bound, _allocation_value(flow_results, tutors, schools, raw_benefits))
+                    solve_stats['lp_certificate'] = 'flow'
+                else:
+                    solve_stats['lp_certificate'] = 'dual'
+                solve_stats['lp_certificate_gap'] = _relative_gap(lp_objective, lp_bound)
+                if lp_bound - lp_objective <= tolerance:
+                    solve_path = 'lp'
+
+        if solve_path != 'lp':
+            # O branch-and-bound usa os benefícios originais, sem a perda de precisão da normalização
+            solve_path = 'lp+mip'
+            solution = None
+            benefit_matrix = raw_benefits
+            scale = 1.0
+            set_allocation_objective(built, benefit_matrix)
+
+    if solve_path != 'lp':
         # Resolver o modelo e verificar o status da solução
-        status = model.optimize()
+        start_time = time.perf_counter()
+        with instr.span('optimize.mip', variables=len(X)):
+            if progress_callback is not None:
+                status, solution = _optimize_logged(model, X, progress_callback, start_time, scale)
+            else:
+                status = model.optimize()
+        solve_stats['mip_time'] = time.perf_counter() - start_time
+
+    solved = solution if solution is not None else model
+
+    if status == OptimizationStatus.NO_SOLUTION_FOUND and start:
+        # O CBC parou no tempo limite sem incumbente próprio: a solução inicial continua válida
+        objective = _allocation_value(start, tutors, schools, raw_benefits)
+        bound = _finite_or_none(solved.objective_bound)
+        bound = bound * scale if bound is not None else None
+        solve_stats['solver_status'] = OptimizationStatus.FEASIBLE.name
+        solve_stats['objective_value'] = objective
+        solve_stats['objective_bound'] = bound
+        solve_stats['gap'] = _relative_gap(objective, bound)
+        solve_stats['solve_path'] = 'start'
+        solve_stats['solve_time'] = solve_stats.get('lp_time', 0) + solve_stats.get('mip_time', 0)
+        return list(start), solve_stats
+
+    _check_mip_status(status)
+
+    if solve_path == 'lp':
+        objective, bound = lp_objective, lp_bound
+    else:
+        objective = _finite_or_none(solved.objective_value)
+        objective = objective * scale if objective is not None else None
+        bound = _finite_or_none(solved.objective_bound)
+        bound = bound * scale if bound is not None else None
+    solve_stats['solver_status'] = status.name
+    solve_stats['objective_value'] = objective
+    solve_stats['objective_bound'] = bound
+    solve_stats['gap'] = _relative_gap(objective, bound)
+    solve_stats['solve_path'] = solve_path
+    solve_stats['solve_time'] = solve_stats.get('lp_time', 0) + solve_stats.get('mip_time', 0)
+
+    with instr.span('extract') as extract_span:
+        results_list = solved.results if solution is not None else extract_allocation_results(X)
+        extract_span.count(allocations=len(results_list))
+    if canonicalize is None:
+        canonicalize = threads != 1
+    if canonicalize:
+        with instr.span('canonicalize'):
+            results_list, canonical_stats = canonicalize_allocation(
+                results_list, tutors, time_slots, schools, availability, vacancies, raw_benefits, candidate_mask
+            )
+        solve_stats.update(canonical_stats)
 
-        if status == OptimizationStatus.INFEASIBLE:
-            raise ValueError(
-                "O modelo não possui solução viável. "
-                "Verifique se há tutores com disponibilidade para as vagas ofertadas."
+    return results_list, solve_stats
+
+def _make_room(position, allocation, occupants, capacities, options, fixed):
+    """
+    Abre uma vaga em 'position' (cadeia de trocas em largura): um ocupante ainda não
+    fixado passa para outra posição permitida a ele, que por sua vez pode ceder o lugar, até
+    chegar a uma posição com vaga livre. Aplica as trocas e retorna True se conseguir.
+    """
+    parents = {position: None}
+    queue = deque([position])
+    while queue:
+        current = queue.popleft()
+        if len(occupants[current]) < capacities[current]:
+            # Aplica as trocas do fim para o começo da cadeia
+            while parents[current] is not None:
+                previous, tutor = parents[current]
+                occupants[previous].remove(tutor)
+                occupants[current].append(tutor)
+                allocation[tutor] = current
+                current = previous
+            return True
+        for tutor in occupants[current]:
+            if tutor in fixed:
+                continue
+            for target in options[tutor]:
+                if target not in parents:
+                    parents[target] = (current, tutor)
+                    queue.append(target)
+    return False
+
+def _canonical_positions(allocation, options, capacities):
+    """
+    Reatribui os tutores de 'allocation' (tutor -> posição) dentro das posições permitidas
+    a cada um ('options', em ordem crescente) da forma lexicograficamente menor: cada tutor,
+    na ordem do índice, fica com a menor posição que ainda permite encaixar todos os
+    seguintes. O resultado não depende da alocação de partida.
+    """
+    allocation = dict(allocation)
+    occupants = defaultdict(list)
+    for i, position in allocation.items():
+        occupants[position].append(i)
+
+    fixed = set()
+    for i in sorted(allocation):
+        current = allocation[i]
+        occupants[current].remove(i)
+        for position in options[i]:
+            if position == current or _make_room(position, allocation, occupants, capacities, options, fixed):
+                occupants[position].append(i)
+                allocation[i] = position
+                break
+        fixed.add(i)
+
+    return allocation
+
+def canonicalize_allocation(results_list, tutors, time_slots, schools, availability, vacancies,
+                            benefit_matrix, candidate_mask=None):
+    """
+    Pós-processamento determinístico que escolhe um representante canônico entre as
+    soluções ótimas equivalentes, para que o resultado não dependa de qual delas o
+    branch-and-bound paralelo (ou a resolução por componentes) encontrou. Trata os dois
+    tipos de empate do modelo:
+
+    1. Tutores intercambiáveis (mesma linha de benefícios, mesma disponibilidade e mesmos
+       candidatos): as posições ocupadas pelo grupo são redistribuídas na ordem dos índices,
+       do maior para o menor benefício.
+    2. Tutores indiferentes entre vagas: cada tutor pode trocar de turno, ou de escola com o
+       mesmo benefício, sem alterar o próprio benefício. Mantido o benefício de cada tutor,
+       a alocação é redistribuída (respeitando disponibilidade, candidatos e vagas) de forma
+       lexicograficamente menor na ordem (escola, turno) das vagas.
+
+    Nenhuma das trocas altera o valor da função objetivo nem a viabilidade.
+
+    Retorna:
+    - results_list: Alocação canônica no formato de 'extract_allocation_results'
+    - canonical_stats: Dicionário com o número de alterações e o tempo gasto
+    """
+    start_time = time.perf_counter()
+
+    tutor_index = {t: i for i, t in enumerate(tutors)}
+    slot_index = {ts: k for k, ts in enumerate(time_slots)}
+    school_index = {s: j for j, s in enumerate(schools)}
+    avail = _availability_matrix(tutors, time_slots, availability)
+    capacities = _vacancy_matrix(time_slots, schools, vacancies)
+    n_slots = len(time_slots)
+
+    original = {
+        tutor_index[r['Tutor Alocado']]: (slot_index[r['Turno da Vaga']], school_index[r['Escola']])
+        for r in results_list
+    }
+
+    # --- 1. Tutores intercambiáveis ---
+    groups = defaultdict(list)
+    for i in range(len(tutors)):
+        key = (benefit_matrix[i].tobytes(), avail[i].tobytes(),
+               None if candidate_mask is None else candidate_mask[i].tobytes())
+        groups[key].append(i)
+
+    allocation = dict(original)
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        row = benefit_matrix[members[0]]
+        positions = sorted(
+            (original[i] for i in members if i in original),
+            key=lambda position: (-row[position[1]], position)
+        )
+        for i in members:
+            allocation.pop(i, None)
+        for i, position in zip(members, positions):
+            allocation[i] = position
+
+    # --- 2. Vagas de mesmo benefício para cada tutor ---
+    # Posição (turno k, escola j) numerada como j * n_slots + k: ordem (escola, turno)
+    options = {}
+    for i, (k, j) in allocation.items():
+        same_benefit = benefit_matrix[i] == benefit_matrix[i, j]
+        if candidate_mask is not None:
+            same_benefit &= candidate_mask[i]
+        slots_i = np.flatnonzero(avail[i])
+        open_positions = capacities[np.ix_(slots_i, np.flatnonzero(same_benefit))] > 0
+        kk, jj = np.nonzero(open_positions)
+        options[i] = sorted((np.flatnonzero(same_benefit)[jj] * n_slots + slots_i[kk]).tolist())
+
+    capacity_by_position = capacities.T.ravel()
+    canonical = _canonical_positions(
+        {i: j * n_slots + k for i, (k, j) in allocation.items()}, options, capacity_by_position
+    )
+    keys = [(i, position % n_slots, position // n_slots) for i, position in canonical.items()]
+
+    changed = sum(1 for i, k, j in keys if original.get(i) != (k, j))
+    canonical_stats = {
+        "canonical_moves": changed,
+        "canonicalize_time": time.perf_counter() - start_time
+    }
+
+    return _results_from_keys(keys, tutors, time_slots, schools), canonical_stats
+
+def solve_flow(tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+               candidate_mask=None):
+    """
+    Resolve a alocação como um problema de atribuição (fluxo de custo mínimo) exato.
+
+    O modelo é um problema de transporte bipartido: cada tutor tem capacidade 1 e cada
+    vaga (turno, escola) tem capacidade inteira, com arestas apenas onde há disponibilidade
+    e vaga. Como a matriz de restrições é totalmente unimodular, o ótimo combinatório é
+    o mesmo do MIP e pode ser obtido sem branch-and-bound.
+
+    Cada vaga é expandida em cópias unitárias apenas até o número de tutores candidatos
+    a ela (não adianta ter mais cópias do que candidatos) e cada tutor ganha uma
+    coluna fictícia de benefício 0, que representa "não alocado". 'candidate_mask'
+    (opcional, tutores x escolas) restringe as escolas consideradas por tutor.
+
+    Retorna:
+    - results_list: Lista de alocações no formato de 'extract_allocation_results'
+    - solve_stats: Dicionário com as estatísticas da construção e da resolução
+    """
+    start_time = time.perf_counter()
+
+    n_tutors = len(tutors)
+    avail = _availability_matrix(tutors, time_slots, availability)
+    capacities = _vacancy_matrix(time_slots, schools, vacancies)
+    if candidate_mask is None:
+        candidate_mask = np.ones((n_tutors, len(schools)), dtype=bool)
+
+    # Número de tutores candidatos a cada vaga (turno x escola)
+    eligible = avail.T.astype(np.int64) @ candidate_mask.astype(np.int64)
+
+    # Quantidade de pares (tutor, turno, escola) equivalente às variáveis X do MIP
+    num_candidates = int(eligible[capacities > 0].sum())
+
+    # --- Expansão das vagas em cópias unitárias ---
+    copy_slot = []
+    copy_school = []
+    for k in range(len(time_slots)):
+        for j in range(len(schools)):
+            copies = min(int(capacities[k, j]), int(eligible[k, j]))
+            if copies > 0:
+                copy_slot.extend([k] * copies)
+                copy_school.extend([j] * copies)
+
+    copy_slot = np.array(copy_slot, dtype=np.intp)
+    copy_school = np.array(copy_school, dtype=np.intp)
+    n_copies = len(copy_slot)
+
+    # --- Arestas tutor -> cópia de vaga (somente onde há disponibilidade) ---
+    edge_rows = []
+    edge_cols = []
+    for k in range(len(time_slots)):
+        slot_tutors = np.flatnonzero(avail[:, k])
+        slot_copies = np.flatnonzero(copy_slot == k)
+        if slot_tutors.size and slot_copies.size:
+            edge_rows.append(np.repeat(slot_tutors, slot_copies.size))
+            edge_cols.append(np.tile(slot_copies, slot_tutors.size))
+
+    edge_rows = np.concatenate(edge_rows) if edge_rows else np.zeros(0, dtype=np.intp)
+    edge_cols = np.concatenate(edge_cols) if edge_cols else np.zeros(0, dtype=np.intp)
+    edge_benefits = benefit_matrix[edge_rows, copy_school[edge_cols]] if edge_rows.size else np.zeros(0)
+
+    # Benefícios negativos nunca seriam escolhidos pelo MIP (é melhor não alocar)
+    keep = (edge_benefits >= 0) & candidate_mask[edge_rows, copy_school[edge_cols]]
+    edge_rows, edge_cols, edge_benefits = edge_rows[keep], edge_cols[keep], edge_benefits[keep]
+
+    # Custos estritamente positivos: custo = M - benefício, e "não alocado" custa M
+    big_m = (edge_benefits.max() if edge_benefits.size else 0) + 1
+    rows = np.concatenate([edge_rows, np.arange(n_tutors)])
+    cols = np.concatenate([edge_cols, n_copies + np.arange(n_tutors)])
+    costs = np.concatenate([big_m - edge_benefits, np.full(n_tutors, big_m)])
+
+    graph = csr_matrix((costs, (rows, cols)), shape=(n_tutors, n_copies + n_tutors))
+    build_time = time.perf_counter() - start_time
+
+    # --- Resolução ---
+    start_time = time.perf_counter()
+    keys = []
+    if n_tutors > 0:
+        matched_rows, matched_cols = min_weight_full_bipartite_matching(graph)
+        for i, c in zip(matched_rows.tolist(), matched_cols.tolist()):
+            if c < n_copies:
+                keys.append((i, int(copy_slot[c]), int(copy_school[c])))
+    solve_time = time.perf_counter() - start_time
+
+    solve_stats = {
+        "num_variables": num_candidates,
+        "build_time": build_time,
+        "solve_time": solve_time
+    }
+
+    return _results_from_keys(keys, tutors, time_slots, schools), solve_stats
+
+def solve_greedy(tutors, time_slots, schools, availability, vacancies, benefit_matrix, rankings,
+                 candidate_mask=None):
+    """
+    Heurística de ditadura serial: percorre os tutores na ordem do ranking e dá a cada um
+    o par (turno, escola) de maior benefício que ainda tem vaga, considerando apenas
+    benefícios positivos. Não garante o ótimo, mas é instantânea e sempre viável, o que a
+    torna útil como prévia e como solução inicial ('model.start') do MIP.
+
+    Retorna:
+    - results_list: Lista de alocações no formato de 'extract_allocation_results'
+    - solve_stats: Dicionário com as estatísticas da resolução
+    """
+    start_time = time.perf_counter()
+
+    avail = _availability_matrix(tutors, time_slots, availability)
+    residual = _vacancy_matrix(time_slots, schools, vacancies)
+    if candidate_mask is None:
+        candidate_mask = np.ones((len(tutors), len(schools)), dtype=bool)
+
+    keys = []
+    for i in _ranking_order(tutors, rankings):
+        feasible = avail[i][:, None] & (residual > 0) & candidate_mask[i][None, :]
+        scores = np.where(feasible, benefit_matrix[i][None, :], -np.inf)
+        k, j = np.unravel_index(np.argmax(scores), scores.shape)
+        if scores[k, j] > 0:
+            residual[k, j] -= 1
+            keys.append((i, int(k), int(j)))
+
+    solve_stats = {
+        "solve_time": time.perf_counter() - start_time
+    }
+
+    return _results_from_keys(keys, tutors, time_slots, schools), solve_stats
+
+def _ranking_order(tutors, rankings):
+    """
+    Índices de 'tutors' do melhor para o pior colocado. Tutores sem ranking ficam por
+    último e empates mantêm a ordem do arquivo.
+    """
+    total_tutors = len(tutors)
+    return sorted(range(total_tutors), key=lambda i: rankings.get(tutors[i], total_tutors))
+
+def _reachable_vacancies(residual, tight_by_vacancy, match):
+    """
+    Busca reversa a partir das vagas com capacidade livre. Uma vaga é alcançável se tem
+    capacidade livre ou se algum tutor alocado nela pode migrar, sem perder o nível já
+    garantido, para outra vaga alcançável.
+
+    Retorna um dicionário vaga -> (tutor que migra, vaga de destino), ou None para as
+    vagas livres, que permite reconstruir o caminho aumentante.
+    """
+    parent = {v: None for v in np.flatnonzero(residual > 0).tolist()}
+    queue = deque(parent)
+    while queue:
+        v = queue.popleft()
+        for u in tight_by_vacancy.get(v, ()):
+            w = match[u]
+            if w not in parent:
+                parent[w] = (u, v)
+                queue.append(w)
+    return parent
+
+def solve_lexicographic(tutors, time_slots, schools, availability, vacancies, base_scores, rankings):
+    """
+    Resolve a alocação com prioridade estritamente lexicográfica pelo ranking, sem o
+    multiplicador 'baseRanking': cada tutor, do melhor para o pior colocado, recebe a
+    maior pontuação base possível sem reduzir a pontuação já garantida aos anteriores.
+
+    Para cada tutor é feita uma busca reversa por caminhos aumentantes a partir das vagas
+    livres, em que os tutores já alocados só podem trocar de vaga por outra com a mesma
+    pontuação. A maior pontuação entre as vagas alcançáveis é exatamente o melhor nível
+    que o tutor pode obter; ele só é alocado se essa pontuação for positiva.
+
+    Retorna:
+    - results_list: Lista de alocações no formato de 'extract_allocation_results'
+    - solve_stats: Dicionário com as estatísticas da resolução
+    """
+    start_time = time.perf_counter()
+
+    n_schools = len(schools)
+    avail = _availability_matrix(tutors, time_slots, availability)
+    capacities = _vacancy_matrix(time_slots, schools, vacancies)
+    open_vacancies = capacities > 0
+
+    # Vagas indexadas por k * n_schools + j
+    residual = capacities.ravel().astype(np.int64)
+    match = {}
+    tight_by_vacancy = defaultdict(list)
+    parent = None
+    reassignments = 0
+
+    for i in _ranking_order(tutors, rankings):
+        if parent is None:
+            parent = _reachable_vacancies(residual, tight_by_vacancy, match)
+        if not parent:
+            break    # Sem capacidade livre, nenhum tutor seguinte pode ser alocado
+
+        scores = np.where(avail[i][:, None] & open_vacancies, base_scores[i][None, :], 0).ravel()
+        reachable = np.zeros(scores.size, dtype=bool)
+        reachable[list(parent)] = True
+
+        best = int(np.argmax(np.where(reachable, scores, 0)))
+        level = scores[best]
+        if not reachable[best] or level <= 0:
+            continue
+
+        # --- Aumenta o emparelhamento ao longo do caminho encontrado ---
+        match[i] = best
+        v = best
+        while parent[v] is not None:
+            u, target = parent[v]
+            match[u] = target
+            reassignments += 1
+            v = target
+        residual[v] -= 1
+
+        # Vagas com a mesma pontuação para as quais o tutor pode migrar depois
+        for w in np.flatnonzero(scores == level).tolist():
+            tight_by_vacancy[w].append(i)
+        parent = None
+
+    keys = [(i, v // n_schools, v % n_schools) for i, v in match.items()]
+    solve_stats = {
+        "reassignments": reassignments,
+        "solve_time": time.perf_counter() - start_time
+    }
+
+    return _results_from_keys(keys, tutors, time_slots, schools), solve_stats
+
+# =============================================================================
+# DECOMPOSIÇÃO EM COMPONENTES CONEXAS
+# =============================================================================
+
+def find_components(tutors, time_slots, schools, availability, vacancies, candidate_mask=None):
+    """
+    Encontra as componentes conexas do grafo bipartido tutores <-> vagas (turno, escola),
+    com arestas onde o tutor está disponível no turno, a escola tem vaga e o par é
+    candidato. Tutores de componentes diferentes nunca competem pelas mesmas vagas.
+
+    Retorna uma lista de componentes (apenas as que têm tutores e vagas), ordenada pelo
+    menor índice de tutor, onde cada componente é um par:
+    - tutor_indices: Índices (em 'tutors') dos tutores da componente
+    - vacancy_keys: Lista de (turno, escola) das vagas da componente
+    """
+    n_tutors = len(tutors)
+    avail = _availability_matrix(tutors, time_slots, availability)
+    capacities = _vacancy_matrix(time_slots, schools, vacancies)
+    if candidate_mask is None:
+        candidate_mask = np.ones((n_tutors, len(schools)), dtype=bool)
+
+    # Vértices de vaga numerados a partir de n_tutors, na ordem (turno, escola)
+    vacancy_slot, vacancy_school = np.nonzero(capacities > 0)
+    vacancy_node = np.full(capacities.shape, -1, dtype=np.intp)
+    vacancy_node[vacancy_slot, vacancy_school] = n_tutors + np.arange(vacancy_slot.size)
+
+    edge_rows = []
+    edge_cols = []
+    for k in range(len(time_slots)):
+        slot_tutors = np.flatnonzero(avail[:, k])
+        slot_schools = np.flatnonzero(capacities[k] > 0)
+        if not slot_tutors.size or not slot_schools.size:
+            continue
+        ii, jj = np.nonzero(candidate_mask[np.ix_(slot_tutors, slot_schools)])
+        edge_rows.append(slot_tutors[ii])
+        edge_cols.append(vacancy_node[k, slot_schools[jj]])
+
+    n_nodes = n_tutors + vacancy_slot.size
+    if edge_rows:
+        edge_rows = np.concatenate(edge_rows)
+        edge_cols = np.concatenate(edge_cols)
+    else:
+        edge_rows = edge_cols = np.zeros(0, dtype=np.intp)
+
+    graph = coo_matrix((np.ones(edge_rows.size, dtype=np.int8), (edge_rows, edge_cols)), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(graph, directed=False)
+
+    tutor_labels = labels[:n_tutors]
+    vacancy_labels = labels[n_tutors:]
+
+    components = []
+    for label in dict.fromkeys(tutor_labels.tolist()):
+        tutor_indices = np.flatnonzero(tutor_labels == label)
+        vacancy_indices = np.flatnonzero(vacancy_labels == label)
+        if vacancy_indices.size:
+            vacancy_keys = [
+                (time_slots[vacancy_slot[v]], schools[vacancy_school[v]]) for v in vacancy_indices
+            ]
+            components.append((tutor_indices, vacancy_keys))
+
+    return components
+
+def _solve_component_batch(task):
+    """
+    Resolve, em um processo do pool, um lote de componentes (um modelo por componente).
+    Precisa estar no nível do módulo para ser serializado pelo ProcessPoolExecutor.
+    """
+    solver_engine, relax_lp, mip_options, time_slots, schools, parts = task
+
+    outputs = []
+    for tutors_c, availability_c, vacancies_c, benefit_c, mask_c in parts:
+        if solver_engine == 'mip':
+            results, stats = solve_mip(
+                tutors_c, time_slots, schools, availability_c, vacancies_c, benefit_c,
+                relax_lp=relax_lp, candidate_mask=mask_c, **mip_options
             )
-        elif status == OptimizationStatus.NO_SOLUTION_FOUND:
-            raise ValueError(
-                "O solver não conseguiu encontrar uma solução no tempo limite. "
-                "Tente simplificar as restrições ou aumentar o tempo máximo."
+        else:
+            results, stats = solve_flow(
+                tutors_c, time_slots, schools, availability_c, vacancies_c, benefit_c,
+                candidate_mask=mask_c
+            )
+        outputs.append((results, stats))
+
+    return outputs
+
+def solve_decomposed(tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                     solver_engine='mip', relax_lp=False, candidate_mask=None, max_workers=None,
+                     time_limit=None, mip_gap=None):
+    """
+    Resolve a alocação dividindo o grafo tutores <-> vagas em componentes conexas
+    independentes, cada uma resolvida como um modelo próprio em um ProcessPoolExecutor.
+
+    As componentes são distribuídas em lotes equilibrados (maiores primeiro) entre os
+    processos, e o resultado é reordenado na mesma ordem das variáveis X do modelo
+    monolítico e passa por 'canonicalize_allocation': a saída é determinística, tem o mesmo
+    valor ótimo e coincide com a do modelo monolítico canonicalizado ('canonicalize=True').
+    'objective_value' e 'objective_bound' são a soma dos valores das componentes, e
+    'solve_path' reúne os caminhos de resolução usados por elas.
+
+    Retorna:
+    - results_list: Lista de alocações no formato de 'extract_allocation_results'
+    - solve_stats: Dicionário com as estatísticas da decomposição e da resolução
+    """
+    start_time = time.perf_counter()
+
+    components = find_components(tutors, time_slots, schools, availability, vacancies, candidate_mask)
+    decompose_time = time.perf_counter() - start_time
+
+    max_workers = max_workers or os.cpu_count() or 1
+    n_batches = max(1, min(max_workers, len(components)))
+
+    # Distribui as componentes (maiores primeiro) no lote com menos tutores até o momento
+    batches = [[] for _ in range(n_batches)]
+    batch_sizes = [0] * n_batches
+    for tutor_indices, vacancy_keys in sorted(components, key=lambda c: -len(c[0])):
+        target = batch_sizes.index(min(batch_sizes))
+        tutors_c = [tutors[i] for i in tutor_indices]
+        component_vacancies = set(vacancy_keys)
+        batches[target].append((
+            tutors_c,
+            {(t, ts): availability.get((t, ts), 0) for t in tutors_c for ts in time_slots},
+            {key: vacancies[key] for key in component_vacancies},
+            benefit_matrix[tutor_indices],
+            None if candidate_mask is None else candidate_mask[tutor_indices]
+        ))
+        batch_sizes[target] += len(tutor_indices)
+
+    mip_options = {"time_limit": time_limit, "mip_gap": mip_gap}
+    tasks = [(solver_engine, relax_lp, mip_options, time_slots, schools, parts) for parts in batches if parts]
+
+    start_time = time.perf_counter()
+    if len(tasks) <= 1:
+        outputs = [_solve_component_batch(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+            outputs = list(executor.map(_solve_component_batch, tasks))
+    solve_time = time.perf_counter() - start_time
+
+    # --- Junção determinística na ordem das variáveis do modelo monolítico ---
+    tutor_index = {t: i for i, t in enumerate(tutors)}
+    slot_index = {ts: k for k, ts in enumerate(time_slots)}
+    school_index = {s: j for j, s in enumerate(schools)}
+
+    keys = []
+    num_variables = 0
+    build_time = 0.0
+    solver_status = 'OPTIMAL'
+    objectives, bounds, solve_paths = [], [], set()
+    for batch_output in outputs:
+        for results, stats in batch_output:
+            num_variables += stats.get('num_variables', 0)
+            build_time += stats.get('build_time', 0.0)
+            objectives.append(stats.get('objective_value'))
+            bounds.append(stats.get('objective_bound'))
+            if stats.get('solve_path'):
+                solve_paths.add(stats['solve_path'])
+            if stats.get('solver_status', 'OPTIMAL') != 'OPTIMAL':
+                solver_status = stats['solver_status']
+            keys.extend(
+                (tutor_index[r['Tutor Alocado']], slot_index[r['Turno da Vaga']], school_index[r['Escola']])
+                for r in results
             )
-        elif status not in (OptimizationStatus.OPTIMAL, OptimizationStatus.FEASIBLE):
+
+    # O ótimo (e o limitante) do modelo inteiro é a soma dos valores das componentes
+    objective = None if None in objectives else float(sum(objectives))
+    bound = None if None in bounds else float(sum(bounds))
+
+    solve_stats = {
+        "num_variables": num_variables,
+        "objective_value": objective,
+        "objective_bound": bound,
+        "gap": _relative_gap(objective, bound) if objective is not None else 0.0,
+        "solve_path": "/".join(sorted(solve_paths)) or solver_engine,
+        "num_components": len(components),
+        "largest_component": max((len(c[0]) for c in components), default=0),
+        "parallel_batches": len(tasks),
+        "solver_status": solver_status,
+        "decompose_time": decompose_time,
+        "build_time": build_time,
+        "solve_time": solve_time
+    }
+
+    results_list = _results_from_keys(keys, tutors, time_slots, schools)
+
+    # Empates entre ótimos das componentes: o mesmo representante canônico do caminho monolítico
+    with instr.span('canonicalize'):
+        results_list, canonical_stats = canonicalize_allocation(
+            results_list, tutors, time_slots, schools, availability, vacancies, benefit_matrix, candidate_mask
+        )
+    solve_stats.update(canonical_stats)
+
+    return results_list, solve_stats
+
+# =============================================================================
+# SESSÃO DE ALOCAÇÃO
+# =============================================================================
+
+# Parâmetros padrão do algoritmo (os mesmos recomendados na página de configurações)
+DEFAULT_PARAMS = {
+    'shift_mode': 'days_shifts',
+    'pref1': 8000,
+    'pref2': 7000,
+    'pref3': 6000,
+    'baseDistance': 5000,
+    'baseRanking': 10**9,
+    'decayType': 'sigmoid',
+    'sigmoidCurve': 2000,
+    'solver_engine': 'mip',
+    'objective_mode': 'weighted',
+    'relax_lp': False,
+    'prune_k': None,
+    'decompose': False,
+    'max_workers': None,
+    'warm_start': False,
+    'time_limit': None,
+    'mip_gap': None,
+    'threads': 1,
+    'canonicalize': None,
+    'profile_memory': False
+}
+
+class AllocationSession:
+    """
+    Sessão persistente de alocação para um mesmo conjunto de arquivos.
+
+    Os CSVs e a matriz de distâncias são lidos uma única vez na criação da sessão. A cada
+    'solve' apenas os benefícios são recalculados; no motor 'mip' (sem poda nem
+    decomposição) o modelo é construído na primeira execução e, nas seguintes, somente a
+    função objetivo é substituída e o CBC parte da solução anterior, que continua viável
+    porque variáveis e restrições não mudam com os parâmetros de pontuação.
+    """
+
+    def __init__(self, tutors_file, schools_file, distances_file, shift_mode='days_shifts'):
+        self.shift_mode = shift_mode
+        self.time_slots = _get_time_slots(shift_mode)
+
+        # --- Carregar Dados ---
+        with instr.span('read.tutors') as read_span:
+            (self.tutors, self.availability, self.preferences, self.rankings,
+             self.tutor_districts, self.total_tutors) = read_tutors(tutors_file, shift_mode)
+            read_span.count(tutors=self.total_tutors)
+        with instr.span('read.schools') as read_span:
+            (self.schools, self.vacancies, self.school_districts,
+             self.total_schools, self.total_vacancies) = read_schools(schools_file, shift_mode)
+            read_span.count(schools=self.total_schools, vacancies=self.total_vacancies)
+
+        # A matriz de distâncias é lida uma única vez e reaproveitada nos cálculos
+        with instr.span('read.distances') as read_span:
+            self.distances = load_distance_matrix(distances_file)
+            read_span.count(schools=len(self.distances.origins))
+        self._prepare()
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """
+        Cria a sessão a partir de um 'dataset.Dataset' já carregado, sem reler os arquivos.
+        Os dados do dataset são compartilhados (não copiados) e nunca são modificados aqui.
+        """
+        session = cls.__new__(cls)
+        session.shift_mode = dataset.shift_mode
+        session.time_slots = dataset.time_slots
+        for name in ('tutors', 'availability', 'preferences', 'rankings', 'tutor_districts',
+                     'total_tutors', 'schools', 'vacancies', 'school_districts',
+                     'total_schools', 'total_vacancies', 'distances'):
+            setattr(session, name, getattr(dataset, name))
+        session._prepare()
+        return session
+
+    def _prepare(self):
+        active_schools = list({s for (slot, s), v in self.vacancies.items() if v > 0})
+        with instr.span('read.distance_mean', active_schools=len(active_schools)):
+            self.distance_mean = calculate_mean_distances(self.distances, active_schools)
+            # Média e maior distância entre as escolas do arquivo, usadas pelos relatórios
+            self.scenario_distance_stats = self.distances.positive_stats(self.schools)
+
+        self._built = None
+        self._last_results = None
+
+    @property
+    def raw_data(self):
+        """Dados puros da instância, no formato esperado pelo módulo de métricas."""
+        return {
+            "tutors": self.tutors,
+            "schools": self.schools,
+            "time_slots": self.time_slots,
+            "vacancies": self.vacancies,
+            "rankings": self.rankings,
+            "preferences": self.preferences,
+            "availability": self.availability,
+            "distances": self.distances,
+            "tutor_districts": self.tutor_districts,
+            "school_districts": self.school_districts
+        }
+
+    def solve(self, params_dict, progress_callback=None):
+        """
+        Executa a otimização com os parâmetros informados (ver 'generate_allocation').
+
+        Retorna um dicionário contendo o DataFrame final, as estatísticas e os dados puros (raw_data).
+        'stats["timings"]' traz a duração (e as contagens) de cada etapa, ver 'instrumentation'.
+        """
+        track_memory = params_dict.get('profile_memory', DEFAULT_PARAMS['profile_memory'])
+        with instr.profile(track_memory=track_memory) as profiler:
+            result = self._solve(params_dict, progress_callback)
+        result['stats']['timings'] = profiler.records()
+        return result
+
+    def _solve(self, params_dict, progress_callback):
+        start_time = time.perf_counter()
+        params = {**DEFAULT_PARAMS, **params_dict}
+
+        if params['shift_mode'] != self.shift_mode:
             raise ValueError(
-                f"O solver retornou status inesperado: {status}. "
-                "Não foi possível gerar uma alocação confiável."
+                f"A sessão foi criada para o modo de turnos '{self.shift_mode}'. "
+                "Crie uma nova sessão para alterar o modo de turnos."
             )
 
-        # --- Extrair e Retornar os Resultados ---
-        results_list = extract_allocation_results(X)
+        tutors, schools, time_slots = self.tutors, self.schools, self.time_slots
+        availability, vacancies = self.availability, self.vacancies
+        preferences, rankings, distances = self.preferences, self.rankings, self.distances
+
+        # --- Extrair Parâmetros de Configuração ---
+        PREF1_SCORE = params['pref1']
+        PREF2_SCORE = params['pref2']
+        PREF3_SCORE = params['pref3']
+        NON_PREF_BASE_SCORE = params['baseDistance']
+        RANKING_MULTIPLIER = params['baseRanking']
+        DISTANCE_DECAY_TYPE = params['decayType']
+        SIGMOID_SCALE = params['sigmoidCurve']
+        SOLVER_ENGINE = params['solver_engine']
+        RELAX_LP = params['relax_lp']
+        PRUNE_K = params['prune_k']
+        DECOMPOSE = params['decompose']
+        MAX_WORKERS = params['max_workers']
+        OBJECTIVE_MODE = params['objective_mode']
+        WARM_START = params['warm_start']
+        TIME_LIMIT = params['time_limit']
+        MIP_GAP = params['mip_gap']
+        THREADS = params['threads']
+        CANONICALIZE = params['canonicalize']
+        DISTANCE_MEAN = self.distance_mean
+
+        if OBJECTIVE_MODE not in ('weighted', 'lexicographic'):
+            raise ValueError(f"Modo de objetivo '{OBJECTIVE_MODE}' desconhecido. Use 'weighted' ou 'lexicographic'.")
+        if SOLVER_ENGINE not in ('mip', 'flow', 'greedy'):
+            raise ValueError(f"Motor de solução '{SOLVER_ENGINE}' desconhecido. Use 'mip', 'flow' ou 'greedy'.")
+
+        prune_stats = {}
+
+        if OBJECTIVE_MODE == 'lexicographic':
+            # --- Prioridade Lexicográfica: apenas a pontuação base, sem multiplicador ---
+            with instr.span('benefits', tutors=len(tutors), schools=len(schools)):
+                base_scores = calculate_base_scores(
+                    tutors, schools, preferences, distances,
+                    decay_type=DISTANCE_DECAY_TYPE,
+                    pref1=PREF1_SCORE,
+                    pref2=PREF2_SCORE,
+                    pref3=PREF3_SCORE,
+                    baseDistance=NON_PREF_BASE_SCORE,
+                    sigmoidCurve=SIGMOID_SCALE,
+                    distance_mean=DISTANCE_MEAN
+                )
+            SOLVER_ENGINE = 'lexicographic'
+            with instr.span('optimize.lexicographic'):
+                results_list, solve_stats = solve_lexicographic(
+                    tutors, time_slots, schools, availability, vacancies, base_scores, rankings
+                )
 
-        if not results_list:
-            df_allocation = pd.DataFrame(columns=['Escola', 'Turno da Vaga', 'Tutor Alocado'])
         else:
-            df_allocation = pd.DataFrame(results_list)
+            # --- Calcular Benefícios ---
+            with instr.span('benefits', tutors=len(tutors), schools=len(schools)):
+                benefit_matrix = calculate_benefit_matrix(
+                    tutors, schools, preferences, distances, rankings,
+                    decay_type=DISTANCE_DECAY_TYPE,
+                    pref1=PREF1_SCORE,
+                    pref2=PREF2_SCORE,
+                    pref3=PREF3_SCORE,
+                    baseDistance=NON_PREF_BASE_SCORE,
+                    baseRanking=RANKING_MULTIPLIER,
+                    sigmoidCurve=SIGMOID_SCALE,
+                    distance_mean=DISTANCE_MEAN
+                )
+
+            # --- Poda de Candidatos (opcional) ---
+            candidate_mask = None
+            if PRUNE_K is not None:
+                with instr.span('prune', k=PRUNE_K):
+                    candidate_mask, prune_stats = prune_candidates(
+                        tutors, time_slots, schools, preferences, distances, availability, vacancies,
+                        benefit_matrix, k=PRUNE_K
+                    )
+
+            # --- Resolver com o Motor Selecionado ---
+            if SOLVER_ENGINE == 'greedy':
+                with instr.span('optimize.greedy'):
+                    results_list, solve_stats = solve_greedy(
+                        tutors, time_slots, schools, availability, vacancies, benefit_matrix, rankings,
+                        candidate_mask=candidate_mask
+                    )
+            elif DECOMPOSE:
+                with instr.span('optimize.decomposed'):
+                    results_list, solve_stats = solve_decomposed(
+                        tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                        solver_engine=SOLVER_ENGINE, relax_lp=RELAX_LP, candidate_mask=candidate_mask,
+                        max_workers=MAX_WORKERS, time_limit=TIME_LIMIT, mip_gap=MIP_GAP
+                    )
+            elif SOLVER_ENGINE == 'mip':
+                # O modelo completo (sem poda) é mantido na sessão entre as execuções
+                reuse_model = candidate_mask is None and self._built is not None
+                start, greedy_stats = None, {}
+                if reuse_model and self._last_results:
+                    start = self._last_results
+                elif WARM_START:
+                    with instr.span('warm_start'):
+                        start, greedy_stats = solve_greedy(
+                            tutors, time_slots, schools, availability, vacancies, benefit_matrix, rankings,
+                            candidate_mask=candidate_mask
+                        )
+
+                if candidate_mask is None and self._built is None:
+                    self._built = build_allocation_model(
+                        tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                        threads=THREADS
+                    )
+
+                results_list, solve_stats = solve_mip(
+                    tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                    relax_lp=RELAX_LP, candidate_mask=candidate_mask, start=start,
+                    time_limit=TIME_LIMIT, mip_gap=MIP_GAP, progress_callback=progress_callback,
+                    threads=THREADS, canonicalize=CANONICALIZE,
+                    built=self._built if candidate_mask is None else None
+                )
+                if candidate_mask is None:
+                    self._last_results = results_list
+                    if not reuse_model:
+                        solve_stats['build_time'] = self._built['build_time']
+                solve_stats['model_reused'] = reuse_model
+                if greedy_stats:
+                    solve_stats['greedy_time'] = greedy_stats['solve_time']
+            else:
+                with instr.span('optimize.flow'):
+                    results_list, solve_stats = solve_flow(
+                        tutors, time_slots, schools, availability, vacancies, benefit_matrix,
+                        candidate_mask=candidate_mask
+                    )
+
+        # --- Extrair e Retornar os Resultados ---
+        with instr.span('dataframe', rows=len(results_list)):
+            if not results_list:
+                df_allocation = pd.DataFrame(columns=['Escola', 'Turno da Vaga', 'Tutor Alocado'])
+            else:
+                df_allocation = pd.DataFrame(results_list)
 
         # --- Cálculo das Estatísticas ---
         stats = {
-            "total_tutors": total_tutors,
-            "total_schools": total_schools,
-            "total_vacancies": total_vacancies,
-            "filled_vacancies": len(results_list)
+            "total_tutors": self.total_tutors,
+            "total_schools": self.total_schools,
+            "total_vacancies": self.total_vacancies,
+            "filled_vacancies": len(results_list),
+            "solver_engine": SOLVER_ENGINE,
+            "objective_mode": OBJECTIVE_MODE,
+            "avg_scenario_distance": self.scenario_distance_stats[0] or 0,
+            "max_scenario_distance": self.scenario_distance_stats[1] or 0,
+            **prune_stats,
+            **solve_stats
         }
+        stats.setdefault("solver_status", "FEASIBLE" if SOLVER_ENGINE == 'greedy' else "OPTIMAL")
+        stats.setdefault("gap", None if SOLVER_ENGINE == 'greedy' else 0.0)
+        stats["elapsed_time"] = time.perf_counter() - start_time
 
         return {
             "dataframe": df_allocation,
             "stats": stats,
-            "raw_data": {
-                "tutors": tutors,
-                "schools": schools,               
-                "time_slots": time_slots,
-                "vacancies": vacancies,
-                "rankings": rankings,
-                "preferences": preferences,
-                "availability": availability,
-                "distances": distances,
-                "tutor_districts": tutor_districts,
-                "school_districts": school_districts
-            }
+            "raw_data": self.raw_data
         }
 
+# =============================================================================
+# FUNÇÃO PRINCIPAL DA OTIMIZAÇÃO
+# =============================================================================
+
+def generate_allocation(tutors_file, schools_file, distances_file, params_dict, progress_callback=None):
+    """
+    Função mestra que executa todo o processo de otimização.
+    
+    Recebe:
+    - tutors_file: O objeto de arquivo CSV dos tutores (ou string de caminho)
+    - schools_file: O objeto de arquivo CSV das escolas (ou string de caminho)
+    - distances_file: O objeto ou caminho do arquivo da matriz de distâncias
+    - params_dict: Um dicionário com todos os parâmetros da página de config
+      * 'solver_engine': 'mip' (padrão, CBC), 'flow' (atribuição exata por fluxo) ou
+        'greedy' (heurística instantânea pela ordem do ranking, sem garantia de ótimo)
+      * 'relax_lp': Se True, o motor 'mip' tenta resolver apenas a relaxação linear
+      * 'prune_k': Se informado, ativa a poda de candidatos com as k escolas mais próximas
+      * 'decompose': Se True, resolve cada componente conexa em paralelo ('max_workers' processos)
+      * 'objective_mode': 'weighted' (padrão, multiplicador de ranking) ou 'lexicographic'
+        (prioridade estrita pelo ranking, ignora 'baseRanking' e os motores acima)
+      * 'warm_start': Se True, o motor 'mip' parte da solução da heurística 'greedy'
+      * 'time_limit' / 'mip_gap': Tempo máximo (s) e gap relativo aceitos pelo motor 'mip'
+      * 'threads': Núcleos do CBC (padrão 1); acima de 1 a solução é canonicalizada
+        ('canonicalize' força ou desativa esse passo)
+      * 'profile_memory': Se True, 'stats["timings"]' inclui o pico de memória de cada etapa
+    - progress_callback: Função opcional que recebe o progresso do CBC (ver 'solve_mip')
+
+    Para várias execuções sobre os mesmos arquivos, use 'AllocationSession', que evita
+    reler os dados e reconstruir o modelo.
+    
+    Retorna:
+    - Um dicionário contendo o DataFrame final, as estatísticas e os dados puros (raw_data)
+    """
+    
+    try:
+        start_time = time.perf_counter()
+
+        # O coletor engloba a leitura dos arquivos e é reaproveitado por 'session.solve'
+        track_memory = params_dict.get('profile_memory', DEFAULT_PARAMS['profile_memory'])
+        with instr.profile(track_memory=track_memory):
+            session = AllocationSession(
+                tutors_file, schools_file, distances_file,
+                shift_mode=params_dict.get('shift_mode', DEFAULT_PARAMS['shift_mode'])
+            )
+            result = session.solve(params_dict, progress_callback=progress_callback)
+
+        result['stats']['elapsed_time'] = time.perf_counter() - start_time
+        return result
+
     except Exception as e:
         raise ValueError(f"Erro ao processar a otimização: {e}")
@@ -1,8 +1,10 @@
-import io
 import streamlit as st
 from PIL import Image
-import optimization as opt
 import metrics as met
+import cache as rc
+import dataset as ds
+import jobs
+import instrumentation as instr
 
 st.set_page_config(
     page_title="Otimização da Alocação de Tutores CODE",
@@ -23,16 +25,93 @@ if 'optimization_result' not in st.session_state:
 if 'saved_config' not in st.session_state:
     st.session_state.saved_config = False
 
-# Evita reprocessamento dos arquivos em cada renderização, se eles não mudarem
-@st.cache_data
-def _get_tutor_count(t_bytes, shift_mode):
-    _, _, _, _, _, n_tutors = opt.read_tutors(io.BytesIO(t_bytes), shift_mode)
-    return n_tutors
-
-@st.cache_data
-def _get_school_stats(s_bytes, shift_mode):
-    _, _, _, n_schools, n_vacancies = opt.read_schools(io.BytesIO(s_bytes), shift_mode)
-    return n_schools, n_vacancies
+# Os arquivos são lidos uma única vez por conteúdo (dataset.py) e reaproveitados pela
+# pré-visualização, pela otimização e pelos relatórios
+def _get_tutor_count(t_file, shift_mode):
+    return ds.load_tutor_data(t_file, shift_mode).total_tutors
+
+def _get_school_stats(s_file, shift_mode):
+    school_data = ds.load_school_data(s_file, shift_mode)
+    return school_data.total_schools, school_data.total_vacancies
+
+def _format_progress(progress):
+    # Resume o último ponto de progresso do solver para exibição abaixo do spinner
+    parts = [f"⏱️ {progress['elapsed']:.0f} s"]
+    if progress.get("objective") is not None:
+        parts.append(f"Melhor solução: {progress['objective']:,.0f}")
+    if progress.get("bound") is not None:
+        parts.append(f"Limitante: {progress['bound']:,.0f}")
+    if progress.get("gap") is not None:
+        parts.append(f"Gap: {progress['gap']:.2%}")
+    if progress.get("objective") is None and progress.get("bound") is None:
+        parts.append("Aguardando o primeiro limitante do solver")
+    return " | ".join(parts)
+
+@st.cache_resource
+def _get_result_cache():
+    # Cache de resultados compartilhado entre as sessões de todos os usuários
+    return rc.ResultCache()
+
+@st.cache_resource
+def _get_job_manager():
+    # Processos de otimização compartilhados entre as sessões de todos os usuários
+    return jobs.JobManager()
+
+def _store_result(result_dict, params):
+    # Guarda o resultado da otimização e as métricas usadas pelas demais páginas
+    with instr.profile() as profiler:
+        report = met.build_report(result_dict, params)
+    result_dict["stats"]["timings"] = result_dict["stats"].get("timings", []) + profiler.records()
+
+    st.session_state.optimization_result = result_dict
+    st.session_state.report = report
+    st.session_state.df_allocation_result = report["allocation"]
+    st.session_state.df_unallocated = report["unallocated"]
+    st.session_state.df_unfilled = report["unfilled_vacancies"]
+    st.session_state.df_detailed = report["detailed"]
+    # Os gráficos são desenhados em segundo plano e só aguardados ao abrir a aba
+    st.session_state.charts_png = report["charts"]
+
+    st.session_state.optimization_done = True
+
+@st.fragment(run_every=1)
+def _job_progress_panel():
+    # Atualiza apenas este trecho da página a cada segundo enquanto o job estiver ativo
+    manager = _get_job_manager()
+    job_id = st.session_state.get("job_id")
+    status = manager.status(job_id)
+
+    if status is not None and status["status"] in (jobs.PENDING, jobs.RUNNING):
+        if status["status"] == jobs.PENDING:
+            st.info(f"⏳ Aguardando na fila... ({status['queued_time']:.0f} s)")
+        else:
+            progress = status["progress"] or {"elapsed": status["elapsed_time"]}
+            st.info(f"⚙️ Otimizando... {_format_progress(progress)}")
+        if st.button("Cancelar otimização", width="stretch"):
+            manager.cancel(job_id)
+        else:
+            return
+
+    # Job encerrado: guarda o resultado e atualiza a página inteira para exibi-lo
+    status = manager.status(job_id)
+    if status is None:
+        st.session_state.job_message = ("error", "A otimização em andamento foi perdida.")
+    elif status["status"] == jobs.DONE:
+        result_dict = manager.result(job_id)
+        if rc.is_cacheable(result_dict):
+            _get_result_cache().put(st.session_state.job_cache_key, result_dict)
+        _store_result(result_dict, st.session_state.job_params)
+        st.session_state.job_message = ("success", "Otimização concluída!")
+    elif status["status"] == jobs.CANCELLED:
+        st.session_state.job_message = ("warning", "Otimização cancelada.")
+    else:
+        st.session_state.job_message = ("error", f"Erro durante a otimização: {status['error']}")
+
+    manager.forget(job_id)
+    st.session_state.job_id = None
+    st.session_state.job_cache_key = None
+    st.session_state.job_params = None
+    st.rerun()
 
 def show_file_stats(t_file, s_file, shift_mode):
     # Exibe estatísticas básicas dos arquivos importados para feedback imediato ao usuário
@@ -40,14 +119,14 @@ def show_file_stats(t_file, s_file, shift_mode):
 
     if s_file:
         try:
-            n_schools, n_vacancies = _get_school_stats(s_file.getvalue(), shift_mode)
+            n_schools, n_vacancies = _get_school_stats(s_file, shift_mode)
             c1.info(f"✅ **{n_schools}** Escolas importadas, com **{n_vacancies}** vagas totais")
         except Exception as e:
             c1.error(f"Erro no arquivo de Escolas: {e}")
 
     if t_file:
         try:
-            n_tutors = _get_tutor_count(t_file.getvalue(), shift_mode)
+            n_tutors = _get_tutor_count(t_file, shift_mode)
             c2.info(f"✅ **{n_tutors}** Tutores importados")
         except Exception as e:
             c2.error(f"Erro no arquivo de Tutores: {e}")
@@ -107,35 +186,44 @@ if st.session_state.current_page == "home":
             if clicou_otimizar:
                 if not st.session_state.get("saved_config", False):
                     st.warning("Por favor, importe os dados e salve as configurações primeiro.")
+                elif st.session_state.get("job_id") is not None:
+                    st.warning("Já existe uma otimização em andamento. Aguarde ou cancele antes de iniciar outra.")
                 else:
                     try:
-                        with st.spinner("Otimizando... Isso pode levar alguns segundos."):
-                            
-                            t_file = st.session_state.tutors_file
-                            s_file = st.session_state.schools_file
-                            params = st.session_state.params
-                            d_file = "distancias.csv" 
-                            
-                            result_dict = opt.generate_allocation(t_file, s_file, d_file, params)
-                            
-                            df_alocacao = result_dict["dataframe"]
-                            raw_data = result_dict["raw_data"]
-                            metricas = met.get_summary_metrics(df_alocacao, raw_data)
-
-                            st.session_state.optimization_result = result_dict
-                            st.session_state.df_allocation_result = df_alocacao
-                            st.session_state.df_unallocated = metricas["unallocated"]
-                            st.session_state.df_unfilled = metricas["unfilled_vacancies"]
-                            
-                            st.session_state.optimization_done = True
-                            
-                        # O success precisa ficar fora do bloco 'with st.spinner' 
-                        # para aparecer no lugar exato do spinner quando ele sumir.
-                        st.success("Otimização concluída!", icon="✅")
+                        t_file = st.session_state.tutors_file
+                        s_file = st.session_state.schools_file
+                        params = st.session_state.params
+                        d_file = "distancias.csv" 
+                        
+                        # Entradas idênticas a uma execução anterior são servidas do cache
+                        cache_key = rc.make_cache_key(t_file, s_file, d_file, params)
+                        result_dict = _get_result_cache().get(cache_key)
+
+                        if result_dict is not None:
+                            _store_result(result_dict, params)
+                            st.success("Otimização concluída!", icon="✅")
+                        else:
+                            # O solver roda em outro processo; a página continua respondendo
+                            st.session_state.job_id = _get_job_manager().submit(t_file, s_file, d_file, params)
+                            st.session_state.job_cache_key = cache_key
+                            st.session_state.job_params = dict(params)
 
                     except Exception as e:
                         st.error(f"Erro durante a otimização: {e}")
 
+            if st.session_state.get("job_id") is not None:
+                _job_progress_panel()
+
+            job_message = st.session_state.pop("job_message", None)
+            if job_message:
+                kind, text = job_message
+                if kind == "success":
+                    st.success(text, icon="✅")
+                elif kind == "warning":
+                    st.warning(text)
+                else:
+                    st.error(text)
+
         # --- EXIBIÇÃO DOS RESULTADOS ---
         if st.session_state.get("optimization_done", False):
 
@@ -173,10 +261,60 @@ if st.session_state.current_page == "home":
 
             m4.metric("Vagas Preenchidas", vagas_ocupadas, delta=delta_msg, delta_color=delta_color)
 
+            gap = stats.get("gap")
+            gap_str = f"{gap:.2%}" if gap is not None else "N/A"
+            st.caption(
+                f"Status do solver: **{stats.get('solver_status', 'N/A')}** | Gap: **{gap_str}** | "
+                f"Tempo total: **{stats.get('elapsed_time', 0):.1f} s**"
+            )
+            if stats.get("solve_path") == "start":
+                st.warning(
+                    "O tempo limite esgotou antes de o solver encontrar uma solução própria: a alocação "
+                    "exibida é a da heurística gulosa (solução inicial), sem limitante e sem garantia de "
+                    "otimalidade. Aumente o tempo máximo ou use 0 (sem limite)."
+                )
+            elif stats.get("solver_status") == "FEASIBLE" and stats.get("solver_engine") != "greedy":
+                st.warning(
+                    f"O solver foi interrompido pelo tempo limite ou pelo gap aceito: a alocação é viável, "
+                    f"mas não comprovadamente ótima (gap {gap_str})."
+                )
+
+            timings = stats.get("timings", [])
+            if timings:
+                with st.expander("⏱️ Tempo por etapa"):
+                    track_memory = any(t["peak_memory_mb"] is not None for t in timings)
+                    rows = []
+                    for t in timings:
+                        row = {
+                            "Etapa": t["stage"],
+                            "Duração (s)": round(t["duration"], 4),
+                            "Contagens": ", ".join(f"{k}={v}" for k, v in t["counts"].items())
+                        }
+                        if track_memory:
+                            row["Pico de memória (MB)"] = t["peak_memory_mb"]
+                        rows.append(row)
+                    st.dataframe(rows, width="stretch", hide_index=True)
+
+                    st.download_button(
+                        label="Exportar tempos (formato Prometheus)",
+                        data=instr.to_prometheus(timings),
+                        file_name="tempos_etapas.prom",
+                        mime="text/plain",
+                    )
+
             st.markdown("---")
             st.markdown("### 📋 Resultados Detalhados")
 
-            aba1, aba2, aba3 = st.tabs(["✅ Alocações", "❌ Não Alocados", "⚠️ Vagas Remanescentes"])
+            # O ZIP (CSVs, relatório em texto e gráficos) só é montado, em memória, ao clicar
+            report = st.session_state.report
+            st.download_button(
+                label="Baixar relatório completo (ZIP)",
+                data=lambda: met.build_report_zip(report=report),
+                file_name="relatorio_alocacao.zip",
+                mime="application/zip",
+            )
+
+            aba1, aba2, aba3, aba4 = st.tabs(["✅ Alocações", "❌ Não Alocados", "⚠️ Vagas Remanescentes", "📈 Gráficos"])
 
             with aba1:
                 allocation = st.session_state.df_allocation_result
@@ -207,6 +345,13 @@ if st.session_state.current_page == "home":
                 else:
                     st.dataframe(df_vagas, width="stretch", hide_index=True)
 
+            with aba4:
+                if st.session_state.df_detailed.empty:
+                    st.info("Nenhuma alocação para exibir nos gráficos.")
+                else:
+                    # PNG gerado em memória (sem gravar em disco) e reaproveitado pelo cache
+                    st.image(st.session_state.charts_png.result(), width="stretch")
+
 # ------------------ CONFIGURAÇÕES ------------------
 if st.session_state.current_page == "config":
 
@@ -243,7 +388,8 @@ if st.session_state.current_page == "config":
             "pref1": 8000, "pref2": 7000, "pref3": 6000,
             "baseDistance": 5000, "baseRanking": 1000000000,
             "decayType": "sigmoid", "sigmoidCurve": 2000,
-            "shift_mode": "days_shifts"
+            "shift_mode": "days_shifts",
+            "time_limit": 0, "mip_gap": 0.0001
         }
         # Recupera parâmetros salvos ou usa os recomendados
         saved = st.session_state.get("params", {})
@@ -300,6 +446,15 @@ if st.session_state.current_page == "config":
         sigmoidCurve = st.number_input("Escala de Inclinação da Curva Sigmoide:", min_value=0,
             value=saved.get("sigmoidCurve", RECOMMENDED["sigmoidCurve"]), icon="📉")
 
+        st.markdown("###### Limites do Solver:")
+
+        time_limit = st.number_input("Tempo Máximo de Otimização (segundos, 0 = sem limite):", min_value=0,
+            value=saved.get("time_limit", RECOMMENDED["time_limit"]), icon="⏱️",
+            help="Com 0 (padrão) o resultado é sempre o ótimo exato. Com um limite, a busca parte da "
+                 "heurística gulosa e pode terminar antes do ótimo; o resultado é sinalizado nesse caso.")
+        mip_gap = st.number_input("Gap Relativo Aceito (%):", min_value=0.0, max_value=100.0, format="%.4f",
+            value=saved.get("mip_gap", RECOMMENDED["mip_gap"]) * 100, icon="🎯")
+
         # Restaura todos os parâmetros para os valores recomendados
         if st.button("Usar configuração recomendada"):
             st.session_state.pop("params", None)
@@ -330,7 +485,11 @@ if st.session_state.current_page == "config":
                         "baseRanking": baseRanking,
                         "decayType": decayType,
                         "sigmoidCurve": sigmoidCurve,
-                        "shift_mode": shift_mode
+                        "shift_mode": shift_mode,
+                        "time_limit": time_limit,
+                        "mip_gap": mip_gap / 100,
+                        # Com tempo limite, a heurística garante uma alocação mesmo sem solução do CBC
+                        "warm_start": time_limit > 0
                     }
 
                     # Salvar flag de sucesso e mudar de página
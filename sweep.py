@@ -0,0 +1,162 @@
+import io
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import optimization as opt
+import metrics as met
+import dataset as ds
+
+# =============================================================================
+# VARREDURA DE PARÂMETROS (CALIBRAÇÃO DA FUNÇÃO OBJETIVO)
+# =============================================================================
+
+# Parâmetros de pontuação usualmente calibrados pela varredura
+SWEEP_PARAMS = ('pref1', 'pref2', 'pref3', 'baseDistance', 'sigmoidCurve', 'decayType')
+
+def make_grid(**values):
+    """
+    Produto cartesiano dos valores informados, ex:
+    make_grid(pref1=[8000, 9000], decayType=['linear', 'sigmoid']) gera 4 pontos.
+    """
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+def sample_points(space, n_points, seed=None):
+    """
+    Amostra aleatória de 'n_points' pontos do espaço de parâmetros. Em 'space', uma lista
+    é sorteada entre os seus elementos e uma tupla (mínimo, máximo) é sorteada de forma
+    uniforme no intervalo (inteiro, se os dois limites forem inteiros).
+    """
+    rng = random.Random(seed)
+    points = []
+    for _ in range(n_points):
+        point = {}
+        for name, domain in space.items():
+            if isinstance(domain, tuple):
+                low, high = domain
+                if isinstance(low, int) and isinstance(high, int):
+                    point[name] = rng.randint(low, high)
+                else:
+                    point[name] = rng.uniform(low, high)
+            else:
+                point[name] = rng.choice(list(domain))
+        points.append(point)
+    return points
+
+def _neighbour_order(points):
+    """
+    Ordena os pontos de forma que pontos vizinhos (mesmo decaimento e valores próximos)
+    sejam resolvidos em sequência, aproveitando melhor a partida a quente.
+    """
+    names = sorted({name for point in points for name in point}, key=lambda n: (n != 'decayType', n))
+
+    def key(index):
+        values = []
+        for name in names:
+            value = points[index].get(name)
+            if isinstance(value, (int, float)):
+                values.append((0, value, ''))
+            else:
+                values.append((1, 0, str(value)))
+        return tuple(values)
+
+    return sorted(range(len(points)), key=key)
+
+def point_kpis(result, params):
+    """
+    KPIs de um ponto da varredura, calculados com as funções do módulo 'metrics':
+    vagas preenchidas, % de 1ª opção, % de polo preferido e distância média das
+    alocações fora das preferências (mesmo critério do histórico).
+    """
+    df_allocation = result['dataframe']
+    raw_data = result['raw_data']
+    stats = result['stats']
+
+    kpis = met.AllocationKPIs(df_allocation, raw_data)
+    preferences_summary = kpis.preferences_summary()
+    first_choice = preferences_summary.loc[preferences_summary['Categoria'] == '1ª Opção', 'Percentual']
+    polo_kpis = kpis.polo_kpis()
+
+    df_detailed = met._generate_detailed_report(df_allocation, raw_data, params, stats=stats, kpis=kpis)
+    dist_non_pref = pd.to_numeric(
+        df_detailed.loc[df_detailed['PrefPos'].isnull(), 'Distância'], errors='coerce'
+    ).replace([np.inf, -np.inf], np.nan).dropna()
+
+    total_vacancies = stats.get('total_vacancies', 0)
+    return {
+        'filled_vacancies': stats.get('filled_vacancies', 0),
+        'fill_rate_pct': stats.get('filled_vacancies', 0) / total_vacancies * 100 if total_vacancies else 0,
+        'pct_pref_1': float(first_choice.iloc[0]) if not first_choice.empty else 0.0,
+        'pct_polo_match': polo_kpis['Percentual_Polo_Preferido'],
+        'avg_distance_non_pref': dist_non_pref.mean() if not dist_non_pref.empty else 0,
+        'total_benefit': df_detailed['Final'].sum() if not df_detailed.empty else 0,
+        'solver_status': stats.get('solver_status', 'N/A')
+    }
+
+def _run_chunk(task):
+    """
+    Resolve um bloco de pontos vizinhos com uma única 'AllocationSession': os arquivos são
+    lidos e o modelo é construído uma vez, e cada ponto troca apenas a função objetivo,
+    partindo da solução do ponto anterior.
+    """
+    tutors_bytes, schools_bytes, distances_bytes, base_params, chunk = task
+    session = opt.AllocationSession(
+        io.BytesIO(tutors_bytes), io.BytesIO(schools_bytes), io.BytesIO(distances_bytes),
+        base_params.get('shift_mode', 'days_shifts')
+    )
+
+    rows = []
+    for index, point in chunk:
+        params = {**opt.DEFAULT_PARAMS, **base_params, **point}
+        start_time = time.perf_counter()
+        result = session.solve(params)
+        solve_time = time.perf_counter() - start_time
+
+        rows.append({
+            'point': index,
+            **point,
+            **point_kpis(result, params),
+            'solve_time': solve_time,
+            'model_reused': result['stats'].get('model_reused', False)
+        })
+    return rows
+
+def run_sweep(tutors_file, schools_file, distances_file, points, base_params=None, max_workers=None):
+    """
+    Executa a otimização para cada ponto (dicionário de parâmetros, ver 'make_grid' e
+    'sample_points') e retorna um DataFrame com uma linha de KPIs por ponto, na ordem
+    recebida (coluna 'point').
+
+    Os pontos são ordenados por vizinhança e divididos em blocos contíguos, um por
+    processo (até 'max_workers', padrão: nº de CPUs). Dentro de cada bloco o modelo é
+    reaproveitado e cada solução serve de partida a quente para o ponto seguinte.
+    'base_params' completa os parâmetros de todos os pontos; o 'shift_mode' deve ser o
+    mesmo para toda a varredura, pois define a estrutura do modelo.
+    """
+    base_params = dict(base_params or {})
+    if any('shift_mode' in point for point in points):
+        raise ValueError("O 'shift_mode' não pode variar na varredura; informe-o em 'base_params'.")
+    if not points:
+        return pd.DataFrame()
+
+    order = _neighbour_order(points)
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(points)))
+    chunks = [
+        [(int(index), points[index]) for index in part]
+        for part in np.array_split(order, workers)
+    ]
+
+    files = (ds.file_bytes(tutors_file), ds.file_bytes(schools_file), ds.file_bytes(distances_file))
+    tasks = [(*files, base_params, chunk) for chunk in chunks]
+
+    if workers == 1:
+        rows = _run_chunk(tasks[0])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = [row for chunk_rows in executor.map(_run_chunk, tasks) for row in chunk_rows]
+
+    return pd.DataFrame(rows).sort_values('point').reset_index(drop=True)
@@ -0,0 +1,180 @@
+import argparse
+import csv
+import io
+import os
+import numpy as np
+import optimization as opt
+
+# =============================================================================
+# GERADOR DE INSTÂNCIAS SINTÉTICAS
+# =============================================================================
+
+_DISTRICT_NAMES = ['Norte', 'Sul', 'Leste', 'Oeste', 'Centro']
+
+# Fator entre a distância em linha reta e a distância percorrida pelas ruas
+_ROAD_FACTOR = 1.3
+
+# Distância (km) a partir da qual o interesse do tutor por uma escola cai pela metade
+_PREFERENCE_HALF_DISTANCE_KM = 4.0
+
+def _district_names(n_districts):
+    if n_districts <= len(_DISTRICT_NAMES):
+        return _DISTRICT_NAMES[:n_districts]
+    return [f"Polo {i + 1}" for i in range(n_districts)]
+
+def _write_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+def generate_instance(n_tutors, n_schools, shift_mode='days_shifts', availability_density=0.3,
+                      preference_concentration=1.0, vacancies_per_tutor=0.8, n_districts=5,
+                      city_size_km=(30.0, 20.0), seed=None):
+    """
+    Gera uma instância sintética no mesmo formato dos CSVs de entrada (tutores, escolas e
+    matriz de distâncias), para testes de escala.
+
+    O modelo imita uma cidade real:
+    - Escolas agrupadas em torno dos centros de 'n_districts' polos; as distâncias são a
+      distância em linha reta (em metros) vezes um fator de ruas
+    - Cada tutor mora em um ponto da cidade e escolhe 3 escolas distintas, com chance
+      proporcional à popularidade da escola e decrescente com a distância
+    - 'preference_concentration' é o expoente da popularidade (lei de Zipf): 0 deixa
+      todas as escolas igualmente populares; valores maiores concentram as preferências
+      em poucas escolas
+    - 'availability_density' é a chance de o tutor estar disponível em cada turno (todo
+      tutor tem ao menos um turno livre)
+    - O total de vagas é 'vacancies_per_tutor' vezes o número de tutores, distribuído
+      entre escolas de tamanhos variados, e cada escola abre cerca de metade dos turnos
+
+    Retorna uma tupla (tutores, escolas, distâncias) com o conteúdo dos CSVs em bytes
+    UTF-8 (use 'io.BytesIO' para passá-los a 'generate_allocation').
+    """
+    if n_tutors < 1 or n_schools < 2:
+        raise ValueError("A instância precisa de ao menos 1 tutor e 2 escolas.")
+    if not 0 < availability_density <= 1:
+        raise ValueError("'availability_density' deve estar no intervalo (0, 1].")
+    if preference_concentration < 0:
+        raise ValueError("'preference_concentration' não pode ser negativo.")
+
+    rng = np.random.default_rng(seed)
+    time_slots = opt._get_time_slots(shift_mode)
+    districts = _district_names(max(1, n_districts))
+    width, height = city_size_km
+
+    # --- Escolas: posição, polo e popularidade ---
+    centers = rng.uniform([0, 0], [width, height], size=(len(districts), 2))
+    school_district = rng.integers(len(districts), size=n_schools)
+    school_xy = centers[school_district] + rng.normal(0, min(width, height) / 8, size=(n_schools, 2))
+    school_xy = np.clip(school_xy, [0, 0], [width, height])
+
+    popularity_rank = rng.permutation(n_schools) + 1
+    log_popularity = -preference_concentration * np.log(popularity_rank)
+
+    digits = len(str(n_schools))
+    school_names = [f"Escola {i + 1:0{digits}d}" for i in range(n_schools)]
+
+    # --- Matriz de distâncias (metros, simétrica, diagonal zero) ---
+    delta = school_xy[:, None, :] - school_xy[None, :, :]
+    distances = np.rint(np.sqrt((delta ** 2).sum(axis=2)) * 1000 * _ROAD_FACTOR).astype(np.int64)
+
+    distances_csv = _write_csv(
+        [''] + school_names,
+        ([name] + row.tolist() for name, row in zip(school_names, distances))
+    )
+    del delta, distances
+
+    # --- Vagas: total proporcional aos tutores, escolas de tamanhos variados ---
+    school_size = rng.lognormal(0, 0.75, size=n_schools)
+    open_slot = rng.random((n_schools, len(time_slots))) < 0.5
+    open_slot[np.arange(n_schools), rng.integers(len(time_slots), size=n_schools)] = True
+    weights = (open_slot * school_size[:, None]).ravel()
+    total_vacancies = max(1, int(round(vacancies_per_tutor * n_tutors)))
+    vacancies = rng.multinomial(total_vacancies, weights / weights.sum()).reshape(n_schools, len(time_slots))
+
+    schools_csv = _write_csv(
+        ['Escola', 'Polo'] + time_slots,
+        ([name, districts[d]] + row.tolist()
+         for name, d, row in zip(school_names, school_district, vacancies))
+    )
+
+    # --- Tutores: disponibilidade, 3 preferências e polos ---
+    availability = rng.random((n_tutors, len(time_slots))) < availability_density
+    no_slot = ~availability.any(axis=1)
+    availability[np.flatnonzero(no_slot), rng.integers(len(time_slots), size=no_slot.sum())] = True
+
+    home_xy = rng.uniform([0, 0], [width, height], size=(n_tutors, 2))
+    home_district = np.argmin(((home_xy[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2), axis=1)
+
+    n_prefs = min(3, n_schools)
+    preferences = np.empty((n_tutors, n_prefs), dtype=np.int64)
+    decay = np.log(2) / _PREFERENCE_HALF_DISTANCE_KM
+    for start in range(0, n_tutors, 1000):    # Em blocos, para limitar a memória
+        stop = min(start + 1000, n_tutors)
+        dist_km = np.sqrt(((home_xy[start:stop, None, :] - school_xy[None, :, :]) ** 2).sum(axis=2))
+        # Sorteio sem reposição proporcional ao peso (truque de Gumbel: top-k de log(peso) + ruído)
+        keys = log_popularity[None, :] - decay * dist_km + rng.gumbel(size=dist_km.shape)
+        top = np.argpartition(-keys, n_prefs - 1, axis=1)[:, :n_prefs]
+        order = np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1)
+        preferences[start:stop] = np.take_along_axis(top, order, axis=1)
+
+    second_district = rng.integers(len(districts), size=n_tutors)
+    has_second = (rng.random(n_tutors) < 0.5) & (second_district != home_district)
+
+    tutor_rows = []
+    for i in range(n_tutors):
+        tutor_polos = [districts[home_district[i]]]
+        if has_second[i]:
+            tutor_polos.append(districts[second_district[i]])
+        prefs = [school_names[s] for s in preferences[i]] + [''] * (3 - n_prefs)
+        tutor_rows.append(
+            [f"T{i + 1}", i + 1] + availability[i].astype(int).tolist() + prefs + [",".join(tutor_polos)]
+        )
+
+    tutors_csv = _write_csv(
+        ['Tutor', 'Ranking'] + time_slots + ['Preferencia1', 'Preferencia2', 'Preferencia3', 'Polos'],
+        tutor_rows
+    )
+
+    return tutors_csv, schools_csv, distances_csv
+
+def write_instance(output_dir, n_tutors, n_schools, **kwargs):
+    """
+    Gera uma instância (ver 'generate_instance') e grava tutores.csv, escolas.csv e
+    distancias.csv em 'output_dir'. Retorna os caminhos dos três arquivos.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    contents = generate_instance(n_tutors, n_schools, **kwargs)
+
+    paths = []
+    for name, content in zip(('tutores.csv', 'escolas.csv', 'distancias.csv'), contents):
+        path = os.path.join(output_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        paths.append(path)
+    return tuple(paths)
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera uma instância sintética (tutores, escolas e distâncias).")
+    parser.add_argument("n_tutors", type=int)
+    parser.add_argument("n_schools", type=int)
+    parser.add_argument("--output", default="instancia_sintetica", help="Pasta de saída")
+    parser.add_argument("--shift-mode", default="days_shifts", choices=["days_shifts", "shifts"])
+    parser.add_argument("--density", type=float, default=0.3, help="Chance de disponibilidade por turno")
+    parser.add_argument("--concentration", type=float, default=1.0, help="Concentração das preferências (Zipf)")
+    parser.add_argument("--vacancies-per-tutor", type=float, default=0.8)
+    parser.add_argument("--districts", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    paths = write_instance(
+        args.output, args.n_tutors, args.n_schools, shift_mode=args.shift_mode,
+        availability_density=args.density, preference_concentration=args.concentration,
+        vacancies_per_tutor=args.vacancies_per_tutor, n_districts=args.districts, seed=args.seed
+    )
+    print("Instância gerada:\n" + "\n".join(paths))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import io
+import os
+import sys
+import pytest
+
+# Os módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import optimization as opt
+import synthetic as syn
+
+@pytest.fixture(scope='session')
+def instance_files():
+    """
+    Instância sintética pequena (CSVs em bytes): 150 tutores e 30 escolas, com poucos
+    turnos livres por tutor para que a decomposição encontre várias componentes.
+    """
+    return syn.generate_instance(150, 30, availability_density=0.02, seed=0)
+
+@pytest.fixture
+def session(instance_files):
+    """Sessão de alocação nova sobre a instância sintética."""
+    return opt.AllocationSession(*(io.BytesIO(content) for content in instance_files))
+
+def benefits_for(session, params_dict):
+    """Matriz de benefícios da sessão com os parâmetros informados (mesma de 'solve')."""
+    params = {**opt.DEFAULT_PARAMS, **params_dict}
+    return opt.calculate_benefit_matrix(
+        session.tutors, session.schools, session.preferences, session.distances, session.rankings,
+        decay_type=params['decayType'],
+        pref1=params['pref1'],
+        pref2=params['pref2'],
+        pref3=params['pref3'],
+        baseDistance=params['baseDistance'],
+        baseRanking=params['baseRanking'],
+        sigmoidCurve=params['sigmoidCurve'],
+        distance_mean=session.distance_mean
+    )
+
+def allocation_value(result, session, benefit_matrix):
+    """Valor exato da alocação de um resultado de 'solve' / 'generate_allocation'."""
+    return opt._allocation_value(
+        result['dataframe'].to_dict('records'), session.tutors, session.schools, benefit_matrix
+    )
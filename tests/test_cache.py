@@ -0,0 +1,62 @@
+import io
+import optimization as opt
+import cache as rc
+
+def _files(instance_files):
+    return [io.BytesIO(content) for content in instance_files]
+
+def test_normalize_params_fills_defaults_and_drops_ignored():
+    normalized = rc.normalize_params({'max_workers': 4, 'profile_memory': True})
+
+    assert normalized == rc.normalize_params({})
+    assert 'max_workers' not in normalized and 'profile_memory' not in normalized
+    assert normalized['pref1'] == opt.DEFAULT_PARAMS['pref1']
+
+def test_normalize_params_integral_floats():
+    assert rc.normalize_params({'pref1': 8000.0}) == rc.normalize_params({'pref1': 8000})
+    assert rc.normalize_params({'pref1': 8000.5})['pref1'] == 8000.5
+
+def test_cache_key(instance_files):
+    key = rc.make_cache_key(*_files(instance_files), {'pref1': 8000})
+
+    assert rc.make_cache_key(*_files(instance_files), {'pref1': 8000.0, 'max_workers': 2}) == key
+    assert rc.make_cache_key(*_files(instance_files), {}) == key
+    assert rc.make_cache_key(*_files(instance_files), {'pref1': 9000}) != key
+
+    tutors, schools, distances = instance_files
+    changed = (tutors + b'\n', schools, distances)
+    assert rc.make_cache_key(*_files(changed), {'pref1': 8000}) != key
+
+def test_cached_generate_allocation_hits(instance_files, tmp_path):
+    cache = rc.ResultCache(cache_dir=str(tmp_path))
+
+    first = rc.cached_generate_allocation(*_files(instance_files), {}, cache)
+    assert 'cache_hit' not in first['stats']
+
+    second = rc.cached_generate_allocation(*_files(instance_files), {'pref1': 8000.0}, cache)
+    assert second['stats']['cache_hit'] == 'memory'
+    assert second['dataframe'].equals(first['dataframe'])
+
+    # Outra instância do cache sobre a mesma pasta encontra o resultado em disco
+    from_disk = rc.cached_generate_allocation(*_files(instance_files), {}, rc.ResultCache(cache_dir=str(tmp_path)))
+    assert from_disk['stats']['cache_hit'] == 'disk'
+
+def test_time_limited_result_is_not_cached(instance_files, tmp_path, monkeypatch):
+    generate_allocation = opt.generate_allocation
+
+    def interrupted(*args, **kwargs):
+        result = generate_allocation(*args, **kwargs)
+        result['stats'].update(solver_status='FEASIBLE', gap=0.01)
+        return result
+
+    monkeypatch.setattr(opt, 'generate_allocation', interrupted)
+    cache = rc.ResultCache(cache_dir=str(tmp_path))
+    params = {'time_limit': 1}
+
+    result = rc.cached_generate_allocation(*_files(instance_files), params, cache)
+
+    assert not rc.is_cacheable(result)
+    assert cache.get(rc.make_cache_key(*_files(instance_files), params)) is None
+
+def test_greedy_result_is_cacheable(session):
+    assert rc.is_cacheable(session.solve({'solver_engine': 'greedy'}))
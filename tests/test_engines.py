@@ -0,0 +1,37 @@
+import pytest
+from conftest import allocation_value, benefits_for
+
+# Motores e caminhos de resolução que devem chegar ao mesmo ótimo do fluxo
+ENGINES = {
+    'mip': {},
+    'relax_lp': {'relax_lp': True},
+    'prune_k': {'prune_k': 3},
+    'decompose': {'decompose': True, 'max_workers': 2},
+    'decompose_flow': {'decompose': True, 'max_workers': 2, 'solver_engine': 'flow'},
+}
+
+@pytest.mark.parametrize('decay_type', ['sigmoid', 'linear'])
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+def test_engines_reach_flow_optimum(session, engine, decay_type):
+    params = {'decayType': decay_type}
+    benefit_matrix = benefits_for(session, params)
+    optimum = allocation_value(session.solve({**params, 'solver_engine': 'flow'}), session, benefit_matrix)
+
+    result = session.solve({**params, **ENGINES[engine]})
+
+    assert result['stats']['solver_status'] == 'OPTIMAL'
+    assert allocation_value(result, session, benefit_matrix) == optimum
+
+def test_decompose_splits_instance(session):
+    result = session.solve({'decompose': True, 'max_workers': 2})
+    assert result['stats']['num_components'] > 1
+
+def test_greedy_is_feasible_lower_bound(session):
+    benefit_matrix = benefits_for(session, {})
+    optimum = allocation_value(session.solve({'solver_engine': 'flow'}), session, benefit_matrix)
+
+    result = session.solve({'solver_engine': 'greedy'})
+
+    assert result['stats']['solver_status'] == 'FEASIBLE'
+    assert allocation_value(result, session, benefit_matrix) <= optimum
+    assert not result['dataframe'].duplicated('Tutor Alocado').any()
@@ -0,0 +1,85 @@
+import os
+import threading
+import pandas as pd
+import pytest
+import history
+import metrics as met
+
+def _row(instance_id, timestamp='2026-01-01 10:00:00', **values):
+    return {
+        'Instance_ID': instance_id,
+        'Timestamp': timestamp,
+        'Shift_Mode': 'days_shifts',
+        'Decay_Type': 'sigmoid',
+        'Allocated': 10,
+        **values
+    }
+
+def test_upsert_replaces_and_export_csv(tmp_path):
+    runs = history.RunHistory(str(tmp_path / history.HISTORY_DB))
+    runs.upsert([_row(1), _row(2)])
+    runs.upsert([_row(1, Allocated=12, Gap=0.0)])    # Substitui a linha e acrescenta uma coluna
+
+    csv_path = runs.export_csv(str(tmp_path / 'saida' / history.HISTORY_CSV))
+    df_csv = pd.read_csv(csv_path)
+
+    assert list(df_csv['Instance_ID']) == [2, 1]    # A linha regravada vai para o fim
+    assert list(df_csv['Allocated']) == [10, 12]
+    assert 'Gap' in df_csv.columns and pd.isna(df_csv['Gap'].iloc[0])
+    assert not [name for name in os.listdir(tmp_path / 'saida') if name.endswith('.tmp')]
+
+def test_upsert_without_key_writes_nothing(tmp_path):
+    runs = history.RunHistory(str(tmp_path / history.HISTORY_DB))
+    with pytest.raises(ValueError):
+        runs.upsert([_row(1), {'Allocated': 3}])
+    assert runs.to_dataframe().empty
+
+def test_runs_filters(tmp_path):
+    runs = history.RunHistory(str(tmp_path / history.HISTORY_DB))
+    runs.upsert([
+        _row(1, '2026-01-01 10:00:00'),
+        _row(2, '2026-02-01 10:00:00', Decay_Type='linear'),
+        _row(3, '2026-03-01 10:00:00'),
+    ])
+
+    assert list(runs.runs(Decay_Type='sigmoid')['Instance_ID']) == ['1', '3']
+    assert list(runs.runs(since='2026-01-15')['Instance_ID']) == ['2', '3']
+    with pytest.raises(ValueError):
+        runs.runs(Unknown_Column=1)
+
+def test_open_history_imports_legacy_csv(tmp_path):
+    pd.DataFrame([_row(7), _row(8)]).to_csv(tmp_path / history.HISTORY_CSV, index=False)
+
+    runs = history.open_history(str(tmp_path))
+
+    assert list(runs.to_dataframe()['Instance_ID']) == ['7', '8']
+
+def test_merge_history_rows_csv_is_opt_in(tmp_path):
+    base_path = str(tmp_path)
+    csv_path = tmp_path / history.HISTORY_CSV
+
+    met.merge_history_rows(base_path, [_row(1)])
+    assert not csv_path.exists()
+
+    met.merge_history_rows(base_path, [_row(2)], export_csv=True)
+    assert list(pd.read_csv(csv_path)['Instance_ID']) == [1, 2]
+
+def test_concurrent_upsert_and_export(tmp_path):
+    base_path = str(tmp_path)
+    errors = []
+
+    def write(instance_id):
+        try:
+            met.merge_history_rows(base_path, [_row(instance_id)], export_csv=True)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    met.export_history_csv(base_path)
+    assert sorted(pd.read_csv(tmp_path / history.HISTORY_CSV)['Instance_ID']) == list(range(6))
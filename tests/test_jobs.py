@@ -0,0 +1,69 @@
+import os
+import time
+import pytest
+import jobs
+import synthetic as syn
+
+# Tempo máximo (s) que os testes esperam por uma mudança de estado dos jobs
+_TIMEOUT = 120
+
+@pytest.fixture
+def manager():
+    manager = jobs.JobManager(max_workers=1)
+    yield manager
+    manager.shutdown()
+
+def _wait(condition):
+    deadline = time.time() + _TIMEOUT
+    while not condition():
+        assert time.time() < deadline, "o job não mudou de estado a tempo"
+        time.sleep(0.1)
+
+def _finished(manager, job_id):
+    _wait(lambda: manager.status(job_id)['status'] in (jobs.DONE, jobs.ERROR, jobs.CANCELLED))
+    return manager.status(job_id)
+
+def _group_alive(pgid):
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+def test_job_result_and_worker_reuse(manager, session, instance_files):
+    first = manager.submit(*instance_files, {})
+    assert _finished(manager, first)['status'] == jobs.DONE
+    assert manager.result(first)['dataframe'].equals(session.solve({})['dataframe'])
+
+    second = manager.submit(*instance_files, {'pref1': 9000})
+    assert _finished(manager, second)['status'] == jobs.DONE
+    assert manager.result(second)['stats']['model_reused']
+
+def test_cancel_running_job_kills_worker(manager, instance_files):
+    large = syn.generate_instance(1500, 150, seed=1)
+    job_id = manager.submit(*large, {})
+    worker = manager._workers[0]
+    # O progresso (com pulsação periódica) só chega depois que o CBC começou
+    _wait(lambda: manager.status(job_id)['progress'] is not None)
+
+    assert manager.cancel(job_id)
+    assert manager.status(job_id)['status'] == jobs.CANCELLED
+    assert not worker.process.is_alive()
+    # Os filhos (CBC) também morrem; o init os recolhe logo em seguida
+    _wait(lambda: not _group_alive(worker.process.pid))
+    assert manager._workers == []
+    assert not manager.cancel(job_id)
+
+    # O próximo job recria o processo
+    next_id = manager.submit(*instance_files, {})
+    assert _finished(manager, next_id)['status'] == jobs.DONE
+
+def test_cancel_pending_job(manager, instance_files):
+    running = manager.submit(*instance_files, {})
+    pending = manager.submit(*instance_files, {'pref1': 9000})
+    assert manager.status(pending)['status'] == jobs.PENDING
+
+    assert manager.cancel(pending)
+    assert _finished(manager, running)['status'] == jobs.DONE
+    assert manager.status(pending)['status'] == jobs.CANCELLED
+    assert manager.result(pending) is None
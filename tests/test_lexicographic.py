@@ -0,0 +1,79 @@
+import io
+import numpy as np
+import pytest
+from mip import Model, xsum, MAXIMIZE, BINARY, CBC, OptimizationStatus
+import optimization as opt
+import synthetic as syn
+
+def _base_scores(session):
+    params = opt.DEFAULT_PARAMS
+    return opt.calculate_base_scores(
+        session.tutors, session.schools, session.preferences, session.distances,
+        decay_type=params['decayType'],
+        pref1=params['pref1'],
+        pref2=params['pref2'],
+        pref3=params['pref3'],
+        baseDistance=params['baseDistance'],
+        sigmoidCurve=params['sigmoidCurve'],
+        distance_mean=session.distance_mean
+    )
+
+def _staged_mip_levels(session, base_scores):
+    """
+    Referência por MIPs em sequência: cada tutor, na ordem do ranking, maximiza a sua
+    pontuação base mantendo (como restrição) os níveis já obtidos pelos anteriores.
+    """
+    tutors, schools, time_slots = session.tutors, session.schools, session.time_slots
+    avail = opt._availability_matrix(tutors, time_slots, session.availability)
+    capacities = opt._vacancy_matrix(time_slots, schools, session.vacancies)
+
+    model = Model(sense=MAXIMIZE, solver_name=CBC)
+    model.verbose = 0
+    terms = {i: [] for i in range(len(tutors))}
+    by_vacancy = {}
+    for i in range(len(tutors)):
+        for k in np.flatnonzero(avail[i]).tolist():
+            for j in np.flatnonzero((capacities[k] > 0) & (base_scores[i] > 0)).tolist():
+                x = model.add_var(var_type=BINARY)
+                terms[i].append((float(base_scores[i, j]), x))
+                by_vacancy.setdefault((k, j), []).append(x)
+    for i, tutor_terms in terms.items():
+        if tutor_terms:
+            model += xsum(x for _, x in tutor_terms) <= 1
+    for (k, j), xs in by_vacancy.items():
+        model += xsum(xs) <= int(capacities[k, j])
+
+    levels = np.zeros(len(tutors))
+    for i in opt._ranking_order(tutors, session.rankings):
+        if not terms[i]:
+            continue
+        expression = xsum(score * x for score, x in terms[i])
+        model.objective = expression
+        assert model.optimize() == OptimizationStatus.OPTIMAL
+        levels[i] = round(model.objective_value)
+        # Pontuações base são inteiras: a folga de 0.5 só absorve a tolerância do CBC
+        model += expression >= levels[i] - 0.5
+    return levels
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_lexicographic_matches_staged_mip(seed):
+    files = syn.generate_instance(30, 6, availability_density=0.3, vacancies_per_tutor=0.5, seed=seed)
+    session = opt.AllocationSession(*(io.BytesIO(content) for content in files))
+    base_scores = _base_scores(session)
+
+    result = session.solve({'objective_mode': 'lexicographic'})
+
+    tutor_index = {t: i for i, t in enumerate(session.tutors)}
+    school_index = {s: j for j, s in enumerate(session.schools)}
+    levels = np.zeros(len(session.tutors))
+    for row in result['dataframe'].to_dict('records'):
+        levels[tutor_index[row['Tutor Alocado']]] = base_scores[
+            tutor_index[row['Tutor Alocado']], school_index[row['Escola']]
+        ]
+    np.testing.assert_array_equal(levels, _staged_mip_levels(session, base_scores))
+
+def test_lexicographic_ignores_ranking_multiplier(session):
+    first = session.solve({'objective_mode': 'lexicographic'})
+    second = session.solve({'objective_mode': 'lexicographic', 'baseRanking': 10})
+
+    assert first['dataframe'].equals(second['dataframe'])
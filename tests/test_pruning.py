@@ -0,0 +1,50 @@
+import numpy as np
+import optimization as opt
+
+SLOT = 'Segunda_Manha'
+
+def _instance():
+    """
+    Três tutores e três escolas com uma vaga cada. T1 e T2 preferem A, T3 prefere B e
+    a escola mais próxima de A é B. Com k=1 a escola C fica fora dos candidatos de T2,
+    mas o ótimo completo aloca T2 em C com um benefício ~1e-7 do maior coeficiente.
+    """
+    tutors = ['T1', 'T2', 'T3']
+    schools = ['A', 'B', 'C']
+    preferences = {'T1': ['A'], 'T2': ['A'], 'T3': ['B']}
+    distances = {
+        (a, b): d for (a, b), d in {
+            ('A', 'A'): 0, ('A', 'B'): 1, ('A', 'C'): 2,
+            ('B', 'A'): 1, ('B', 'B'): 0, ('B', 'C'): 2,
+            ('C', 'A'): 2, ('C', 'B'): 2, ('C', 'C'): 0,
+        }.items()
+    }
+    availability = {(t, SLOT): 1 for t in tutors}
+    vacancies = {(SLOT, s): 1 for s in schools}
+    benefit_matrix = np.array([
+        [8e12, 7e12, 1e6],
+        [6e12, 5e12, 1e6],
+        [4e12, 7e12, 1e6],
+    ])
+    return tutors, schools, preferences, distances, availability, vacancies, benefit_matrix
+
+def test_prune_restores_column_beyond_k_nearest():
+    tutors, schools, preferences, distances, availability, vacancies, benefit_matrix = _instance()
+
+    initial_mask = opt.select_candidate_schools(
+        tutors, schools, preferences, distances, np.ones(len(schools), dtype=bool), k=1
+    )
+    assert not initial_mask[1, 2]    # T2 -> C foi podado
+
+    candidate_mask, prune_stats = opt.prune_candidates(
+        tutors, [SLOT], schools, preferences, distances, availability, vacancies, benefit_matrix, k=1
+    )
+    assert candidate_mask[1, 2]
+    assert prune_stats['prune_restored_pairs'] >= 1
+
+    full, _ = opt.solve_flow(tutors, [SLOT], schools, availability, vacancies, benefit_matrix)
+    pruned, _ = opt.solve_mip(
+        tutors, [SLOT], schools, availability, vacancies, benefit_matrix, candidate_mask=candidate_mask
+    )
+    assert pruned == full
+    assert {'Escola': 'C', 'Turno da Vaga': SLOT, 'Tutor Alocado': 'T2'} in full
@@ -0,0 +1,35 @@
+import io
+import pytest
+import optimization as opt
+from conftest import allocation_value, benefits_for
+
+# Sequência de parâmetros de pontuação aplicada sobre o mesmo modelo
+RESOLVES = [
+    {'pref1': 9000},
+    {'pref1': 9000, 'decayType': 'linear'},
+    {'baseRanking': 1000, 'sigmoidCurve': 500},
+]
+
+def test_resolve_matches_fresh_solve(session, instance_files):
+    session.solve({})
+
+    for params in RESOLVES:
+        result = session.solve(params)
+        fresh = opt.generate_allocation(*(io.BytesIO(content) for content in instance_files), params)
+
+        benefit_matrix = benefits_for(session, params)
+        assert result['stats']['model_reused']
+        assert result['stats']['solver_status'] == 'OPTIMAL'
+        assert allocation_value(result, session, benefit_matrix) == allocation_value(fresh, session, benefit_matrix)
+
+def test_pruned_solve_keeps_session_model(session):
+    session.solve({})
+    pruned = session.solve({'prune_k': 3})
+    resolved = session.solve({'pref1': 9000})
+
+    assert not pruned['stats']['model_reused']
+    assert resolved['stats']['model_reused']
+
+def test_shift_mode_change_requires_new_session(session):
+    with pytest.raises(ValueError):
+        session.solve({'shift_mode': 'shifts'})